@@ -0,0 +1,161 @@
+# Copyright (c) 2021 Linux Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compare the old delete and executemany load of dm.dm_componentdeps with each COMPONENT_LOAD_MODE.
+
+Needs the DeployHub database, configured with the same DB_* variables as the service, and the id
+of a component to load the rows against. Every run happens in a transaction that is rolled back,
+so the component is left as it was.
+
+Two cases are timed: a first load of an SBOM, and a reload of the same SBOM with a few percent of
+the packages changed, which the staged loads turn into a small delta.
+
+    DB_HOST=localhost python benchmarks/component_loading.py <compid> [components] [runs]
+"""
+
+import os
+import random
+import sys
+from time import perf_counter
+
+os.environ.setdefault("VALIDATEUSER_URL", "http://localhost/msapi/validateuser")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402 pylint: disable=C0413
+
+load_modes = ["executemany", "values", "copy"]
+bomformat = "license"
+
+
+def generate_components(compid, count, rng, version_tag):
+    """
+    Generate component tuples shaped like those of a container image SBOM.
+
+    Args:
+        compid (int): id of the component
+        count (int): number of packages
+        rng (Random): random source
+        version_tag (string): added to the version of about one package in twenty to make a changed SBOM
+
+    Returns:
+        list: component tuples.
+    """
+    licenses = ["MIT", "Apache-2.0", "BSD-3-Clause", "GPL-2.0-only", "ISC", "MPL-2.0"]
+    components = []
+    for number in range(count):
+        name = f"package-{number}"
+        version = f"{number % 7}.{number % 13}.{number % 5}"
+        if version_tag and rng.random() < 0.05:
+            version += version_tag
+        license_name = licenses[number % len(licenses)]
+        purl = f"pkg:deb/debian/{name}@{version}?arch=amd64"
+        components.append((compid, name, version, bomformat, license_name, f"https://spdx.org/licenses/{license_name}.html", "", purl, "deb"))
+    return components
+
+
+def legacy_load(cursor, compid, components):
+    """
+    The load save_components_data did before the staged loads: delete everything and insert a statement per row.
+
+    Args:
+        cursor (cursor): cursor to run the load on
+        compid (int): id of the component
+        components (list): component tuples
+
+    Returns:
+        int: rows inserted.
+    """
+    cursor.execute("DELETE from dm.dm_componentdeps where compid=%s and deptype=%s", (compid, bomformat))
+    sqlstmt = f"""
+        INSERT INTO dm.dm_componentdeps({main.componentdeps_columns})
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) ON CONFLICT ON CONSTRAINT dm_componentdeps_pkey DO NOTHING
+    """
+    cursor.executemany(sqlstmt, list(set(components)))
+    return cursor.rowcount
+
+
+def staged_load(cursor, compid, components):
+    """
+    The load save_components_data does now, in the current COMPONENT_LOAD_MODE.
+
+    Args:
+        cursor (cursor): cursor to run the load on
+        compid (int): id of the component
+        components (list): component tuples
+
+    Returns:
+        int: rows inserted.
+    """
+    main.stage_components(cursor, components)
+    return main.apply_components(cursor, compid, bomformat)["added"]
+
+
+def time_load(conn, load, compid, baseline, components):
+    """
+    Time one load in a transaction that is rolled back afterwards.
+
+    Args:
+        conn (connection): psycopg2 connection
+        load (function): legacy_load or staged_load
+        compid (int): id of the component
+        baseline (list): rows already loaded before the timed load, empty for a first load
+        components (list): rows of the timed load
+
+    Returns:
+        list: [seconds, rows inserted].
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE from dm.dm_componentdeps where compid=%s and deptype=%s", (compid, bomformat))
+        if baseline:
+            legacy_load(cursor, compid, baseline)
+
+        started = perf_counter()
+        inserted = load(cursor, compid, components)
+        return [perf_counter() - started, inserted]
+    finally:
+        conn.rollback()
+        cursor.close()
+
+
+def run():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    compid = int(sys.argv[1])
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 8000
+    runs = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+
+    original = generate_components(compid, count, random.Random(42), "")
+    changed = generate_components(compid, count, random.Random(42), "+1")
+    cases = [("first load", [], original), ("reload with changes", original, changed)]
+
+    with main.engine.connect() as connection:
+        conn = connection.connection
+        print(f"{count} components against compid {compid}, best of {runs} runs")
+        for case, baseline, components in cases:
+            print(case)
+            loads = [("delete + executemany", legacy_load, None)] + [(f"staged {mode}", staged_load, mode) for mode in load_modes]
+            for label, load, mode in loads:
+                if mode is not None:
+                    main.component_load_mode = mode
+                timings = [time_load(conn, load, compid, baseline, components) for _ in range(runs)]
+                seconds = min(timing[0] for timing in timings)
+                print(f"  {label:22} {seconds * 1000:9.1f} ms  {timings[0][1]:6} rows inserted")
+
+
+if __name__ == "__main__":
+    run()
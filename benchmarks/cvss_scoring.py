@@ -0,0 +1,143 @@
+# Copyright (c) 2021 Linux Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compare scoring OSV severity vectors on every advisory with the memoized cvss_risklevel.
+
+The vectors come from an OSV dump (the list of vulnerability records osv_standin.py serves) when one
+is given, otherwise from a built in sample of vectors seen in OSV. The workload repeats them with the
+skew of a real sweep, where a few vectors cover most advisories.
+
+    python benchmarks/cvss_scoring.py [osv_vulns.json] [advisories]
+"""
+
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+from time import perf_counter
+
+os.environ.setdefault("VALIDATEUSER_URL", "http://localhost/msapi/validateuser")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402 pylint: disable=C0413
+
+# CVSS v2, v3 and v4 vectors as they appear in OSV severity entries, including one that does not parse
+sample_vectors = [
+    "CVSS:3.1/AV:N/AC:L/PR:N/UI:N/S:U/C:H/I:H/A:H",
+    "CVSS:3.1/AV:N/AC:L/PR:N/UI:N/S:U/C:N/I:N/A:H",
+    "CVSS:3.1/AV:N/AC:L/PR:N/UI:R/S:C/C:L/I:L/A:N",
+    "CVSS:3.1/AV:N/AC:L/PR:N/UI:N/S:U/C:L/I:N/A:N",
+    "CVSS:3.1/AV:N/AC:L/PR:L/UI:N/S:U/C:H/I:H/A:H",
+    "CVSS:3.1/AV:L/AC:L/PR:L/UI:N/S:U/C:H/I:H/A:H",
+    "CVSS:3.1/AV:N/AC:H/PR:N/UI:N/S:U/C:H/I:N/A:N",
+    "CVSS:3.1/AV:N/AC:L/PR:N/UI:R/S:U/C:H/I:H/A:H",
+    "CVSS:3.1/AV:N/AC:H/PR:N/UI:R/S:U/C:H/I:N/A:N",
+    "CVSS:3.0/AV:N/AC:L/PR:N/UI:N/S:U/C:H/I:H/A:H",
+    "CVSS:3.0/AV:N/AC:L/PR:N/UI:N/S:U/C:N/I:N/A:H",
+    "CVSS:4.0/AV:N/AC:L/AT:N/PR:N/UI:N/VC:H/VI:H/VA:H/SC:N/SI:N/SA:N",
+    "CVSS:4.0/AV:N/AC:L/AT:N/PR:N/UI:N/VC:N/VI:N/VA:H/SC:N/SI:N/SA:N",
+    "CVSS:4.0/AV:N/AC:L/AT:N/PR:N/UI:P/VC:N/VI:N/VA:N/SC:L/SI:L/SA:N",
+    "CVSS:4.0/AV:L/AC:L/AT:N/PR:L/UI:N/VC:H/VI:H/VA:H/SC:N/SI:N/SA:N",
+    "AV:N/AC:L/Au:N/C:P/I:P/A:P",
+    "AV:N/AC:M/Au:N/C:N/I:P/A:N",
+    "AV:N/AC:L/Au:N/C:N/I:N/A:P",
+    "CVSS:3.1/AV:X",
+]
+
+
+def load_vectors(filename):
+    """
+    Collect the severity vectors of an OSV dump.
+
+    Args:
+        filename (string): JSON file holding a list of OSV vulnerability records, None for the built in sample
+
+    Returns:
+        list: the vectors, one per severity entry so common vectors repeat.
+    """
+    if filename is None:
+        return sample_vectors
+
+    with open(filename, mode="r", encoding="utf-8") as osv_file:
+        vulns = json.load(osv_file)
+    return [severity["score"] for vuln in vulns for severity in vuln.get("severity", []) if severity.get("score")]
+
+
+def run_uncached(workload):
+    """
+    Score and bucket every advisory from scratch, as the sweep did before the cache.
+
+    Args:
+        workload (list): vectors to score
+
+    Returns:
+        list: the risk levels.
+    """
+    cached_score = main.calculate_cvss_score
+    main.calculate_cvss_score = main.calculate_cvss_score.__wrapped__
+    try:
+        return [main.cvss_risklevel.__wrapped__(vector) for vector in workload]
+    finally:
+        main.calculate_cvss_score = cached_score
+
+
+def run_cached(workload):
+    """
+    Score and bucket every advisory through the memoized cvss_risklevel, starting cold.
+
+    Args:
+        workload (list): vectors to score
+
+    Returns:
+        list: the risk levels.
+    """
+    main.calculate_cvss_score.cache_clear()
+    main.cvss_risklevel.cache_clear()
+    return [main.cvss_risklevel(vector) for vector in workload]
+
+
+def run():
+    filename = sys.argv[1] if len(sys.argv) > 1 else None
+    advisories = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+
+    vectors = load_vectors(filename)
+    rng = random.Random(42)
+    # a few vectors cover most advisories, the same as in the OSV data
+    weights = [1.0 / (rank + 1) for rank in range(len(vectors))]
+    workload = rng.choices(vectors, weights=weights, k=advisories)
+
+    # invalid vectors print an error each time they are scored
+    with contextlib.redirect_stdout(io.StringIO()):
+        started = perf_counter()
+        uncached = run_uncached(workload)
+        uncached_seconds = perf_counter() - started
+
+        started = perf_counter()
+        cached = run_cached(workload)
+        cached_seconds = perf_counter() - started
+
+    assert cached == uncached, "cached risk levels differ from the uncached ones"
+
+    print(f"{advisories} advisories, {len(set(workload))} distinct vectors")
+    print(f"uncached: {uncached_seconds * 1000:10.1f} ms  {uncached_seconds / advisories * 1e6:8.2f} us/advisory")
+    print(f"cached:   {cached_seconds * 1000:10.1f} ms  {cached_seconds / advisories * 1e6:8.2f} us/advisory")
+    print(f"speedup:  {uncached_seconds / cached_seconds:10.1f}x")
+    print(f"cache:    {main.cvss_risklevel.cache_info()}")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,187 @@
+# Copyright (c) 2021 Linux Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compare reparsing every purl and recleaning its names with the memoized parse_purl.
+
+The purl list mixes npm, pypi, maven, golang, cargo and deb packages, with scopes, namespaces and
+qualifiers, and repeats popular packages the way SBOMs across many components do. The old path
+parses with PackageURL.from_string and runs the replace chain of clean_name once for create_compver
+and again for get_component, new_component_version and update_name.
+
+    python benchmarks/purl_parsing.py [purls]
+"""
+
+import os
+import random
+import sys
+from time import perf_counter
+
+from packageurl import PackageURL
+
+os.environ.setdefault("VALIDATEUSER_URL", "http://localhost/msapi/validateuser")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402 pylint: disable=C0413
+
+# clean_name calls per purl after create_compver: get_component, new_component_version and update_name
+downstream_cleans = 3
+
+
+def old_clean_name(name):
+    if name is None:
+        return name
+
+    name = name.replace(".", "_")
+    name = name.replace("-", "_")
+    name = name.replace("/", ".")
+    name = name.replace("+", "_")
+    name = name.replace(":", "_")
+    name = name.replace("~", "_")
+    name = name.replace("(", "")
+    name = name.replace(")", "")
+    name = name.replace("#", "_")
+    name = name.replace("@", "")
+    return name
+
+
+def old_names(purl):
+    """
+    Derive the DeployHub names the way create_compver did before parse_purl.
+
+    Args:
+        purl (string): package url
+
+    Returns:
+        tuple: domain, compname, variant and package, None if the purl is not valid.
+    """
+    try:
+        purl_parts = PackageURL.from_string(purl)
+    except ValueError:
+        return None
+
+    if purl_parts.namespace is None:
+        domain = "GLOBAL.Open Source." + purl_parts.type
+    else:
+        domain = "GLOBAL.Open Source." + purl_parts.type + "." + purl_parts.namespace.replace(".", "_")
+    domain = domain.replace("/", ".").replace("-", "_").replace("+", "_").replace("@", "")
+
+    version = ""
+    if purl_parts.version is None:
+        compname = old_clean_name(purl_parts.name.replace(".", "_"))
+    else:
+        compname = old_clean_name(purl_parts.name.replace(".", "_") + ";" + purl_parts.version)
+        version = old_clean_name(purl_parts.version)
+    package = old_clean_name(purl_parts.name).replace(".", "_")
+
+    for _ in range(downstream_cleans):
+        old_clean_name(compname)
+        old_clean_name(version)
+    return (domain, compname, version, package)
+
+
+def new_names(purl):
+    """
+    Derive the DeployHub names through parse_purl and the cached clean_name.
+
+    Args:
+        purl (string): package url
+
+    Returns:
+        tuple: domain, compname, variant and package, None if the purl is not valid.
+    """
+    record = main.parse_purl(purl)
+    if record is None:
+        return None
+
+    for _ in range(downstream_cleans):
+        main.clean_name(record.compname)
+        main.clean_name(record.variant)
+    return (record.domain, record.compname, record.variant, record.package)
+
+
+def generate_purls(count, rng):
+    """
+    Generate a purl list with the mix and repetition of SBOMs across many components.
+
+    Args:
+        count (int): number of purls
+        rng (Random): random source
+
+    Returns:
+        list: the purls.
+    """
+    words = ["core", "utils", "http", "json", "log", "auth", "crypto", "data", "io", "test", "cli", "web", "async", "yaml", "xml"]
+    packages = []
+    for number in range(15000):
+        name = "-".join(rng.sample(words, 2)) + str(number)
+        kind = number % 6
+        if kind == 0:
+            prefix, qualifiers = "pkg:npm/" + ("%40" + rng.choice(words) + "/" if number % 3 == 0 else ""), ""
+        elif kind == 1:
+            prefix, qualifiers, name = "pkg:pypi/", "", name.replace("-", "_") + ".ext"
+        elif kind == 2:
+            prefix, qualifiers = "pkg:maven/org." + rng.choice(words) + "." + rng.choice(words) + "/", "?type=jar"
+        elif kind == 3:
+            prefix, qualifiers = "pkg:golang/github.com/" + rng.choice(words) + "/" + rng.choice(words) + "/", ""
+        elif kind == 4:
+            prefix, qualifiers, name = "pkg:cargo/", "", name.replace("-", "_")
+        else:
+            prefix, qualifiers = "pkg:deb/debian/", "?arch=amd64&distro=debian-12"
+
+        # each package is pinned at a handful of versions across the SBOMs
+        for _ in range(rng.randint(1, 4)):
+            version = f"{rng.randint(0, 4)}.{rng.randint(0, 12)}.{rng.randint(0, 3)}"
+            if kind == 5:
+                version += f"-{rng.randint(1, 3)}+deb12u1"
+            packages.append(f"{prefix}{name}@{version}{qualifiers}")
+
+    # popular packages show up in most SBOMs, a long tail shows up once or twice
+    weights = [1.0 / (rank + 1) ** 0.9 for rank in range(len(packages))]
+    purls = rng.choices(packages, weights=weights, k=count)
+    purls.append("notapurl")
+    return purls
+
+
+def run():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    purls = generate_purls(count, random.Random(42))
+
+    started = perf_counter()
+    old_results = [old_names(purl) for purl in purls]
+    old_seconds = perf_counter() - started
+
+    main.parse_purl_base.cache_clear()
+    main.clean_name.cache_clear()
+    started = perf_counter()
+    new_results = [new_names(purl) for purl in purls]
+    cold_seconds = perf_counter() - started
+
+    # a second sweep over the same purls only hits the cache
+    started = perf_counter()
+    [new_names(purl) for purl in purls]  # pylint: disable=W0106
+    warm_seconds = perf_counter() - started
+
+    assert new_results == old_results, "parse_purl names differ from the old derivation"
+
+    print(f"{len(purls)} purls, {len(set(purls))} distinct")
+    print(f"reparse:          {old_seconds * 1000:9.1f} ms  {old_seconds / len(purls) * 1e6:7.2f} us/purl")
+    print(f"parse_purl cold:  {cold_seconds * 1000:9.1f} ms  {cold_seconds / len(purls) * 1e6:7.2f} us/purl")
+    print(f"parse_purl warm:  {warm_seconds * 1000:9.1f} ms  {warm_seconds / len(purls) * 1e6:7.2f} us/purl")
+    print(f"speedup cold {old_seconds / cold_seconds:.1f}x, warm {old_seconds / warm_seconds:.1f}x")
+    print(f"purl cache: {main.parse_purl_base.cache_info()}")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,194 @@
+# Copyright (c) 2021 Linux Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compare the memory and lookup time of the safety database index with the raw dict-of-lists.
+
+Uses insecure_full.json when it is given, otherwise a generated database of the same shape where a
+few popular packages carry hundreds of advisories. The report is drawn from the advisories of the
+database plus some unknown ones, and both lookups must give the same CVE names and urls. The
+index matches package names the way PEP 503 does, so the report is also looked up with each name
+respelled, which only the index finds.
+
+    python benchmarks/safety_index.py [insecure_full.json] [report entries]
+"""
+
+import gc
+import json
+import os
+import random
+import sys
+import tracemalloc
+from time import perf_counter
+
+os.environ.setdefault("VALIDATEUSER_URL", "http://localhost/msapi/validateuser")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402 pylint: disable=C0413
+
+
+def generate_db(packages, rng):
+    """
+    Generate a database shaped like insecure_full.json.
+
+    Args:
+        packages (int): number of packages
+        rng (Random): random source
+
+    Returns:
+        string: the database as JSON text.
+    """
+    data = {"$meta": {"advisory": "PyUp.io metadata", "timestamp": 1700000000}}
+    advisory_id = 10000
+    for rank in range(packages):
+        # advisory counts fall off with popularity, the top packages have hundreds
+        count = max(1, int(400 / (rank + 1) ** 0.8))
+        advisories = []
+        for _ in range(count):
+            advisory_id += 1
+            cve = f"CVE-20{rng.randint(10, 24)}-{rng.randint(1000, 99999)}" if rng.random() < 0.8 else f"PVE-2023-{advisory_id}"
+            advisories.append(
+                {
+                    "advisory": "Affected versions are vulnerable to " + " ".join(rng.choices(["remote", "code", "execution", "denial", "of", "service", "via", "crafted", "input"], k=40)),
+                    "cve": cve,
+                    "id": f"pyup.io-{advisory_id}",
+                    "more_info_path": f"/vulnerabilities/{cve}/{advisory_id}/",
+                    "specs": [f"<{rng.randint(1, 9)}.{rng.randint(0, 20)}.{rng.randint(0, 9)}", f">={rng.randint(0, 1)}.0,<1.{rng.randint(0, 9)}"],
+                    "v": f"<{rng.randint(1, 9)}.{rng.randint(0, 20)}",
+                }
+            )
+        data[f"package-{rank}"] = advisories
+    return json.dumps(data)
+
+
+def old_lookup(safety_db, packagename, safety_id):
+    """
+    The list scan the safety endpoint did before the index.
+
+    Args:
+        safety_db (dict): raw database
+        packagename (string): package in the report
+        safety_id (string): advisory number in the report
+
+    Returns:
+        tuple: (cve name, cve url) as written to dm_componentdeps.
+    """
+    cve_name = safety_id
+    cve_url = ""
+    cve_detail = safety_db.get(packagename, None)
+    if cve_detail is not None:
+        for cve in cve_detail:
+            if cve["id"] == "pyup.io-" + safety_id:
+                cve_name = cve["cve"]
+                if cve_name is not None and cve_name.startswith("CVE"):
+                    cve_url = "https://nvd.nist.gov/vuln/detail/" + cve_name
+                break
+    return (cve_name, cve_url)
+
+
+def new_lookup(index, packagename, safety_id):
+    """
+    The indexed lookup the safety endpoint does now.
+
+    Args:
+        index (dict): output of index_safety_db
+        packagename (string): package in the report
+        safety_id (string): advisory number in the report
+
+    Returns:
+        tuple: (cve name, cve url) as written to dm_componentdeps.
+    """
+    cve_name = safety_id
+    cve_url = ""
+    detail = index.get((main.canonical_package_name(packagename), safety_id))
+    if detail is not None:
+        cve_name = detail[0]
+        cve_url = detail[1] or ""
+    return (cve_name, cve_url)
+
+
+def respell(packagename):
+    """
+    Spell a package name differently without changing its PEP 503 name.
+
+    Args:
+        packagename (string): package name
+
+    Returns:
+        string: the name uppercased with "-" changed to "_".
+    """
+    return packagename.upper().replace("-", "_")
+
+
+def run():
+    filename = sys.argv[1] if len(sys.argv) > 1 else None
+    report_size = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    rng = random.Random(42)
+
+    if filename is None:
+        text = generate_db(5000, rng)
+    else:
+        with open(filename, mode="r", encoding="utf-8") as db_file:
+            text = db_file.read()
+
+    gc.collect()
+    tracemalloc.start()
+    safety_db = json.loads(text)
+    raw_bytes = tracemalloc.get_traced_memory()[0]
+
+    started = perf_counter()
+    index = main.index_safety_db(safety_db)
+    build_seconds = perf_counter() - started
+
+    known = [(packagename, advisory["id"][len("pyup.io-") :]) for packagename, advisories in safety_db.items() if packagename != "$meta" for advisory in advisories]
+    report = rng.choices(known, k=report_size) + [(packagename, "0") for packagename, _ in rng.choices(known, k=report_size // 10)]
+
+    tracemalloc.stop()
+
+    # the index keeps only the strings it needs, measure it once the raw database it was built from is freed
+    tracemalloc.start()
+    index_copy = main.index_safety_db(json.loads(text))
+    gc.collect()
+    index_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del index_copy
+
+    started = perf_counter()
+    old_results = [old_lookup(safety_db, packagename, safety_id) for packagename, safety_id in report]
+    old_seconds = perf_counter() - started
+
+    started = perf_counter()
+    new_results = [new_lookup(index, packagename, safety_id) for packagename, safety_id in report]
+    new_seconds = perf_counter() - started
+
+    assert new_results == old_results, "indexed lookups differ from the list scan"
+
+    respelled = [(respell(packagename), safety_id) for packagename, safety_id in report]
+    respelled_found = sum(1 for packagename, safety_id in respelled if old_lookup(safety_db, packagename, safety_id)[0] != safety_id)
+    main.canonical_package_name.cache_clear()
+    started = perf_counter()
+    respelled_results = [new_lookup(index, packagename, safety_id) for packagename, safety_id in respelled]
+    respelled_seconds = perf_counter() - started
+
+    assert respelled_results == old_results, "indexed lookups depend on how the package name is spelled"
+
+    print(f"{len(known)} advisories over {len(safety_db) - 1} packages, report of {len(report)} entries")
+    print(f"dict-of-lists: {raw_bytes / 1048576:8.1f} MiB  lookups {old_seconds * 1000:9.1f} ms")
+    print(f"index:         {index_bytes / 1048576:8.1f} MiB  lookups {new_seconds * 1000:9.1f} ms  (built in {build_seconds * 1000:.1f} ms)")
+    print(f"respelled:     {respelled_found:8} found by the list scan, lookups {respelled_seconds * 1000:9.1f} ms through the index")
+    print(f"lookup speedup {old_seconds / new_seconds:.1f}x, memory {raw_bytes / index_bytes:.1f}x smaller")
+
+
+if __name__ == "__main__":
+    run()
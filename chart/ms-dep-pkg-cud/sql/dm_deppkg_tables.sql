@@ -0,0 +1,25 @@
+-- Bookkeeping tables of ms-dep-pkg-cud, run against the DeployHub database by a user allowed to run DDL.
+-- Keep in step with schema_ddl in main.py, which creates any that are missing when the service user may.
+
+-- scan watermark of each package, delta vulnerability sweeps skip packages scanned within VULN_SCAN_TTL_HOURS
+create table if not exists dm.dm_vulnscan (
+    purl text primary key,
+    lastscan timestamp not null default now()
+);
+
+-- repo and commit resolved for each purl, misses are retried after PURL_NEGATIVE_TTL_HOURS
+create table if not exists dm.dm_purlcommit (
+    purl text primary key,
+    repourl text,
+    commitsha text,
+    resolved timestamp not null default now()
+);
+
+-- checkpoint of the full vulnerability sweep so an interrupted sweep resumes after the last purl it finished
+create table if not exists dm.dm_vulnsweep (
+    sweep text primary key,
+    lastpurl text,
+    started timestamp not null default now(),
+    updated timestamp not null default now(),
+    finished timestamp
+);
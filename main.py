@@ -15,9 +15,13 @@
 # pylint: disable=E0401,E0611
 # pyright: reportMissingImports=false,reportMissingModuleSource=false
 
+import asyncio
+import codecs
+import hashlib
 import json
 import logging
 import os
+import queue
 import re
 import socket
 import subprocess  # nosec B404
@@ -26,20 +30,33 @@ import tempfile
 import threading
 import traceback
 import urllib.parse
+import uuid
 import warnings
+from bisect import bisect_left
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from functools import lru_cache, partial
+from http.cookiejar import DefaultCookiePolicy
 from pprint import pprint
-from time import sleep
+from time import monotonic, perf_counter, sleep
 
+import psycopg2
 import requests
+import urllib3
 import uvicorn
 from cvss import CVSS2, CVSS3, CVSS4
 from defusedxml import ElementTree as ET
 from fastapi import FastAPI, HTTPException, Request, Response, status
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from packageurl import PackageURL
+from psycopg2.extras import execute_values
 from pydantic import BaseModel  # pylint: disable=E0611
+from requests.adapters import HTTPAdapter
 from sqlalchemy import create_engine
-from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.exc import InterfaceError, OperationalError, SQLAlchemyError
 
 # Init Globals
 service_name = "ortelius-ms-dep-pkg-cud"  # pylint: disable=C0103
@@ -62,6 +79,14 @@ tags_metadata = [
         "name": "safety",
         "description": "Python Safety Upload end point",
     },
+    {
+        "name": "status",
+        "description": "Background processing status end point",
+    },
+    {
+        "name": "purl2comp",
+        "description": "Purl to component end points",
+    },
 ]
 
 dhurl = ""
@@ -85,6 +110,18 @@ RestAPI endpoint for adding SBOM data to a component
 ![Discord](https://img.shields.io/discord/722468819091849316)
 """
 
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    """
+    Start the background work when the service starts and stop it on shutdown.
+    """
+    safety_db.start()
+    threading.Thread(target=vuln_sweep.resume, daemon=True).start()
+    yield
+    safety_db.stop()
+
+
 # Init FastAPI
 app = FastAPI(
     title=service_name,
@@ -101,6 +138,7 @@ app = FastAPI(
         "email": "support@ortelius.io",
     },
     openapi_tags=tags_metadata,
+    lifespan=lifespan,
 )
 
 
@@ -140,7 +178,48 @@ db_user = os.getenv("DB_USER", "postgres")
 db_pass = os.getenv("DB_PASS", "postgres")
 db_port = os.getenv("DB_PORT", "5432")
 validateuser_url = os.getenv("VALIDATEUSER_URL", "")
-safety_db = None
+osv_url = os.getenv("OSV_URL", "https://api.osv.dev")
+osv_batch_size = int(os.getenv("OSV_BATCH_SIZE", "1000"))
+vuln_sweep_mode = os.getenv("VULN_SWEEP_MODE", "delta")
+vuln_scan_ttl = int(os.getenv("VULN_SCAN_TTL_HOURS", "24"))
+purl_negative_ttl = int(os.getenv("PURL_NEGATIVE_TTL_HOURS", "24"))
+vuln_queue_size = int(os.getenv("VULN_QUEUE_SIZE", "10000"))
+osv_dedup_cache_size = int(os.getenv("OSV_DEDUP_CACHE_SIZE", "50000"))
+osv_detail_cache_size = int(os.getenv("OSV_DETAIL_CACHE_SIZE", "10000"))
+osv_detail_cache_ttl = float(os.getenv("OSV_DETAIL_CACHE_TTL", "86400"))
+vuln_insert_batch_size = int(os.getenv("VULN_INSERT_BATCH_SIZE", "5000"))
+vuln_commit_interval = float(os.getenv("VULN_COMMIT_INTERVAL", "5"))
+component_load_mode = os.getenv("COMPONENT_LOAD_MODE", "copy")
+component_page_size = int(os.getenv("COMPONENT_PAGE_SIZE", "5000"))
+sbom_chunk_size = int(os.getenv("SBOM_CHUNK_SIZE", "65536"))
+sbom_spool_size = int(os.getenv("SBOM_SPOOL_SIZE", str(8 * 1024 * 1024)))
+ingest_workers = int(os.getenv("INGEST_WORKERS", "8"))
+sweep_workers = int(os.getenv("SWEEP_WORKERS", "8"))
+purl_job_workers = int(os.getenv("PURL_JOB_WORKERS", "4"))
+purl_job_queue_size = int(os.getenv("PURL_JOB_QUEUE_SIZE", "20000"))
+purl_job_ttl = float(os.getenv("PURL_JOB_TTL", "86400"))
+purl_job_store_size = int(os.getenv("PURL_JOB_STORE_SIZE", "1000"))
+db_pool_size = int(os.getenv("DB_POOL_SIZE", str(ingest_workers + sweep_workers + purl_job_workers + 4)))
+db_pool_overflow = int(os.getenv("DB_POOL_OVERFLOW", "10"))
+http_pool_size = int(os.getenv("HTTP_POOL_SIZE", "20"))
+http_pool_hosts = int(os.getenv("HTTP_POOL_HOSTS", "20"))
+validateuser_cache_ttl = float(os.getenv("VALIDATEUSER_CACHE_TTL", "60"))
+validateuser_cache_size = int(os.getenv("VALIDATEUSER_CACHE_SIZE", "1024"))
+breaker_failures = int(os.getenv("BREAKER_FAILURES", "5"))
+breaker_reset_timeout = float(os.getenv("BREAKER_RESET_SECONDS", "60"))
+deferred_purl_limit = int(os.getenv("DEFERRED_PURL_LIMIT", "10000"))
+deferred_purl_retries = int(os.getenv("DEFERRED_PURL_RETRIES", "3"))
+git_timeout = float(os.getenv("GIT_TIMEOUT", "10"))
+git_refs_cache_ttl = float(os.getenv("GIT_REFS_CACHE_TTL", "3600"))
+git_refs_cache_size = int(os.getenv("GIT_REFS_CACHE_SIZE", "1024"))
+component_cache_ttl = float(os.getenv("COMPONENT_CACHE_TTL", "300"))
+component_cache_size = int(os.getenv("COMPONENT_CACHE_SIZE", "10000"))
+safety_db_url = os.getenv("SAFETY_DB_URL", "https://raw.githubusercontent.com/pyupio/safety-db/master/data/insecure_full.json")
+safety_db_snapshot = os.getenv("SAFETY_DB_SNAPSHOT", os.path.join(tempfile.gettempdir(), "insecure_full.json"))
+safety_db_refresh = float(os.getenv("SAFETY_DB_REFRESH_SECONDS", "86400"))
+safety_db_wait = float(os.getenv("SAFETY_DB_WAIT_SECONDS", "30"))
+cvss_cache_size = int(os.getenv("CVSS_CACHE_SIZE", "8192"))
+purl_cache_size = int(os.getenv("PURL_CACHE_SIZE", "100000"))
 
 if len(validateuser_url) == 0:
     validateuser_host = os.getenv("MS_VALIDATE_USER_SERVICE_HOST", "127.0.0.1")
@@ -167,8 +246,92 @@ if len(validateuser_url) == 0:
 engine = create_engine(
     "postgresql+psycopg2://" + db_user + ":" + db_pass + "@" + db_host + ":" + db_port + "/" + db_name,
     pool_pre_ping=True,
+    pool_size=db_pool_size,
+    max_overflow=db_pool_overflow,
 )
 
+# bounded pool for the blocking database and http work done on behalf of async requests
+ingest_executor = ThreadPoolExecutor(max_workers=ingest_workers, thread_name_prefix="ingest")
+
+# bounded pool for enriching packages during the vulnerability sweep
+sweep_executor = ThreadPoolExecutor(max_workers=sweep_workers, thread_name_prefix="sweep")
+
+# bounded pool for the batch purl to component jobs
+purl_job_executor = ThreadPoolExecutor(max_workers=purl_job_workers, thread_name_prefix="purljob")
+
+
+# Tables owned by this microservice. They are created by chart/ms-dep-pkg-cud/sql/dm_deppkg_tables.sql,
+# keep the two in step; ensure_schema only creates the ones that are missing.
+schema_ddl = {
+    "dm.dm_vulnscan": """
+    create table if not exists dm.dm_vulnscan (
+        purl text primary key,
+        lastscan timestamp not null default now()
+    )
+    """,
+    "dm.dm_purlcommit": """
+    create table if not exists dm.dm_purlcommit (
+        purl text primary key,
+        repourl text,
+        commitsha text,
+        resolved timestamp not null default now()
+    )
+    """,
+    "dm.dm_vulnsweep": """
+    create table if not exists dm.dm_vulnsweep (
+        sweep text primary key,
+        lastpurl text,
+        started timestamp not null default now(),
+        updated timestamp not null default now(),
+        finished timestamp
+    )
+    """,
+}
+schema_ready = False  # pylint: disable=C0103
+persistent_caches = True  # pylint: disable=C0103
+schema_lock = threading.Lock()
+
+
+def ensure_schema():
+    """
+    Create the tables used for bookkeeping by this microservice if they are missing.
+
+    If they cannot be created, for example because the database user may not run DDL, the error is
+    logged once and the commit cache, scan watermarks and sweep checkpoints are turned off instead of
+    failing the requests that use them. Lost connections are retried on the next call.
+
+    Returns:
+        boolean: True if the tables can be used.
+    """
+    global schema_ready, persistent_caches  # pylint: disable=W0603
+
+    with schema_lock:
+        if schema_ready or not persistent_caches:
+            return schema_ready
+
+        try:
+            with engine.connect() as connection:
+                conn = connection.connection
+                cursor = conn.cursor()
+                for table, sqlstmt in schema_ddl.items():
+                    cursor.execute("select to_regclass(%s)", (table,))
+                    row = cursor.fetchone()
+                    if row is None or row[0] is None:
+                        print(f"Creating missing table {table}")
+                        cursor.execute(sqlstmt)
+                conn.commit()
+                cursor.close()
+        except (InterfaceError, OperationalError, psycopg2.InterfaceError, psycopg2.OperationalError) as err:
+            print(f"Could not check the bookkeeping tables, will retry: {err}")
+            return False
+        except (psycopg2.Error, SQLAlchemyError) as err:
+            print(f"Could not create the bookkeeping tables, running without the commit cache, scan watermarks and sweep checkpoints: {err}")
+            persistent_caches = False
+            return False
+
+        schema_ready = True
+        return True
+
 
 def is_empty(my_string):
     """
@@ -201,6 +364,785 @@ def is_not_empty(my_string):
     return bool(my_string and my_string.strip())
 
 
+class TTLCache:
+    """
+    Thread-safe bounded LRU cache whose entries expire after a time to live.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """
+        Look up a key.
+
+        Args:
+            key: key to look up
+            default: value returned when the key is missing or expired
+
+        Returns:
+            the cached value or default.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] <= monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return default
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, ttl=None):
+        """
+        Add or replace a key, evicting the least recently used entries when full.
+
+        Args:
+            key: key to store
+            value: value to store
+            ttl (float): time to live in seconds, defaults to the cache ttl
+        """
+        if ttl is None:
+            ttl = self.ttl
+
+        with self.lock:
+            self.entries[key] = (monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def discard(self, key):
+        """
+        Remove a key if it is cached.
+
+        Args:
+            key: key to remove
+        """
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def discard_where(self, predicate):
+        """
+        Remove every key matching a predicate.
+
+        Args:
+            predicate (function): called with each key, returns True to remove it
+        """
+        with self.lock:
+            for key in [key for key in self.entries if predicate(key)]:
+                del self.entries[key]
+
+    def stats(self):
+        """
+        Get the cache counters.
+
+        Returns:
+            dict: size, maxsize, ttl, hits and misses.
+        """
+        with self.lock:
+            return {"size": len(self.entries), "maxsize": self.maxsize, "ttl": self.ttl, "hits": self.hits, "misses": self.misses}
+
+
+class SingleFlight:
+    """
+    Per key locks so only one thread does the work for a key while the others wait for it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.locks = {}
+
+    @contextmanager
+    def hold(self, key):
+        """
+        Hold the lock for a key, the lock is discarded once nobody is waiting on it.
+
+        Args:
+            key: key to lock
+        """
+        with self.lock:
+            entry = self.locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self.lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self.locks[key]
+
+
+class Metrics:
+    """
+    Prometheus counters, histograms and gauges kept in process and rendered in the text exposition format.
+
+    Recording is a dict update under a lock so it can stay on in production. Gauges are read from
+    callbacks when the metrics are scraped.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.types = {}
+        self.buckets = {}
+        self.values = {}
+        self.collectors = []
+
+    def counter(self, name, help_text):
+        """
+        Register a counter.
+
+        Args:
+            name (string): metric name
+            help_text (string): description of the metric
+        """
+        self.types[name] = ("counter", help_text)
+
+    def histogram(self, name, help_text, buckets):
+        """
+        Register a histogram.
+
+        Args:
+            name (string): metric name
+            help_text (string): description of the metric
+            buckets (tuple): upper bounds of the buckets in increasing order
+        """
+        self.types[name] = ("histogram", help_text)
+        self.buckets[name] = tuple(buckets)
+
+    def gauge(self, name, help_text):
+        """
+        Register a gauge whose samples come from a collector.
+
+        Args:
+            name (string): metric name
+            help_text (string): description of the metric
+        """
+        self.types[name] = ("gauge", help_text)
+
+    def collect(self, collector):
+        """
+        Add a callback that returns gauge samples when the metrics are scraped.
+
+        Args:
+            collector (function): returns a list of (name, labels, value) samples
+        """
+        self.collectors.append(collector)
+
+    def inc(self, name, labels, amount=1):
+        """
+        Add to a counter.
+
+        Args:
+            name (string): metric name
+            labels (dict): label values
+            amount (float): amount to add
+        """
+        key = (name, tuple(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        """
+        Record a value in a histogram.
+
+        Args:
+            name (string): metric name
+            labels (dict): label values
+            value (float): observed value
+        """
+        key = (name, tuple(labels.items()))
+        index = bisect_left(self.buckets[name], value)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = [[0] * (len(self.buckets[name]) + 1), 0.0]
+                self.values[key] = entry
+            entry[0][index] += 1
+            entry[1] += value
+
+    @contextmanager
+    def timer(self, name, labels):
+        """
+        Record how long the block takes in a histogram.
+
+        Args:
+            name (string): metric name
+            labels (dict): label values
+        """
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, labels, perf_counter() - started)
+
+    def render(self):
+        """
+        Render every metric in the Prometheus text format.
+
+        Returns:
+            string: the metrics.
+        """
+        samples = {}
+        with self.lock:
+            for (name, labels), value in self.values.items():
+                if isinstance(value, list):
+                    value = [list(value[0]), value[1]]
+                samples.setdefault(name, []).append((labels, value))
+
+        for collector in self.collectors:
+            try:
+                for name, labels, value in collector():
+                    samples.setdefault(name, []).append((tuple(labels.items()), value))
+            except Exception as err:
+                print(f"Metrics collector failed: {err}")
+
+        lines = []
+        for name, (metric_type, help_text) in self.types.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples.get(name, []):
+                if metric_type != "histogram":
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+                    continue
+
+                counts, total = value
+                cumulative = 0
+                for bound, count in zip(self.buckets[name] + ("+Inf",), counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {total}")
+                lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    """
+    Format label pairs for the Prometheus text format.
+
+    Args:
+        labels (tuple): (name, value) pairs
+
+    Returns:
+        string: the labels in braces, empty if there are none.
+    """
+    if len(labels) == 0:
+        return ""
+    pairs = []
+    for label, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{label}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+metrics = Metrics()
+metrics.histogram("http_request_duration_seconds", "Latency of the requests handled by the service per route.", latency_buckets)
+metrics.histogram("upstream_request_duration_seconds", "Latency of outbound calls per upstream.", latency_buckets)
+metrics.counter("upstream_requests_total", "Outbound calls per upstream and outcome.")
+metrics.histogram("db_query_duration_seconds", "Latency of database operations.", latency_buckets)
+metrics.counter("db_rows_inserted_total", "Rows inserted per table.")
+metrics.gauge("vuln_sweep_running", "1 while a vulnerability sweep is running.")
+metrics.gauge("vuln_sweep_queued", "1 while another vulnerability sweep is queued.")
+metrics.gauge("vuln_sweep_processed", "Packages processed by the running vulnerability sweep.")
+metrics.gauge("vuln_sweep_vulns_inserted", "Vulnerabilities inserted by the running vulnerability sweep.")
+metrics.gauge("vuln_sweep_osv_dedup_ratio", "Share of OSV queries saved by deduplication in the running vulnerability sweep.")
+metrics.gauge("vuln_sweep_queue_depth", "Packages waiting in the vulnerability sweep queue.")
+metrics.gauge("purls_deferred", "Purls waiting for their enrichment to be retried after a registry failure.")
+metrics.counter("purl_retries_total", "Retries of deferred purls per outcome.")
+metrics.counter("vuln_sweeps_total", "Vulnerability sweeps finished per status.")
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording the latency of every request by method, route template and status.
+    """
+
+    def __init__(self, asgi_app):
+        self.app = asgi_app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = perf_counter()
+        response_status = [500]
+
+        async def send_status(message):
+            if message["type"] == "http.response.start":
+                response_status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            # the route template keeps the label values bounded, unknown paths share one label
+            route = scope.get("route")
+            metrics.observe(
+                "http_request_duration_seconds",
+                {"method": scope["method"], "route": getattr(route, "path", "unmatched"), "status": str(response_status[0])},
+                perf_counter() - started,
+            )
+
+
+app.add_middleware(MetricsMiddleware)
+
+
+def env_map(name, defaults):
+    """
+    Read a comma separated list of key=value settings from the environment on top of the defaults.
+
+    Args:
+        name (string): name of the environment variable, for example "osv=20,registry=5"
+        defaults (dict): default value for each key
+
+    Returns:
+        dict: the merged settings, values converted to the type of the defaults.
+    """
+    settings = dict(defaults)
+    for item in os.getenv(name, "").split(","):
+        if "=" in item:
+            key, value = item.split("=", 1)
+            key = key.strip()
+            settings[key] = type(defaults.get(key, value))(value.strip())
+    return settings
+
+
+# timeouts in seconds for each kind of outbound call
+http_timeouts = env_map(
+    "HTTP_TIMEOUTS",
+    {
+        "probe": 1.0,
+        "validateuser": 5.0,
+        "deployhub": 300.0,
+        "deployhub_import": 1800.0,
+        "osv": 10.0,
+        "osv_batch": 30.0,
+        "registry": 2.0,
+        "safetydb": 30.0,
+    },
+)
+
+http_stats_lock = threading.Lock()
+http_stats = {}  # type: ignore
+
+
+def count_http(host, field):
+    """
+    Increment a per host connection counter.
+
+    Args:
+        host (string): host the counter is for
+        field (string): requests or connections
+    """
+    with http_stats_lock:
+        counters = http_stats.setdefault(host, {"requests": 0, "connections": 0})
+        counters[field] += 1
+
+
+class CountingHTTPConnection(urllib3.connection.HTTPConnection):
+    """
+    HTTP connection that counts every TCP connect, including reconnects of a pooled connection
+    the server closed.
+    """
+
+    def connect(self):
+        count_http(self.host, "connections")
+        super().connect()
+
+
+class CountingHTTPSConnection(urllib3.connection.HTTPSConnection):
+    """
+    HTTPS connection that counts every TCP connect, including reconnects of a pooled connection
+    the server closed.
+    """
+
+    def connect(self):
+        count_http(self.host, "connections")
+        super().connect()
+
+
+class CountingHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    """
+    HTTP connection pool that counts requests and the connects of its connections.
+    """
+
+    ConnectionCls = CountingHTTPConnection
+
+    def urlopen(self, method, url, *args, **kwargs):  # pylint: disable=W0221
+        count_http(self.host, "requests")
+        return super().urlopen(method, url, *args, **kwargs)
+
+
+class CountingHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+    """
+    HTTPS connection pool that counts requests and the connects of its connections.
+    """
+
+    ConnectionCls = CountingHTTPSConnection
+
+    def urlopen(self, method, url, *args, **kwargs):  # pylint: disable=W0221
+        count_http(self.host, "requests")
+        return super().urlopen(method, url, *args, **kwargs)
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    Transport adapter keeping a keep-alive connection pool per host with connection counting.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": CountingHTTPConnectionPool, "https": CountingHTTPSConnectionPool}
+
+
+def new_http_session():
+    """
+    Create the session shared by all outbound calls.
+
+    Returns:
+        requests.Session: session with pooled adapters that never stores cookies from responses.
+    """
+    session = requests.Session()
+    # cookies belong to the user making the request so never keep them on the shared session
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    adapter = PooledHTTPAdapter(pool_connections=http_pool_hosts, pool_maxsize=http_pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# upstream for the registry hosts, everything else is labelled by the kind of call
+registry_upstreams = {
+    "pypi.org": "pypi",
+    "registry.npmjs.org": "npm",
+    "repo1.maven.org": "maven",
+    "crates.io": "cratesio",
+    "proxy.golang.org": "goproxy",
+    "launchpad.net": "launchpad",
+}
+
+# maximum concurrent calls to each upstream across all threads, the probe and validateuser calls
+# made while handling a request have their own limits so they never queue behind enrichment
+upstream_concurrency = env_map(
+    "UPSTREAM_CONCURRENCY",
+    {
+        "deployhub": 8,
+        "probe": 16,
+        "validateuser": 16,
+        "osv": 8,
+        "pypi": 8,
+        "npm": 8,
+        "maven": 8,
+        "cratesio": 4,
+        "goproxy": 8,
+        "launchpad": 4,
+        "git": 8,
+        "default": 8,
+    },
+)
+upstream_semaphores = {}  # type: ignore
+upstream_semaphores_lock = threading.Lock()
+
+
+def upstream_for(url, kind):
+    """
+    Name the upstream service a call goes to.
+
+    Args:
+        url (string): url being called
+        kind (string): kind of call passed to http_request
+
+    Returns:
+        string: deployhub, osv, pypi, npm, maven, cratesio, goproxy, launchpad or the kind/host for anything else.
+    """
+    if kind in ("deployhub", "deployhub_import"):
+        return "deployhub"
+    if kind in ("osv", "osv_batch"):
+        return "osv"
+    if kind == "registry":
+        host = urllib.parse.urlparse(url).hostname or ""
+        return registry_upstreams.get(host, host)
+    return kind
+
+
+@contextmanager
+def upstream_slot(upstream):
+    """
+    Wait for a free slot under the concurrency limit of an upstream.
+
+    Args:
+        upstream (string): name of the upstream
+    """
+    with upstream_semaphores_lock:
+        semaphore = upstream_semaphores.get(upstream)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(upstream_concurrency.get(upstream, upstream_concurrency["default"]))
+            upstream_semaphores[upstream] = semaphore
+
+    with semaphore:
+        yield
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter, callers wait until a token is available.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a token, sleeping until one is available. A rate of 0 or less means unlimited.
+        """
+        if self.rate <= 0:
+            return
+
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            sleep(wait)
+
+
+class UpstreamUnavailable(Exception):
+    """
+    Raised instead of calling an upstream whose circuit breaker is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for an upstream service.
+
+    After failure_threshold consecutive failures the circuit opens and calls fail fast for
+    reset_timeout seconds, then a single trial call decides whether it closes again.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened = 0.0
+        self.trips = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """
+        Check whether a call may go ahead.
+
+        Returns:
+            boolean: True if the call may be made.
+        """
+        with self.lock:
+            if self.state == "closed":
+                return True
+
+            # a trial call that never reported back does not keep the circuit half open forever
+            if self.state in ("open", "half_open") and monotonic() - self.opened >= self.reset_timeout:
+                self.state = "half_open"
+                self.opened = monotonic()
+                return True
+
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        """
+        Close the circuit after a successful call.
+        """
+        with self.lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def record_failure(self):
+        """
+        Count a failed call, opening the circuit when the threshold is reached or the trial call failed.
+        """
+        with self.lock:
+            self.failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+                if self.state != "open":
+                    self.trips += 1
+                self.state = "open"
+                self.opened = monotonic()
+
+    def status(self):
+        """
+        Get the breaker state.
+
+        Returns:
+            dict: state, consecutive failures, trips, rejected calls and seconds until the next trial call.
+        """
+        with self.lock:
+            retry_in = 0.0
+            if self.state == "open":
+                retry_in = max(self.reset_timeout - (monotonic() - self.opened), 0.0)
+            return {"state": self.state, "failures": self.failures, "trips": self.trips, "rejected": self.rejected, "retry_in": round(retry_in, 1)}
+
+
+# requests per second allowed to each package registry
+registry_rates = env_map(
+    "REGISTRY_RATE_LIMITS",
+    {
+        "pypi": 20.0,
+        "npm": 20.0,
+        "maven": 20.0,
+        "cratesio": 1.0,
+        "goproxy": 20.0,
+        "launchpad": 5.0,
+        "default": 10.0,
+    },
+)
+registry_guards = {}  # type: ignore
+registry_guards_lock = threading.Lock()
+
+
+def registry_guard(upstream):
+    """
+    Get the rate limiter and circuit breaker for a package registry.
+
+    Args:
+        upstream (string): name of the registry
+
+    Returns:
+        list: [TokenBucket, CircuitBreaker].
+    """
+    with registry_guards_lock:
+        guard = registry_guards.get(upstream)
+        if guard is None:
+            rate = float(registry_rates.get(upstream, registry_rates["default"]))
+            guard = [TokenBucket(rate, max(rate, 1.0)), CircuitBreaker(breaker_failures, breaker_reset_timeout)]
+            registry_guards[upstream] = guard
+        return guard
+
+
+def get_registry_status():
+    """
+    Get the rate limit and circuit breaker state of each registry that has been called.
+
+    Returns:
+        dict: breaker state and rate limit per registry.
+    """
+    with registry_guards_lock:
+        guards = dict(registry_guards)
+    return {upstream: dict(breaker.status(), rate=bucket.rate) for upstream, (bucket, breaker) in guards.items()}
+
+
+http_session = new_http_session()
+validateuser_cache = TTLCache(validateuser_cache_size, validateuser_cache_ttl)
+git_refs_cache = TTLCache(git_refs_cache_size, git_refs_cache_ttl)
+component_cache = TTLCache(component_cache_size, component_cache_ttl)
+vuln_detail_cache = TTLCache(osv_detail_cache_size, osv_detail_cache_ttl)
+git_refs_flight = SingleFlight()
+vuln_detail_flight = SingleFlight()
+compver_flight = SingleFlight()
+
+# never let git wait for credentials on a private or missing repository
+git_env = dict(os.environ, GIT_TERMINAL_PROMPT="0")
+
+
+def http_request(method, url, kind, **kwargs):
+    """
+    Make an outbound http call on the shared pooled session.
+
+    Args:
+        method (string): GET, POST or HEAD
+        url (string): url to call
+        kind (string): kind of call, selects the timeout from http_timeouts
+        kwargs: any other arguments for requests
+
+    Returns:
+        requests.Response: the response.
+    """
+    kwargs.setdefault("timeout", http_timeouts[kind])
+    upstream = upstream_for(url, kind)
+
+    started = perf_counter()
+    outcome = "error"
+    try:
+        response = call_upstream(method, url, kind, upstream, kwargs)
+        outcome = f"{response.status_code // 100}xx"
+        return response
+    except UpstreamUnavailable:
+        outcome = "rejected"
+        raise
+    finally:
+        metrics.observe("upstream_request_duration_seconds", {"upstream": upstream}, perf_counter() - started)
+        metrics.inc("upstream_requests_total", {"upstream": upstream, "outcome": outcome})
+
+
+def call_upstream(method, url, kind, upstream, kwargs):
+    """
+    Send an outbound call, applying the rate limit and circuit breaker of package registries.
+
+    Args:
+        method (string): GET, POST or HEAD
+        url (string): url to call
+        kind (string): kind of call passed to http_request
+        upstream (string): name of the upstream service
+        kwargs (dict): arguments for requests
+
+    Returns:
+        requests.Response: the response.
+    """
+    if kind != "registry":
+        with upstream_slot(upstream):
+            return http_session.request(method, url, **kwargs)
+
+    # package registries are rate limited and skipped quickly while they are failing
+    bucket, breaker = registry_guard(upstream)
+    if not breaker.allow():
+        raise UpstreamUnavailable(f"Circuit open for {upstream}")
+
+    bucket.acquire()
+    try:
+        with upstream_slot(upstream):
+            response = http_session.request(method, url, **kwargs)
+    except Exception:
+        breaker.record_failure()
+        raise
+
+    if response.status_code >= 500 or response.status_code == 429:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return response
+
+
+def get_http_stats():
+    """
+    Get the connection reuse counters.
+
+    Returns:
+        dict: requests, new connections and reused connections per host.
+    """
+    with http_stats_lock:
+        return {host: dict(counters, reused=max(counters["requests"] - counters["connections"], 0)) for host, counters in http_stats.items()}
+
+
 def get_json(url, cookies):
     """
     Get URL as json string.
@@ -214,7 +1156,7 @@ def get_json(url, cookies):
 
     """
     try:
-        res = requests.get(url, cookies=cookies, timeout=300)
+        res = http_request("GET", url, "deployhub", cookies=cookies)
         if res is None:
             return None
         if res.status_code == 502:
@@ -258,23 +1200,25 @@ def post_json(url, payload, cookies):
     """
     try:
         if "/import" in url:
-            res = requests.post(
+            res = http_request(
+                "POST",
                 url,
+                "deployhub_import",
                 data=payload,
                 cookies=cookies,
                 headers={"Content-Type": "application/json"},
-                timeout=1800,
             )
         else:
-            res = requests.post(
+            res = http_request(
+                "POST",
                 url,
+                "deployhub",
                 data=payload,
                 cookies=cookies,
                 headers={
                     "Content-Type": "application/json",
                     "host": "console.deployhub.com",
                 },
-                timeout=300,
             )
 
         if res is None:
@@ -357,6 +1301,16 @@ def get_component(dhurl, cookies, compname, compvariant, compversion, id_only, l
     if latest:
         param = param + "&latest=Y"
 
+    # keyed by the component name without variant and version so creating a version can drop every lookup for it,
+    # and by the session because DeployHub only finds the components the user is allowed to see. The latest
+    # version moves whenever a version is created, possibly by another replica, so those lookups are never cached
+    cache_key = None
+    if not latest:
+        cache_key = ("name", dhurl, compname.split(";")[0], cookie_key(cookies), component, param)
+        cached = component_cache.get(cache_key)
+        if cached is not None:
+            return list(cached)
+
     data = get_json(
         dhurl + "/dmadminweb/API/component/?name=" + urllib.parse.quote(component) + param,
         cookies,
@@ -377,11 +1331,28 @@ def get_component(dhurl, cookies, compname, compvariant, compversion, id_only, l
                     name = ver["name"]
                     break
 
+        if cache_key is not None:
+            component_cache.put(cache_key, (compid, name))
         return [compid, name]
 
     return [-1, ""]
 
 
+def forget_component(dhurl, compname, compid=None):
+    """
+    Drop the cached lookups of every session for a component after it was created or renamed.
+
+    Args:
+        dhurl (string): url to the server
+        compname (string): name of the component including domain, the variant and version are ignored
+        compid (int): id of the component whose name changed, optional
+    """
+    base = compname.split(";")[0]
+    component_cache.discard_where(lambda key: key[0] == "name" and key[1] == dhurl and key[2] == base)
+    if compid is not None:
+        component_cache.discard_where(lambda key: key[0] == "id" and key[1] == dhurl and key[2] == compid)
+
+
 def new_component_version(
     dhurl,
     cookies,
@@ -528,6 +1499,7 @@ def new_docker_component(dhurl, cookies, compname, compvariant, compversion, par
 
         update_name(dhurl, cookies, compname, compvariant, compversion, compid)
 
+    forget_component(dhurl, compname)
     new_component_item(dhurl, cookies, compid, "docker", None)
 
     return compid
@@ -581,6 +1553,7 @@ def new_file_component(dhurl, cookies, compname, compvariant, compversion, paren
                 compid = int(result.get("id", "0"))
         update_name(dhurl, cookies, compname, compvariant, compversion, compid)
 
+    forget_component(dhurl, compname)
     new_component_item(dhurl, cookies, compid, "file", component_items)
 
     return compid
@@ -646,6 +1619,11 @@ def new_component_item(dhurl, cookies, compid, kind, component_items):
     return data
 
 
+# each character is only mapped once so "/" still becomes "." after "." becomes "_"
+clean_name_table = str.maketrans({".": "_", "-": "_", "/": ".", "+": "_", ":": "_", "~": "_", "(": "", ")": "", "#": "_", "@": ""})
+
+
+@lru_cache(maxsize=purl_cache_size)
 def clean_name(name):
     """
     Remove periods and dashes from the name.
@@ -659,17 +1637,7 @@ def clean_name(name):
     if name is None:
         return name
 
-    name = name.replace(".", "_")
-    name = name.replace("-", "_")
-    name = name.replace("/", ".")
-    name = name.replace("+", "_")
-    name = name.replace(":", "_")
-    name = name.replace("~", "_")
-    name = name.replace("(", "")
-    name = name.replace(")", "")
-    name = name.replace("#", "_")
-    name = name.replace("@", "")
-    return name
+    return name.translate(clean_name_table)
 
 
 def update_name(dhurl, cookies, compname, compvariant, compversion, compid):
@@ -693,6 +1661,8 @@ def update_name(dhurl, cookies, compname, compvariant, compversion, compid):
         compvariant = compversion
         compversion = None
 
+    forget_component(dhurl, compname, compid)
+
     if "." in compname:
         compname = compname.split(".")[-1]
 
@@ -769,7 +1739,11 @@ def get_component_name(dhurl, cookies, compid):
     Returns:
         string: full name of the component
     """
-    name = ""
+    cache_key = ("id", dhurl, compid, cookie_key(cookies))
+    name = component_cache.get(cache_key, "")
+    if name != "":
+        return name
+
     data = get_json(dhurl + "/dmadminweb/API/component/" + str(compid) + "?idonly=Y", cookies)
 
     if data is None:
@@ -778,6 +1752,7 @@ def get_component_name(dhurl, cookies, compid):
     # FIX: Guard against None to resolve reportOptionalSubscript
     if isinstance(data, dict) and data.get("success"):
         name = data["result"]["domain"] + "." + data["result"]["name"]
+        component_cache.put(cache_key, name)
     return name
 
 
@@ -812,14 +1787,55 @@ def update_component_attrs(dhurl, cookies, compname, compvariant, compversion, a
     return [True, data, dhurl + "/dmadminweb/API/setvar/component/" + str(compid)]
 
 
-def create_compver(dhurl, cookies, purl):
+@dataclass(frozen=True, slots=True)
+class PurlRecord:
+    """
+    A parsed purl with the DeployHub names derived from it.
+    """
+
+    type: str
+    namespace: str | None
+    name: str
+    version: str | None
+    base: str
+    domain: str
+    compname: str
+    package: str
+    variant: str
+
+
+def parse_purl(purl):
+    """
+    Parse a purl once and derive the DeployHub domain and component names for it.
+
+    Args:
+        purl (string): package url
+
+    Returns:
+        PurlRecord: the parsed purl, None if the purl is not valid.
+    """
     if purl is None or purl.strip() == "":
-        return
+        return None
+
+    # qualifiers and subpaths do not change any of the derived names so they are left out of the cache key
+    return parse_purl_base(purl.split("#")[0].split("?")[0])
+
+
+@lru_cache(maxsize=purl_cache_size)
+def parse_purl_base(purl):
+    """
+    Memoized part of parse_purl for a purl without qualifiers or subpath.
+
+    Args:
+        purl (string): package url without qualifiers or subpath
 
+    Returns:
+        PurlRecord: the parsed purl, None if the purl is not valid.
+    """
     try:
         purl_parts = PackageURL.from_string(purl)
     except ValueError:
-        return
+        return None
 
     domain = ""
     if purl_parts.namespace is None:
@@ -839,22 +1855,112 @@ def create_compver(dhurl, cookies, purl):
 
     package = clean_name(purl_parts.name).replace(".", "_")
 
+    # the purl has no qualifiers or subpath by now so its canonical form is the base
+    base = purl_parts.to_string()
+
+    return PurlRecord(
+        type=purl_parts.type,
+        namespace=purl_parts.namespace,
+        name=purl_parts.name,
+        version=purl_parts.version,
+        base=base,
+        domain=domain,
+        compname=compname,
+        package=package,
+        variant=version,
+    )
+
+
+def existing_purls(purls):
+    """
+    Find which purls already have a component, with one query for the whole batch.
+
+    Args:
+        purls (list): package urls
+
+    Returns:
+        set: the purls whose component exists, empty if the lookup failed.
+    """
+    pairs = {}
+    for purl in purls:
+        record = parse_purl(purl)
+        if record is not None:
+            pairs.setdefault((record.domain, record.compname), []).append(purl)
+
+    if len(pairs) == 0:
+        return set()
+
+    found = set()
     try:
         with engine.connect() as connection:
             conn = connection.connection
             cursor = conn.cursor()
+            with metrics.timer("db_query_duration_seconds", {"operation": "existing_purls"}):
+                cursor.execute(
+                    """
+                    select t.domain, t.name from unnest(%s::text[], %s::text[]) as t(domain, name)
+                    where exists (
+                        select 1 from dm.dm_component a, dm.dm_domain b
+                        where a.domainid = b.id and b.fullname = t.domain and a.name = t.name
+                    )
+                    """,
+                    ([pair[0] for pair in pairs], [pair[1] for pair in pairs]),
+                )
+            for row in cursor.fetchall():
+                found.update(pairs.get((row[0], row[1]), []))
+            cursor.close()
+    except Exception as err:
+        print(f"Bulk component lookup failed: {err}")
+        return set()
+    return found
 
-            params = tuple([domain, compname])
-            cursor.execute(
-                "select count(*) from dm.dm_component a, dm.dm_domain b where a.domainid = b.id and b.fullname = %s and a.name = %s",
-                params,
-            )
-
-            count_result = 0
-            row = cursor.fetchone()
-            if row is not None:
-                count_result = row[0]
-            cursor.close
+
+def create_compver(dhurl, cookies, purl, exists=False, record=None):
+    """
+    Create the DeployHub component version for a purl and record its git repo and commit.
+
+    Args:
+        dhurl (string): url to the server
+        cookies (string): cookies from login
+        purl (string): package url
+        exists (boolean): the component was already found by existing_purls
+        record (PurlRecord): the purl already parsed by the caller, optional
+
+    Returns:
+        list: [True, ""] on success, [None, reason] if the package registry is unavailable and the purl
+        should be retried with DeferredPurls, otherwise [False, reason].
+    """
+    if record is None:
+        record = parse_purl(purl)
+    if record is None:
+        return [False, "Invalid purl"]
+
+    domain = record.domain
+    compname = record.compname
+    package = record.package
+    version = record.variant
+
+    try:
+        # versions of the same package share a parent component so only let one worker create them at a time
+        with compver_flight.hold(domain + "." + package):
+            # purls already found by existing_purls skip the lookup
+            count_result = 1 if exists else 0
+            if not exists:
+                with engine.connect() as connection:
+                    conn = connection.connection
+                    cursor = conn.cursor()
+
+                    params = tuple([domain, compname])
+                    with metrics.timer("db_query_duration_seconds", {"operation": "count_component"}):
+                        cursor.execute(
+                            "select count(*) from dm.dm_component a, dm.dm_domain b where a.domainid = b.id and b.fullname = %s and a.name = %s",
+                            params,
+                        )
+
+                    row = cursor.fetchone()
+                    if row is not None:
+                        count_result = row[0]
+                    cursor.close()
 
             if count_result == 0:
                 compvariant = ""
@@ -893,116 +1999,308 @@ def create_compver(dhurl, cookies, purl):
                 compname = domain + "." + package
                 compversion = version
 
-                compid = get_component(dhurl, cookies, compname, compvariant, compversion, True, False)
-
-            compname = get_component_name(dhurl, cookies, compid)
-            compversion = ""
-            compvariant = ""
-
-            print("Creation Done: " + compname)
-            attrs = {}
-            org = ""
-            repo_project = ""
-            gitcommit = None
-            giturl = None
-
-            results = getCommitFromPurl(
-                purl_parts.type,
-                purl_parts.namespace,
-                purl_parts.name,
-                purl_parts.version,
-                purl,
-            )
+                compid = get_component(dhurl, cookies, compname, compvariant, compversion, True, False)[0]
 
-            giturl = results.get("repo_url", None)
-            gitcommit = results.get("commit_sha", None)
-
-            print(f"Purl: {purl}, Url: {giturl}, Commit: {gitcommit}")
-            if gitcommit is not None:
-                attrs["GitCommit"] = gitcommit
-
-            if giturl is not None and giturl != "":
-                giturl = giturl.replace(".git", "")
-                path_segments = giturl.strip("/").replace("https://", "").replace("http://", "").split("/")
-                # Extract org and repo from the path segments
-                if len(path_segments) >= 3:
-                    org = path_segments[1]
-                    repo_project = path_segments[2]
-
-                attrs["Purl"] = purl
-                attrs["GitUrl"] = giturl
-                attrs["GitOrg"] = org
-                attrs["GitRepo"] = org + "/" + repo_project
-                attrs["GitRepoProject"] = repo_project
-                if purl_parts.version is not None:
-                    attrs["GitTag"] = purl_parts.version
-
-                data = update_component_attrs(dhurl, cookies, compname, compvariant, compversion, attrs)
-                print("Attribute Update Done")
-                return
+        if compid is None or compid < 1:
+            return [False, "Component could not be created"]
+
+        compname = get_component_name(dhurl, cookies, compid)
+        compversion = ""
+        compvariant = ""
+
+        print("Creation Done: " + compname)
+        attrs = {}
+        org = ""
+        repo_project = ""
+        gitcommit = None
+        giturl = None
+
+        results = get_commit_from_purl_cached(record, purl)
+
+        giturl = results.get("repo_url", None)
+        gitcommit = results.get("commit_sha", None)
+
+        print(f"Purl: {purl}, Url: {giturl}, Commit: {gitcommit}")
+        if gitcommit is not None:
+            attrs["GitCommit"] = gitcommit
+
+        if giturl is not None and giturl != "":
+            giturl = giturl.replace(".git", "")
+            path_segments = giturl.strip("/").replace("https://", "").replace("http://", "").split("/")
+            # Extract org and repo from the path segments
+            if len(path_segments) >= 3:
+                org = path_segments[1]
+                repo_project = path_segments[2]
+
+            attrs["Purl"] = purl
+            attrs["GitUrl"] = giturl
+            attrs["GitOrg"] = org
+            attrs["GitRepo"] = org + "/" + repo_project
+            attrs["GitRepoProject"] = repo_project
+            if record.version is not None:
+                attrs["GitTag"] = record.version
+
+            data = update_component_attrs(dhurl, cookies, compname, compvariant, compversion, attrs)
+            if data is not None and not data[0]:
+                return [False, data[1]]
+            print("Attribute Update Done")
+        return [True, ""]
+    except UpstreamUnavailable as err:
+        print(f"Deferring {purl}: {err}")
+        return [None, str(err)]
     except Exception as err:
         print(str(err))
-        return
+        return [False, str(err)]
 
 
-def get_commit_sha(repo_url, package_version):
-    if repo_url is None:
-        return None
+class DeferredPurls:
+    """
+    Purls whose enrichment was skipped because a package registry was unavailable.
 
-    cwd = os.getcwd()
+    They are retried through create_compver once the circuit breaker has had time to reset, with
+    the DeployHub url and session of the request that submitted them. A purl that is deferred
+    again is kept for up to DEFERRED_PURL_RETRIES retries before it is given up on.
+    """
 
-    # Create a temporary directory
-    with tempfile.TemporaryDirectory() as temp_dir:
-        repo_url = repo_url.replace("http://github.com", "https://github.com")
-        repo_url = repo_url.replace("git://github.com", "https://github.com")
-        repo_url = repo_url.replace("git+https://", "https://github.com")
-        repo_url = repo_url.replace("git+ssh://git@", "https://")
-        repo_url = repo_url.replace("git+", "")
+    def __init__(self, limit, retries):
+        self.lock = threading.Lock()
+        self.limit = limit
+        self.retries = retries
+        self.pending = {}
+        self.retry_timer = None
+        self.retried = 0
+        self.dropped = 0
+
+    def defer(self, purl_dhurl, purl_cookies, purl, record=None, callback=None):
+        """
+        Keep a purl to be retried once the registry that failed it has had time to recover.
+
+        Args:
+            purl_dhurl (string): url to the server the purl was submitted to
+            purl_cookies (dict): cookies of the user that submitted the purl
+            purl (string): purl whose enrichment was skipped
+            record (PurlRecord): the parsed purl, optional
+            callback (function): called with the purl, created and error once the purl is retried for the last time, optional
+
+        Returns:
+            boolean: True if the purl will be retried, False if too many purls are deferred already.
+        """
+        entry = {
+            "dhurl": purl_dhurl,
+            "cookies": dict(purl_cookies),
+            "record": record,
+            "callbacks": [callback] if callback is not None else [],
+            "attempts": 0,
+        }
+        return self.add(purl, entry)
+
+    def add(self, purl, entry):
+        """
+        Queue a purl for the next retry, starting the retry timer if it is not running.
+
+        Args:
+            purl (string): purl to retry
+            entry (dict): dhurl, cookies, record, callbacks and attempts of the purl
+
+        Returns:
+            boolean: True if the purl will be retried, False if too many purls are deferred already.
+        """
+        with self.lock:
+            pending = self.pending.get(purl)
+            if pending is not None:
+                # the same purl from another caller is retried once and reported to both
+                pending["callbacks"].extend(entry["callbacks"])
+                return True
+
+            if len(self.pending) >= self.limit:
+                self.dropped += 1
+                return False
+
+            self.pending[purl] = entry
+            if self.retry_timer is None:
+                self.retry_timer = threading.Timer(breaker_reset_timeout, self.retry)
+                self.retry_timer.daemon = True
+                self.retry_timer.start()
+        return True
+
+    def retry(self):
+        """
+        Retry every deferred purl on the enrichment pool.
+        """
+        with self.lock:
+            self.retry_timer = None
+            pending = self.pending
+            self.pending = {}
+
+        for purl, entry in pending.items():
+            sweep_executor.submit(self.retry_purl, purl, entry)
+
+    def retry_purl(self, purl, entry):
+        """
+        Retry one deferred purl, deferring it again while the registry is still unavailable.
+
+        Args:
+            purl (string): purl to retry
+            entry (dict): dhurl, cookies, record, callbacks and attempts the purl was deferred with
+        """
+        try:
+            created, error = create_compver(entry["dhurl"], entry["cookies"], purl, False, entry["record"])
+        except Exception as err:
+            created, error = False, str(err)
 
-        # Clone the repository without checking out the files
-        # print(f"Clone {repo_url}")
+        attempts = entry["attempts"] + 1
+        with self.lock:
+            self.retried += 1
+        metrics.inc("purl_retries_total", {"outcome": "deferred" if created is None else "done" if created else "failed"})
 
-        try:
-            subprocess.run(
-                ["git", "clone", repo_url, "--no-checkout", temp_dir],
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-                timeout=5,
-            )  # nosec B602, B603, B607
-        except subprocess.TimeoutExpired:
-            os.chdir(cwd)
-            return None
+        if created is None:
+            if attempts < self.retries and self.add(purl, dict(entry, attempts=attempts)):
+                return
+            created, error = False, f"Gave up after {attempts} retries: {error}"
 
-        # Change into the cloned repository directory
-        os.chdir(temp_dir)
+        for callback in entry["callbacks"]:
+            callback(purl, created, error)
 
-        if not os.path.exists(".git"):
-            os.chdir(cwd)
-            return None
+    def status(self):
+        """
+        Get the deferred purl counters.
 
-        commit_sha = None
-        try:
-            commit_sha = subprocess.check_output(
-                ["git", "rev-list", "-n", "1", package_version],
+        Returns:
+            dict: purls waiting, retries made and purls dropped because too many were deferred.
+        """
+        with self.lock:
+            return {"pending": len(self.pending), "retried": self.retried, "dropped": self.dropped}
+
+    def metrics_samples(self):
+        """
+        Get the number of deferred purls as a gauge sample for the metrics endpoint.
+
+        Returns:
+            list: (name, labels, value) samples.
+        """
+        with self.lock:
+            return [("purls_deferred", {}, len(self.pending))]
+
+
+deferred_purls = DeferredPurls(deferred_purl_limit, deferred_purl_retries)
+metrics.collect(deferred_purls.metrics_samples)
+
+
+def normalize_repo_url(repo_url):
+    """
+    Rewrite the repo url forms found in package metadata to something git can fetch anonymously.
+
+    Args:
+        repo_url (string): repo url from the package metadata
+
+    Returns:
+        string: the rewritten url.
+    """
+    repo_url = repo_url.replace("http://github.com", "https://github.com")
+    repo_url = repo_url.replace("git://github.com", "https://github.com")
+    repo_url = repo_url.replace("git+https://", "https://github.com")
+    repo_url = repo_url.replace("git+ssh://git@", "https://")
+    repo_url = repo_url.replace("git+", "")
+    return repo_url
+
+
+def get_remote_tags(repo_url):
+    """
+    Get the tags of a remote repository without cloning it.
+
+    The ref list is cached per repo url so resolving many versions of a package costs one call.
+
+    Args:
+        repo_url (string): url of the repository
+
+    Returns:
+        dict: tag name to commit sha, annotated tags are peeled to the commit they point at.
+    """
+    tags = git_refs_cache.get(repo_url)
+    if tags is not None:
+        return tags
+
+    # concurrent lookups for the same repo wait for the first one instead of repeating it
+    with git_refs_flight.hold(repo_url):
+        tags = git_refs_cache.get(repo_url)
+        if tags is not None:
+            return tags
+        return list_remote_tags(repo_url)
+
+
+def list_remote_tags(repo_url):
+    """
+    Run git ls-remote for the tags of a repository and cache the result.
+
+    git runs in its own empty working directory so it never depends on, or changes, the
+    working directory of the process and never picks up the config of a local repository.
+
+    Args:
+        repo_url (string): url of the repository
+
+    Returns:
+        dict: tag name to commit sha.
+    """
+    tags = {}
+    started = perf_counter()
+    outcome = "error"
+    try:
+        with upstream_slot("git"), tempfile.TemporaryDirectory() as work_dir:
+            result = subprocess.run(
+                ["git", "ls-remote", "--tags", repo_url],
+                cwd=work_dir,
+                stdout=subprocess.PIPE,
                 stderr=subprocess.DEVNULL,
                 text=True,
-            ).strip()  # nosec B602, B603, B607
-        except subprocess.CalledProcessError:
-            pass
+                timeout=git_timeout,
+                env=git_env,
+                check=False,
+            )  # nosec B602, B603, B607
+        outcome = "ok" if result.returncode == 0 else "error"
+    except subprocess.TimeoutExpired:
+        outcome = "timeout"
+        git_refs_cache.put(repo_url, tags, min(git_refs_cache.ttl, 300))
+        return tags
+    finally:
+        metrics.observe("upstream_request_duration_seconds", {"upstream": "git"}, perf_counter() - started)
+        metrics.inc("upstream_requests_total", {"upstream": "git", "outcome": outcome})
+
+    if result.returncode != 0:
+        git_refs_cache.put(repo_url, tags, min(git_refs_cache.ttl, 300))
+        return tags
+
+    for line in result.stdout.splitlines():
+        commit_sha, _, ref = line.partition("\t")
+        if not ref.startswith("refs/tags/"):
+            continue
+
+        tag = ref[len("refs/tags/") :]
+        if tag.endswith("^{}"):
+            # peeled annotated tag, this is the commit rather than the tag object
+            tags[tag[:-3]] = commit_sha
+        else:
+            tags.setdefault(tag, commit_sha)
 
-        if commit_sha is None:
-            try:
-                commit_sha = subprocess.check_output(
-                    ["git", "rev-list", "-n", "1", "v" + package_version],
-                    stderr=subprocess.DEVNULL,
-                    text=True,
-                ).strip()  # nosec B602, B603, B607
-            except subprocess.CalledProcessError:
-                pass
+    git_refs_cache.put(repo_url, tags)
+    return tags
+
+
+def get_commit_sha(repo_url, package_version):
+    """
+    Find the commit for a package version by matching it to a tag in the repository.
+
+    Args:
+        repo_url (string): url of the repository
+        package_version (string): version of the package, tried as is and with a v prefix
+
+    Returns:
+        string: the commit sha, None if no tag matches.
+    """
+    if is_empty(repo_url) or is_empty(package_version):
+        return None
 
-        # print(f"Commit {commit_sha}")
-        os.chdir(cwd)
-        return commit_sha
+    tags = get_remote_tags(normalize_repo_url(repo_url))
+    return tags.get(package_version, tags.get("v" + package_version, None))
 
 
 def get_deb_info(package_name, version):
@@ -1010,7 +2308,7 @@ def get_deb_info(package_name, version):
     dscfile = f"https://launchpad.net/ubuntu/+archive/primary/+sourcefiles/{package_name}/{version}/{package_name}_{version}.dsc"
 
     try:
-        response = requests.get(dscfile, allow_redirects=True, timeout=2)
+        response = http_request("GET", dscfile, "registry", allow_redirects=True)
         # Check if the request was successful (status code 200)
         if response.status_code == 502:
             print("\n" + "=" * 80, flush=True)
@@ -1067,7 +2365,7 @@ def get_deb_info(package_name, version):
 def get_pypi_info(package_name, version):
     url = f"https://pypi.org/pypi/{package_name}/{version}/json"
     try:
-        response = requests.get(url, timeout=2)
+        response = http_request("GET", url, "registry")
         if response.status_code == 502:
             print("\n" + "=" * 80, flush=True)
             print(f"502 BAD GATEWAY from get_pypi_info: {url}", flush=True)
@@ -1101,7 +2399,7 @@ def get_pypi_info(package_name, version):
 def get_npm_info(package_name, version):
     url = f"https://registry.npmjs.org/{package_name}/{version}"
     try:
-        response = requests.get(url, timeout=2)
+        response = http_request("GET", url, "registry")
         if response.status_code == 502:
             print("\n" + "=" * 80, flush=True)
             print(f"502 BAD GATEWAY from get_npm_info: {url}", flush=True)
@@ -1136,7 +2434,7 @@ def get_golang_info(domain, module_name, version):
     url = f"https://proxy.golang.org/{domain}/{module_name}/@v/{version}.info"
     print("Version URL: " + url)
     try:
-        response = requests.get(url, timeout=2)
+        response = http_request("GET", url, "registry")
         if response.status_code == 502:
             print("\n" + "=" * 80, flush=True)
             print(f"502 BAD GATEWAY from get_golang_info: {url}", flush=True)
@@ -1167,7 +2465,7 @@ def get_java_info(group, artifact, version):
     url = url = f'https://repo1.maven.org/maven2/{group.replace(".", "/")}/{artifact}/{version}/{artifact}-{version}.pom'
 
     try:
-        response = requests.get(url, timeout=2)
+        response = http_request("GET", url, "registry")
         if response.status_code == 502:
             print("\n" + "=" * 80, flush=True)
             print(f"502 BAD GATEWAY from get_java_info: {url}", flush=True)
@@ -1209,7 +2507,7 @@ def get_java_info(group, artifact, version):
 def get_rust_info(crate_name, version):
     url = f"https://crates.io/api/v1/crates/{crate_name}/{version}"
     try:
-        response = requests.get(url, timeout=2)
+        response = http_request("GET", url, "registry")
         if response.status_code == 502:
             print("\n" + "=" * 80, flush=True)
             print(f"502 BAD GATEWAY from get_rust_info: {url}", flush=True)
@@ -1257,13 +2555,84 @@ def getCommitFromPurl(package_type, package_namespace, package_name, package_ver
     return {"repo_url": repo_url, "commit_sha": commit_sha}
 
 
+def get_commit_from_purl_cached(record, purl):
+    """
+    Resolve the git repo and commit for a purl, using the dm.dm_purlcommit table as a persistent cache.
+
+    A package version never changes so resolved commits are kept for good. Lookups that did not
+    find a commit are retried after PURL_NEGATIVE_TTL_HOURS. Purls without a version are not cached.
+
+    Args:
+        record (PurlRecord): the parsed purl
+        purl (string): the full purl
+
+    Returns:
+        dict: repo_url and commit_sha, either may be None.
+
+    Raises:
+        UpstreamUnavailable: the circuit breaker of the package registry is open.
+    """
+    if is_empty(record.version) or is_empty(record.type):
+        return getCommitFromPurl(record.type, record.namespace, record.name, record.version, purl)
+
+    if not ensure_schema():
+        return getCommitFromPurl(record.type, record.namespace, record.name, record.version, purl)
+
+    # qualifiers and subpaths do not change the repo or commit
+    cache_key = record.base
+
+    try:
+        with engine.connect() as connection:
+            conn = connection.connection
+            cursor = conn.cursor()
+            with metrics.timer("db_query_duration_seconds", {"operation": "lookup_purlcommit"}):
+                cursor.execute(
+                    """
+                    select repourl, commitsha from dm.dm_purlcommit
+                    where purl = %s and (commitsha is not null or resolved > now() - make_interval(hours => %s))
+                    """,
+                    (cache_key, purl_negative_ttl),
+                )
+            row = cursor.fetchone()
+            cursor.close()
+            if row is not None:
+                return {"repo_url": row[0], "commit_sha": row[1]}
+    except Exception as err:
+        print(f"Commit cache lookup failed for {cache_key}: {err}")
+
+    # UpstreamUnavailable goes to the caller without remembering the miss, the registry is down rather than the package having no repo
+    results = getCommitFromPurl(record.type, record.namespace, record.name, record.version, purl)
+
+    try:
+        with engine.connect() as connection:
+            conn = connection.connection
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                insert into dm.dm_purlcommit (purl, repourl, commitsha, resolved) values (%s, %s, %s, now())
+                ON CONFLICT (purl) DO UPDATE SET repourl = excluded.repourl, commitsha = excluded.commitsha, resolved = excluded.resolved
+                """,
+                (cache_key, results.get("repo_url", None), results.get("commit_sha", None)),
+            )
+            conn.commit()
+            cursor.close()
+    except Exception as err:
+        print(f"Commit cache update failed for {cache_key}: {err}")
+
+    return results
+
+
 def example(filename):
     example_dict = {}
+    # relative to this file rather than the process working directory
+    if not os.path.isabs(filename):
+        filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
     with open(filename, mode="r", encoding="utf-8") as example_file:
         example_dict = json.load(example_file)
     return example_dict
 
 
+@lru_cache(maxsize=cvss_cache_size)
 def calculate_cvss_score(cvss_vector):
     try:
         # Determine the CVSS version
@@ -1283,25 +2652,44 @@ def calculate_cvss_score(cvss_vector):
 
 
 def get_vulns(payload):
-    vulns = []
-    url = "https://api.osv.dev/v1/query"
+    """
+    Get the vulnerabilities for a single package from OSV.
+
+    Args:
+        payload (dict): OSV query for the package
+
+    Returns:
+        list: list of OSV vulnerability records, None if OSV could not be queried.
+    """
+    return get_vulns_batch([payload])[0]
+
+
+def get_vuln_detail(vulnid):
+    """
+    Get the full OSV record for a vulnerability id.
+
+    Args:
+        vulnid (string): OSV vulnerability id
+
+    Returns:
+        dict: the OSV vulnerability record, None if it could not be retrieved.
+    """
+    url = osv_url + "/v1/vulns/" + urllib.parse.quote(vulnid)
     try:
-        response = requests.post(url, json=payload, headers={"Content-Type": "application/json"}, timeout=10)
+        response = http_request("GET", url, "osv")
         if response.status_code == 502:
             print("\n" + "=" * 80, flush=True)
-            print(f"502 BAD GATEWAY from get_vulns: {url}", flush=True)
+            print(f"502 BAD GATEWAY from get_vuln_detail: {url}", flush=True)
             print("=" * 80, flush=True)
             traceback.print_stack(file=sys.stdout)
             sys.stdout.flush()
             print("=" * 80 + "\n", flush=True)
 
         if response.status_code == 200:
-            data = response.json()
-            if "vulns" in data:
-                vulns = data["vulns"]
+            return response.json()
     except requests.exceptions.ConnectionError as conn_error:
         print("\n" + "=" * 80, flush=True)
-        print("502 CONNECTION ERROR in get_vulns", flush=True)
+        print("502 CONNECTION ERROR in get_vuln_detail", flush=True)
         print(f"URL: {url}", flush=True)
         print(f"Error: {str(conn_error)}", flush=True)
         traceback.print_exc(file=sys.stdout)
@@ -1310,7 +2698,211 @@ def get_vulns(payload):
     except Exception as ex:
         print(ex)
 
-    return vulns
+    return None
+
+
+def get_vuln_detail_cached(vulnid, modified):
+    """
+    Get the full OSV record for a vulnerability id, reusing the record fetched for the same modified time.
+
+    The querybatch API reports when each vulnerability was last modified, so a cached record is only
+    reused while OSV still has the same version of it.
+
+    Args:
+        vulnid (string): OSV vulnerability id
+        modified (string): modified time of the vulnerability reported by querybatch
+
+    Returns:
+        dict: the OSV vulnerability record, None if it could not be retrieved.
+    """
+    key = (vulnid, modified)
+    detail = vuln_detail_cache.get(key)
+    if detail is not None:
+        return detail
+
+    # batches running side by side that share a vulnerability wait for the first fetch instead of repeating it
+    with vuln_detail_flight.hold(key):
+        detail = vuln_detail_cache.get(key)
+        if detail is None:
+            detail = get_vuln_detail(vulnid)
+            if detail is not None:
+                vuln_detail_cache.put(key, detail)
+    return detail
+
+
+def get_vulns_batch(payloads):
+    """
+    Get the vulnerabilities for many packages using the OSV querybatch API.
+
+    The querybatch API only returns the ids of the matching vulnerabilities so the
+    full records are hydrated afterwards, once per distinct id and modified time.
+
+    Args:
+        payloads (list): list of OSV queries, same format as get_vulns
+
+    Returns:
+        list: list of OSV vulnerability record lists, one per payload in the same order. The entry is None
+        when the query, or the lookup of one of its vulnerabilities, failed so the package is not recorded as clean.
+    """
+    vulnids = [[] for _ in payloads]
+    failed = set()
+    url = osv_url + "/v1/querybatch"
+
+    for start in range(0, len(payloads), osv_batch_size):
+        pending = {idx: payloads[idx] for idx in range(start, min(start + osv_batch_size, len(payloads)))}
+
+        # OSV pages large result sets, so keep asking for the queries that returned a page token
+        while len(pending) > 0:
+            indexes = list(pending.keys())
+            try:
+                response = http_request(
+                    "POST",
+                    url,
+                    "osv_batch",
+                    json={"queries": [pending[idx] for idx in indexes]},
+                    headers={"Content-Type": "application/json"},
+                )
+                if response.status_code == 502:
+                    print("\n" + "=" * 80, flush=True)
+                    print(f"502 BAD GATEWAY from get_vulns_batch: {url}", flush=True)
+                    print("=" * 80, flush=True)
+                    traceback.print_stack(file=sys.stdout)
+                    sys.stdout.flush()
+                    print("=" * 80 + "\n", flush=True)
+
+                if response.status_code != 200:
+                    failed.update(indexes)
+                    break
+
+                results = response.json().get("results", [])
+            except requests.exceptions.ConnectionError as conn_error:
+                print("\n" + "=" * 80, flush=True)
+                print("502 CONNECTION ERROR in get_vulns_batch", flush=True)
+                print(f"URL: {url}", flush=True)
+                print(f"Error: {str(conn_error)}", flush=True)
+                traceback.print_exc(file=sys.stdout)
+                sys.stdout.flush()
+                print("=" * 80 + "\n", flush=True)
+                failed.update(indexes)
+                break
+            except Exception as ex:
+                print(ex)
+                failed.update(indexes)
+                break
+
+            # a short result list means the missing queries were not answered
+            failed.update(indexes[len(results) :])
+
+            next_pending = {}
+            for idx, result in zip(indexes, results):
+                for vuln in result.get("vulns", []):
+                    if vuln.get("id") is not None:
+                        vulnids[idx].append((vuln["id"], vuln.get("modified", "")))
+
+                page_token = result.get("next_page_token", None)
+                if page_token:
+                    next_pending[idx] = dict(payloads[idx], page_token=page_token)
+            pending = next_pending
+
+    details = {}
+    unique_ids = list({vulnid for idx, ids in enumerate(vulnids) if idx not in failed for vulnid in ids})
+    fetched = sweep_executor.map(get_vuln_detail_cached, [vulnid[0] for vulnid in unique_ids], [vulnid[1] for vulnid in unique_ids])
+    for vulnid, detail in zip(unique_ids, fetched):
+        if detail is not None:
+            details[vulnid] = detail
+
+    results = []
+    for idx, ids in enumerate(vulnids):
+        if idx in failed or any(vulnid not in details for vulnid in ids):
+            results.append(None)
+        else:
+            results.append([details[vulnid] for vulnid in dict.fromkeys(ids)])
+    return results
+
+
+def osv_payload(packagename, packageversion, purl):
+    """
+    Build the OSV query for a package.
+
+    Args:
+        packagename (string): name of the package
+        packageversion (string): version of the package
+        purl (string): package url, optional
+
+    Returns:
+        list: [OSV query payload, purl with the qualifiers removed].
+    """
+    if purl is None or purl.strip() == "":
+        payload = {
+            "package": {"name": packagename.lower()},
+            "version": packageversion.lower(),
+        }
+    else:
+        if "?" in purl:
+            purl = purl.split("?")[0]
+        payload = {"package": {"purl": purl.lower()}}
+    return [payload, purl]
+
+
+@lru_cache(maxsize=cvss_cache_size)
+def cvss_risklevel(cvss_vector):
+    """
+    Bucket the base score of a cvss vector into a risk level.
+
+    Vectors repeat across many advisories so the score and bucket are cached per vector,
+    including vectors that could not be scored.
+
+    Args:
+        cvss_vector (string): CVSS v2, v3 or v4 vector
+
+    Returns:
+        string: None, Low, Medium, High or Critical, empty if the vector could not be scored.
+    """
+    base = calculate_cvss_score(cvss_vector)
+    if base is None:
+        return ""
+    if base == 0.0:
+        return "None"
+    if 0.1 <= base <= 3.9:
+        return "Low"
+    if 4.0 <= base <= 6.9:
+        return "Medium"
+    if 7.0 <= base <= 8.9:
+        return "High"
+    if base >= 9.0:
+        return "Critical"
+    return ""
+
+
+def osv_risklevel(obj):
+    """
+    Derive the risk level and cvss vector for an OSV vulnerability record.
+
+    Args:
+        obj (dict): OSV vulnerability record
+
+    Returns:
+        list: [risk level, cvss vector].
+    """
+    risklevel = ""
+    cvss = ""
+    if "severity" in obj:
+        sevlist = obj.get("severity", [])
+        sev = sevlist[0]
+        cvss = sev.get("score", None)
+
+        if cvss is not None:
+            risklevel = cvss_risklevel(cvss)
+
+        if not risklevel and "database_specific" in obj:
+            sec = obj["database_specific"]
+            if "severity" in sec:
+                risklevel = sec["severity"]
+
+    risklevel = risklevel.capitalize()
+    if risklevel == "Moderate":
+        risklevel = "Medium"
+    return [risklevel, cvss]
 
 
 def login(dhurl, user, password, errors):
@@ -1327,10 +2919,11 @@ def login(dhurl, user, password, errors):
         string: the cookies to be used in subsequent API calls.
     """
     try:
-        result = requests.post(
+        result = http_request(
+            "POST",
             dhurl + "/dmadminweb/API/login",
+            "deployhub",
             data={"user": user, "pass": password},
-            timeout=300,
         )
         if result.status_code == 502:
             print("\n" + "=" * 80, flush=True)
@@ -1359,10 +2952,327 @@ def login(dhurl, user, password, errors):
     return None
 
 
-def update_vulns():
+def queue_sweep_rows(sqlstmt, params, work_queue, stop, errors):
+    """
+    Producer thread that feeds the packages to sweep into the bounded work queue.
+
+    Args:
+        sqlstmt (string): query returning the packagename, packageversion, purl rows to sweep
+        params (tuple): parameters for the query
+        work_queue (queue.Queue): bounded queue shared with the sweep, None marks the end of the rows
+        stop (threading.Event): set by the sweep when it gives up so the producer does not block forever
+        errors (list): list to return any exception back to the sweep
+    """
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                work_queue.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        with engine.connect() as connection:
+            conn = connection.connection
+            # named cursors are server side so the rows are streamed instead of loaded up front
+            cursor = conn.cursor(name="vuln_sweep_rows")
+            cursor.itersize = osv_batch_size
+            cursor.execute(sqlstmt, params)
+
+            with metrics.timer("db_query_duration_seconds", {"operation": "fetch_sweep_rows"}):
+                rows = cursor.fetchmany(osv_batch_size)
+            while len(rows) > 0:
+                for row in rows:
+                    if not put(row):
+                        return
+                with metrics.timer("db_query_duration_seconds", {"operation": "fetch_sweep_rows"}):
+                    rows = cursor.fetchmany(osv_batch_size)
+            cursor.close()
+    except Exception as err:
+        errors.append(err)
+    finally:
+        put(None)
+
+
+class VulnWriter:
+    """
+    Buffer dm.dm_vulns rows and write them in large multi-row inserts.
+
+    The scan watermarks for the packages, and the sweep checkpoint, are written in the same
+    transaction as their vulnerabilities so a package is never marked as scanned without its rows.
+    Watermarks are left out when the bookkeeping tables could not be created.
+    """
+
+    def __init__(self, conn, batch_size, commit_interval, sweep=None, watermarks=True):
+        self.conn = conn
+        self.sweep = sweep
+        self.watermarks = watermarks
+        self.lastpurl = None
+        self.finished = False
+        self.cursor = conn.cursor()
+        self.batch_size = batch_size
+        self.commit_interval = commit_interval
+        self.rows = []
+        self.uncommitted = []
+        self.scanned = set()
+        self.last_commit = monotonic()
+        self.inserted = 0
+        self.uncommitted_inserted = 0
+
+    def add(self, row):
+        """
+        Buffer a vulnerability row, flushing when the batch is full.
+
+        Args:
+            row (tuple): packagename, packageversion, purl, id, summary, risklevel, cvss
+        """
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def mark_scanned(self, purls):
+        """
+        Record the scan watermark for the packages with the next commit.
+
+        Args:
+            purls (iterable): purls that were scanned
+        """
+        if self.watermarks:
+            self.scanned.update(purls)
+
+    def checkpoint(self, purl):
+        """
+        Record how far the sweep got with the next commit.
+
+        Args:
+            purl (string): last purl whose rows have all been processed
+        """
+        self.lastpurl = purl
+
+    def flush(self):
+        """
+        Write the buffered rows and commit if the commit interval has passed.
+        """
+        if len(self.rows) > 0:
+            rows = self.rows
+            self.rows = []
+            self.uncommitted.extend(rows)
+            try:
+                sqlstmt = """
+                    insert into dm.dm_vulns (packagename, packageversion, purl, id, summary, risklevel, cvss)
+                    values %s ON CONFLICT ON CONSTRAINT dm_vulns_pkey DO NOTHING
+                """
+                with metrics.timer("db_query_duration_seconds", {"operation": "insert_vulns"}):
+                    execute_values(self.cursor, sqlstmt, rows, page_size=len(rows))
+                self.uncommitted_inserted += max(self.cursor.rowcount, 0)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                raise
+            except Exception as err:
+                print(f"Bulk vulnerability insert failed, retrying row by row: {err}")
+                self.conn.rollback()
+                self.insert_rows()
+
+        if monotonic() - self.last_commit >= self.commit_interval:
+            self.commit()
+
+    def insert_rows(self):
+        """
+        Insert the uncommitted rows one at a time so a single bad row does not lose the batch.
+        """
+        sqlstmt = """
+            insert into dm.dm_vulns (packagename, packageversion, purl, id, summary, risklevel, cvss)
+            values (%s, %s, %s, %s, %s, %s, %s) ON CONFLICT ON CONSTRAINT dm_vulns_pkey DO NOTHING
+        """
+        for row in self.uncommitted:
+            try:
+                self.cursor.execute(sqlstmt, row)
+                inserted = max(self.cursor.rowcount, 0)
+                self.conn.commit()
+                self.inserted += inserted
+                metrics.inc("db_rows_inserted_total", {"table": "dm_vulns"}, inserted)
+            except Exception:
+                self.conn.rollback()
+                print("Duplicate Vuln: " + ", ".join(str(value) for value in row))
+        self.uncommitted = []
+        self.uncommitted_inserted = 0
+
+    def commit(self):
+        """
+        Write the scan watermarks and commit the transaction.
+        """
+        if len(self.scanned) > 0:
+            # record the scan watermark so delta sweeps can skip these packages until they go stale
+            sqlstmt = """
+                insert into dm.dm_vulnscan (purl, lastscan) select unnest(%s::text[]), now()
+                ON CONFLICT (purl) DO UPDATE SET lastscan = excluded.lastscan
+            """
+            self.cursor.execute(sqlstmt, (list(self.scanned),))
+            self.scanned = set()
+        if self.sweep is not None and (self.lastpurl is not None or self.finished):
+            sqlstmt = """
+                update dm.dm_vulnsweep set lastpurl = coalesce(%s, lastpurl), updated = now(),
+                finished = case when %s then now() else finished end
+                where sweep = %s
+            """
+            self.cursor.execute(sqlstmt, (self.lastpurl, self.finished, self.sweep))
+        with metrics.timer("db_query_duration_seconds", {"operation": "commit_vulns"}):
+            self.conn.commit()
+        self.inserted += self.uncommitted_inserted
+        metrics.inc("db_rows_inserted_total", {"table": "dm_vulns"}, self.uncommitted_inserted)
+        self.uncommitted = []
+        self.uncommitted_inserted = 0
+        self.last_commit = monotonic()
+
+    def close(self):
+        """
+        Flush and commit everything that is still buffered.
+        """
+        self.commit_interval = 0
+        self.flush()
+        self.cursor.close()
+
+    def finish(self):
+        """
+        Mark the sweep as finished and commit everything that is still buffered.
+        """
+        self.finished = True
+        self.close()
+
+
+def start_sweep_checkpoint(sweep):
+    """
+    Find where an interrupted sweep stopped, or record the start of a new one.
+
+    Args:
+        sweep (string): name of the sweep
+
+    Returns:
+        string: last purl the interrupted sweep finished, None to start from the beginning.
+    """
+    with engine.connect() as connection:
+        conn = connection.connection
+        cursor = conn.cursor()
+        cursor.execute("select lastpurl from dm.dm_vulnsweep where sweep = %s and finished is null", (sweep,))
+        row = cursor.fetchone()
+        if row is None:
+            sqlstmt = """
+                insert into dm.dm_vulnsweep (sweep, lastpurl, started, updated, finished) values (%s, null, now(), now(), null)
+                ON CONFLICT (sweep) DO UPDATE SET lastpurl = null, started = now(), updated = now(), finished = null
+            """
+            cursor.execute(sqlstmt, (sweep,))
+        conn.commit()
+        cursor.close()
+    return row[0] if row is not None else None
+
+
+def process_vuln_batch(writer, rows, osv_results, progress):
+    """
+    Enrich a batch of packages and store their OSV vulnerabilities.
+
+    Rows whose purls only differ by qualifiers or case make the same OSV query, so each
+    distinct query is run once per sweep and its results are fanned out to every row.
+
+    Args:
+        writer (VulnWriter): buffered writer for the dm.dm_vulns rows
+        rows (list): list of (packagename, packageversion, purl) tuples
+        osv_results (TTLCache): OSV results already fetched in this sweep, keyed by query
+        progress (dict): dictionary updated with the number of rows and OSV queries
+
+    Returns:
+        boolean: True if every package in the batch was scanned, False if OSV failed for some of them.
+    """
+    packages = []
+    queries = {}
+    found = {}
+    scanned = set()
+
+    # take the server and session once so every purl of the batch is created for the same user
+    batch_dhurl = dhurl
+    batch_cookies = cookies
+    purls = list(dict.fromkeys(row[2] for row in rows))
+
+    if batch_dhurl == "":
+        # a sweep resumed at startup runs before any request has supplied a server and session, the vulnerabilities
+        # are still stored and the components are left to a later sweep that has one
+        if "enrichment_skipped" not in progress:
+            print("No DeployHub url or session yet, sweeping vulnerabilities without creating components")
+        progress["enrichment_skipped"] = progress.get("enrichment_skipped", 0) + len(purls)
+    else:
+        # enrichment is almost all network wait so run it on the worker pool, the db writes stay on this thread
+        existing = existing_purls(purls)
+        records = [parse_purl(purl) for purl in purls]
+        outcomes = sweep_executor.map(partial(create_compver, batch_dhurl, batch_cookies), purls, [purl in existing for purl in purls], records)
+        for purl, record, (created, _) in zip(purls, records, outcomes):
+            if created is None:
+                deferred_purls.defer(batch_dhurl, batch_cookies, purl, record)
+
+    for packagename, packageversion, row_purl in rows:
+        payload, purl = osv_payload(packagename, packageversion, row_purl)
+        key = json.dumps(payload, sort_keys=True)
+        packages.append((packagename, packageversion, purl, key, row_purl))
+
+        if key in found or key in queries:
+            continue
+        vulns = osv_results.get(key)
+        if vulns is not None:
+            found[key] = vulns
+        else:
+            queries[key] = payload
+
+    if len(queries) > 0:
+        for key, vulns in zip(queries, get_vulns_batch(list(queries.values()))):
+            found[key] = vulns
+            # failed queries are neither cached nor marked as scanned so they are asked again
+            if vulns is not None:
+                osv_results.put(key, vulns)
+
+    progress["osv_rows"] = progress.get("osv_rows", 0) + len(rows)
+    progress["osv_queries"] = progress.get("osv_queries", 0) + len(queries)
+    progress["osv_dedup_ratio"] = round(1 - progress["osv_queries"] / progress["osv_rows"], 3)
+
+    failed = 0
+    for packagename, packageversion, purl, key, row_purl in packages:
+        if found[key] is None:
+            failed += 1
+            continue
+
+        scanned.add(row_purl)
+        for obj in found[key]:
+            vulnid = obj.get("id", "")
+            desc = obj.get("summary", "")
+
+            if "aliases" in obj:
+                aliases = " ".join(obj["aliases"])
+                if desc:
+                    desc = f"{aliases}: {desc}"
+                else:
+                    desc = aliases
+
+            risklevel, cvss = osv_risklevel(obj)
+            writer.add((packagename, packageversion, purl, vulnid, desc, risklevel, cvss))
+
+    if failed > 0:
+        progress["osv_failed"] = progress.get("osv_failed", 0) + failed
+
+    writer.mark_scanned(scanned)
+    writer.flush()
+    return failed == 0
+
+
+def update_vulns(compids=None, work_queue=None, progress=None):
     """
     Thread to update vulnerabilities
 
+    In delta mode only the packages for the uploaded components plus the packages that
+    have not been scanned within VULN_SCAN_TTL_HOURS are processed, otherwise every package is rescanned.
+
+    Args:
+        compids (list): ids of the components that were just uploaded, optional
+        work_queue (queue.Queue): bounded queue for the packages waiting to be processed, optional
+        progress (dict): dictionary updated with the number of packages processed, optional
+
     Global:
         dhurl (string): url to server
         cookies (string): cookies from login
@@ -1375,102 +3285,103 @@ def update_vulns():
     # errors = []
     # cookies = login(dhurl, "admin", "admin", errors)
 
+    if work_queue is None:
+        work_queue = queue.Queue(maxsize=vuln_queue_size)
+
+    if progress is None:
+        progress = {}
+
     # Retry logic for failed query
     no_of_retry = db_conn_retry
     attempt = 1
     while True:
+        stop = threading.Event()
+        errors = []
+        producer = None
         try:
-            sqlstmt = """
-                select distinct packagename, packageversion, purl
-                from dm.dm_componentdeps where deptype = 'license' and purl is not null
-            """
+            # without the bookkeeping tables there are no watermarks to find stale packages by, so every sweep is full and unresumable
+            persistent = ensure_schema()
+
+            # rows come in purl order so a full sweep can resume after the last purl it checkpointed,
+            # delta sweeps resume on their own because finished packages already have fresh watermarks
+            sweep = None
+            lastpurl = None
+            if compids and vuln_sweep_mode == "delta" and persistent:
+                sqlstmt = """
+                    select distinct d.packagename, d.packageversion, d.purl
+                    from dm.dm_componentdeps d left join dm.dm_vulnscan s on s.purl = d.purl
+                    where d.deptype = 'license' and d.purl is not null
+                    and (d.compid = any(%s) or s.lastscan is null or s.lastscan < now() - make_interval(hours => %s))
+                    order by d.purl
+                """
+                params = (list(compids), vuln_scan_ttl)
+            else:
+                if persistent:
+                    sweep = "full"
+                    lastpurl = start_sweep_checkpoint(sweep)
+                if lastpurl is None:
+                    sqlstmt = """
+                        select distinct packagename, packageversion, purl
+                        from dm.dm_componentdeps where deptype = 'license' and purl is not null
+                        order by purl
+                    """
+                    params = None
+                else:
+                    print(f"Resuming full vulnerability sweep after {lastpurl}")
+                    progress["resumed_after"] = lastpurl
+                    sqlstmt = """
+                        select distinct packagename, packageversion, purl
+                        from dm.dm_componentdeps where deptype = 'license' and purl is not null and purl > %s
+                        order by purl
+                    """
+                    params = (lastpurl,)
+
+            producer = threading.Thread(target=queue_sweep_rows, args=(sqlstmt, params, work_queue, stop, errors), daemon=True)
+            producer.start()
 
             with engine.connect() as connection:
-                conn = connection.connection
-                cursor = conn.cursor()
-                cursor.execute(sqlstmt)
-                results = cursor.fetchall()
-
-                for result in results:
-                    packagename, packageversion, purl = result
-
-                    create_compver(dhurl, cookies, purl)
-
-                    if purl is None or purl.strip() == "":
-                        payload = {
-                            "package": {"name": packagename.lower()},
-                            "version": packageversion.lower(),
-                        }
-                    else:
-                        if "?" in purl:
-                            purl = purl.split("?")[0]
-                        payload = {"package": {"purl": purl.lower()}}
-
-                    vulns = get_vulns(payload)
-
-                    for obj in vulns:
-                        vulnid = obj.get("id", "")
-                        desc = obj.get("summary", "")
-
-                        if "aliases" in obj:
-                            aliases = " ".join(obj["aliases"])
-                            if desc:
-                                desc = f"{aliases}: {desc}"
-                            else:
-                                desc = aliases
-
-                        risklevel = ""
-                        cvss = ""
-                        if "severity" in obj:
-                            sevlist = obj.get("severity", [])
-                            sev = sevlist[0]
-                            cvss = sev.get("score", None)
-
-                            if cvss is not None:
-                                base = calculate_cvss_score(cvss)
-                                if base is not None:
-                                    if base == 0.0:
-                                        risklevel = "None"
-                                    elif 0.1 <= base <= 3.9:
-                                        risklevel = "Low"
-                                    elif 4.0 <= base <= 6.9:
-                                        risklevel = "Medium"
-                                    elif 7.0 <= base <= 8.9:
-                                        risklevel = "High"
-                                    elif base >= 9.0:
-                                        risklevel = "Critical"
-
-                            if not risklevel and "database_specific" in obj:
-                                sec = obj["database_specific"]
-                                if "severity" in sec:
-                                    risklevel = sec["severity"]
-
-                        risklevel = risklevel.capitalize()
-                        if risklevel == "Moderate":
-                            risklevel = "Medium"
-
-                        try:
-                            sqlstmt = """
-                                insert into dm.dm_vulns (packagename, packageversion, purl, id, summary, risklevel, cvss)
-                                values (%s, %s, %s, %s, %s, %s, %s) ON CONFLICT ON CONSTRAINT dm_vulns_pkey DO NOTHING
-                            """
-                            params = tuple(
-                                [
-                                    packagename,
-                                    packageversion,
-                                    purl,
-                                    vulnid,
-                                    desc,
-                                    risklevel,
-                                    cvss,
-                                ]
-                            )
-                            cursor.execute(sqlstmt, params)
-                            conn.commit()
-                        except Exception:
-                            print(f"Duplicate Vuln: {packagename}, {packageversion}, {vulnid}, {desc}, {risklevel}, {cvss}")
-                return
-        except (InterfaceError, OperationalError) as ex:
+                writer = VulnWriter(connection.connection, vuln_insert_batch_size, vuln_commit_interval, sweep, watermarks=persistent)
+                osv_results = TTLCache(osv_dedup_cache_size, vuln_scan_ttl * 3600)
+
+                done = False
+                complete = True
+                carry = None
+                while not done:
+                    rows = []
+                    if carry is not None:
+                        rows.append(carry)
+                        carry = None
+                    while True:
+                        row = work_queue.get()
+                        if row is None:
+                            done = True
+                            break
+                        # keep rows for the same purl in one batch so the checkpoint never splits them
+                        if len(rows) >= osv_batch_size and row[2] != rows[-1][2]:
+                            carry = row
+                            break
+                        rows.append(row)
+
+                    if len(rows) > 0:
+                        # once OSV fails for a package the checkpoint stays before it so a resumed sweep rescans it
+                        if not process_vuln_batch(writer, rows, osv_results, progress):
+                            complete = False
+                        if complete:
+                            writer.checkpoint(rows[-1][2])
+                        progress["processed"] = progress.get("processed", 0) + len(rows)
+                        progress["vulns_inserted"] = writer.inserted
+
+                if complete:
+                    writer.finish()
+                else:
+                    writer.close()
+                progress["vulns_inserted"] = writer.inserted
+
+            if len(errors) > 0:
+                raise errors[0]
+            return
+        except (InterfaceError, OperationalError, psycopg2.InterfaceError, psycopg2.OperationalError) as ex:
+            # the writer and producer use raw psycopg2 cursors, which raise the driver's errors rather than SQLAlchemy's
             if attempt < no_of_retry:
                 sleep_for = 0.2
                 logging.error(
@@ -1486,12 +3397,843 @@ def update_vulns():
                 continue
             else:
                 raise
+        finally:
+            # release the producer and drop anything it queued so the next sweep starts clean
+            stop.set()
+            if producer is not None:
+                producer.join()
+            while not work_queue.empty():
+                try:
+                    work_queue.get_nowait()
+                except queue.Empty:
+                    break
+
+
+class VulnSweepScheduler:
+    """
+    Single-flight scheduler for the background vulnerability sweep.
+
+    Sweep requests are coalesced so there is at most one sweep running and one queued. Components
+    requested while a sweep is queued are merged into that queued sweep.
+    """
+
+    def __init__(self, queue_size):
+        self.lock = threading.Lock()
+        self.work_queue = queue.Queue(maxsize=queue_size)
+        self.running = False
+        self.queued = False
+        self.pending_full = False
+        self.pending_compids = set()
+        self.current = None
+        self.last_sweep = None
+        self.requested = 0
+        self.coalesced = 0
+        self.completed = 0
+        self.failed = 0
+
+    def request(self, compid=None):
+        """
+        Ask for a sweep, coalescing it with the queued one if there is one.
+
+        Args:
+            compid (int): id of the component that was uploaded, None for a full sweep
+        """
+        with self.lock:
+            self.requested += 1
+            if self.queued:
+                self.coalesced += 1
+            self.queued = True
+
+            if compid is None:
+                self.pending_full = True
+            else:
+                self.pending_compids.add(compid)
+
+            if not self.running:
+                self.running = True
+                threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        """
+        Run queued sweeps one at a time until there is nothing left to do.
+        """
+        while True:
+            with self.lock:
+                if not self.queued:
+                    self.running = False
+                    return
+
+                compids = None if self.pending_full else sorted(self.pending_compids)
+                self.queued = False
+                self.pending_full = False
+                self.pending_compids = set()
+                self.current = {
+                    "mode": "full" if compids is None else vuln_sweep_mode,
+                    "compids": compids,
+                    "started": datetime.now(timezone.utc).isoformat(),
+                    "processed": 0,
+                }
+
+            sweep_status = "completed"
+            sweep_error = ""
+            try:
+                update_vulns(compids, self.work_queue, self.current)
+            except Exception as err:
+                sweep_status = "failed"
+                sweep_error = str(err)
+                print(f"Vulnerability sweep failed: {err}")
+                traceback.print_exc(file=sys.stdout)
+
+            with self.lock:
+                if sweep_status == "completed":
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                self.last_sweep = dict(self.current, finished=datetime.now(timezone.utc).isoformat(), status=sweep_status, error=sweep_error)
+                self.current = None
+
+    def resume(self):
+        """
+        Restart a full sweep that was interrupted, for example by the pod restarting.
+        """
+        if not ensure_schema():
+            return
+
+        try:
+            with engine.connect() as connection:
+                conn = connection.connection
+                cursor = conn.cursor()
+                cursor.execute("select lastpurl from dm.dm_vulnsweep where sweep = 'full' and finished is null")
+                row = cursor.fetchone()
+                cursor.close()
+        except Exception as err:
+            print(f"Could not check for an interrupted vulnerability sweep: {err}")
+            return
+
+        if row is not None:
+            print(f"Resuming interrupted vulnerability sweep after {row[0] or 'the start'}")
+            self.request()
+
+    def status(self):
+        """
+        Get the current state of the scheduler.
+
+        Returns:
+            dict: running/queued flags, queue depth, current and last sweep details and counters.
+        """
+        with self.lock:
+            return {
+                "running": self.running,
+                "queued": self.queued,
+                "queued_compids": sorted(self.pending_compids),
+                "queue_depth": self.work_queue.qsize(),
+                "queue_size": self.work_queue.maxsize,
+                "current": dict(self.current) if self.current is not None else None,
+                "last": self.last_sweep,
+                "requested": self.requested,
+                "coalesced": self.coalesced,
+                "completed": self.completed,
+                "failed": self.failed,
+            }
+
+    def metrics_samples(self):
+        """
+        Get the sweep progress as gauge samples for the metrics endpoint.
+
+        Returns:
+            list: (name, labels, value) samples.
+        """
+        with self.lock:
+            current = dict(self.current) if self.current is not None else {}
+            return [
+                ("vuln_sweep_running", {}, 1 if self.current is not None else 0),
+                ("vuln_sweep_queued", {}, 1 if self.queued else 0),
+                ("vuln_sweep_processed", {}, current.get("processed", 0)),
+                ("vuln_sweep_vulns_inserted", {}, current.get("vulns_inserted", 0)),
+                ("vuln_sweep_osv_dedup_ratio", {}, current.get("osv_dedup_ratio", 0)),
+                ("vuln_sweep_queue_depth", {}, self.work_queue.qsize()),
+                ("vuln_sweeps_total", {"status": "completed"}, self.completed),
+                ("vuln_sweeps_total", {"status": "failed"}, self.failed),
+            ]
+
+
+vuln_sweep = VulnSweepScheduler(vuln_queue_size)
+metrics.collect(vuln_sweep.metrics_samples)
+
+
+# runs of the separators PEP 503 treats as equal
+package_separators = re.compile(r"[-_.]+")
+
+
+@lru_cache(maxsize=purl_cache_size)
+def canonical_package_name(name):
+    """
+    Normalize a Python package name the way PEP 503 does.
+
+    Args:
+        name (string): package name as written in a report or the safety database
+
+    Returns:
+        string: the name lowercased with each run of "-", "_" and "." changed to "-".
+    """
+    return sys.intern(package_separators.sub("-", name).lower())
+
+
+def index_safety_db(data):
+    """
+    Index the safety database by package and advisory so a report entry is a single dict lookup.
+
+    The raw database maps each package to a list of advisories with long descriptions and version
+    specs. Only the CVE name and url are kept, in a tuple, and the package names are normalized
+    with canonical_package_name and interned so the keys share them. Lookups must normalize too.
+
+    Args:
+        data (dict): insecure_full.json keyed by package name
+
+    Returns:
+        dict: (canonical package name, advisory number) to (cve name, cve url), either may be None.
+    """
+    index = {}
+    for packagename, advisories in data.items():
+        if packagename == "$meta" or not isinstance(advisories, list):
+            continue
+
+        packagename = canonical_package_name(packagename)
+        for advisory in advisories:
+            advisory_id = advisory.get("id") or ""
+            if advisory_id.startswith("pyup.io-"):
+                advisory_id = advisory_id[len("pyup.io-") :]
+
+            # the first advisory with an id wins, the same as the old list scan, including across spellings of the package
+            key = (packagename, advisory_id)
+            if key in index:
+                continue
+
+            cve_name = advisory.get("cve") or None
+            cve_url = None
+            if cve_name is not None and cve_name.startswith("CVE"):
+                cve_url = "https://nvd.nist.gov/vuln/detail/" + cve_name
+            index[key] = (cve_name, cve_url)
+    return index
+
+
+class SafetyDb:
+    """
+    The indexed safety database, loaded from a local snapshot at startup and refreshed in the background.
+
+    Downloads are conditional on the ETag and Last-Modified of the snapshot, and a new index is
+    swapped in whole so lookups never see a partly built one. Each refresh thread has its own stop
+    event, and swaps and snapshot writes happen under the lock after checking it, so a thread that
+    was stopped mid download never writes after stop returns.
+    """
+
+    def __init__(self, url, snapshot, refresh_interval):
+        self.url = url
+        self.snapshot = snapshot
+        self.refresh_interval = refresh_interval
+        self.index = None
+        self.etag = None
+        self.last_modified = None
+        self.checked = None
+        self.ready = threading.Event()
+        self.lock = threading.Lock()
+        self.stopped = False
+        self.stop_event = None
+        self.thread = None
+
+    def get(self, key, default=None):
+        """
+        Look up an advisory, matching the package name however it is spelled.
+
+        Args:
+            key (tuple): (package name, advisory number)
+            default: value returned when the advisory is not known
+
+        Returns:
+            tuple: (cve name, cve url), default if not found or the database is not loaded yet.
+        """
+        index = self.index
+        if index is None:
+            return default
+        packagename, advisory_id = key
+        return index.get((canonical_package_name(packagename), advisory_id), default)
+
+    def wait_ready(self, timeout):
+        """
+        Wait for the snapshot to load or the first download to finish, starting the refresh if needed.
+
+        Args:
+            timeout (float): maximum seconds to wait
+
+        Returns:
+            boolean: True if a database is loaded.
+        """
+        self.start(restart=False)
+        self.ready.wait(timeout)
+        return self.index is not None
+
+    def age(self):
+        """
+        Get how long ago the database was last confirmed to be current.
+
+        Returns:
+            float: age in seconds, None if no database is loaded.
+        """
+        if self.index is None or self.checked is None:
+            return None
+        return round(max(datetime.now(timezone.utc).timestamp() - self.checked, 0.0), 1)
+
+    def load_snapshot(self):
+        """
+        Load the database from the local snapshot if there is one.
+
+        Returns:
+            boolean: True if the snapshot was loaded.
+        """
+        try:
+            with open(self.snapshot, mode="r", encoding="utf-8") as snapshot_file:
+                self.index = index_safety_db(json.load(snapshot_file))
+            self.checked = os.path.getmtime(self.snapshot)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as err:
+            print(f"Could not load safety database snapshot {self.snapshot}: {err}")
+            return False
+
+        try:
+            with open(self.snapshot + ".meta", mode="r", encoding="utf-8") as meta_file:
+                meta = json.load(meta_file)
+            self.etag = meta.get("etag", None)
+            self.last_modified = meta.get("last_modified", None)
+        except (OSError, ValueError):
+            pass
+        return True
+
+    def write_snapshot(self, content):
+        """
+        Atomically replace the local snapshot and its validators.
+
+        Args:
+            content (bytes): the downloaded database
+        """
+        snapshot_dir = os.path.dirname(os.path.abspath(self.snapshot))
+        for path, data in (
+            (self.snapshot, content),
+            (self.snapshot + ".meta", json.dumps({"etag": self.etag, "last_modified": self.last_modified}).encode("utf-8")),
+        ):
+            with tempfile.NamedTemporaryFile(dir=snapshot_dir, delete=False) as tmp_file:
+                tmp_file.write(data)
+            os.replace(tmp_file.name, path)
+
+    def refresh(self, stop_event=None):
+        """
+        Download the database if it changed since the last download and swap in the new index.
+
+        Args:
+            stop_event (threading.Event): stop event of the refresh thread, the download is thrown away once it is set
+
+        Returns:
+            boolean: True if the database is current, False if the download failed or the refresh was stopped.
+        """
+        headers = {}
+        if self.index is not None:
+            if self.etag:
+                headers["If-None-Match"] = self.etag
+            if self.last_modified:
+                headers["If-Modified-Since"] = self.last_modified
+
+        try:
+            url_res = http_request("GET", self.url, "safetydb", headers=headers)
+            if url_res.status_code == 502:
+                print("\n" + "=" * 80, flush=True)
+                print("502 BAD GATEWAY when fetching safety database", flush=True)
+                print("=" * 80, flush=True)
+                traceback.print_stack(file=sys.stdout)
+                sys.stdout.flush()
+                print("=" * 80 + "\n", flush=True)
+
+            if url_res.status_code == 304:
+                with self.lock:
+                    if stop_event is not None and stop_event.is_set():
+                        return False
+                    self.checked = datetime.now(timezone.utc).timestamp()
+                    try:
+                        os.utime(self.snapshot)
+                    except OSError:
+                        pass
+                return True
+
+            if url_res.status_code != 200:
+                print(f"Safety database download failed with status {url_res.status_code}")
+                return False
+
+            index = index_safety_db(json.loads(url_res.content))
+        except requests.exceptions.ConnectionError as conn_error:
+            print("\n" + "=" * 80, flush=True)
+            print("502 CONNECTION ERROR fetching safety database", flush=True)
+            print(f"Error: {str(conn_error)}", flush=True)
+            traceback.print_exc(file=sys.stdout)
+            sys.stdout.flush()
+            print("=" * 80 + "\n", flush=True)
+            return False
+        except (requests.exceptions.RequestException, ValueError) as err:
+            print(f"Safety database download failed: {err}")
+            return False
+
+        with self.lock:
+            if stop_event is not None and stop_event.is_set():
+                return False
+
+            self.etag = url_res.headers.get("ETag", None)
+            self.last_modified = url_res.headers.get("Last-Modified", None)
+            self.index = index
+            self.checked = datetime.now(timezone.utc).timestamp()
+
+            try:
+                self.write_snapshot(url_res.content)
+            except OSError as err:
+                print(f"Could not write safety database snapshot {self.snapshot}: {err}")
+        return True
+
+    def run(self, stop_event):
+        """
+        Refresh the database until stopped, retrying failed downloads sooner than the refresh interval.
+
+        Args:
+            stop_event (threading.Event): set by stop to end this thread
+        """
+        while not stop_event.is_set():
+            interval = self.refresh_interval if self.refresh(stop_event) else min(self.refresh_interval, 300)
+            if stop_event.is_set():
+                break
+            # uploads waiting for the first download go ahead even if it failed
+            self.ready.set()
+            stop_event.wait(interval)
+
+    def start(self, restart=True):
+        """
+        Load the snapshot and start the background refresh, unless it is already running.
+
+        Args:
+            restart (boolean): start again after stop, False for callers that only need a database loaded
+        """
+        with self.lock:
+            if self.thread is not None or (self.stopped and not restart):
+                return
+            self.stopped = False
+
+            if self.load_snapshot():
+                print(f"Loaded safety database snapshot {self.snapshot}")
+                self.ready.set()
+
+            self.stop_event = threading.Event()
+            self.thread = threading.Thread(target=self.run, args=(self.stop_event,), name="safety-db-refresh", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """
+        Stop the background refresh. A download in progress is thrown away when it finishes.
+        """
+        with self.lock:
+            self.stopped = True
+            if self.stop_event is not None:
+                self.stop_event.set()
+            self.stop_event = None
+            self.thread = None
+
+
+safety_db = SafetyDb(safety_db_url, safety_db_snapshot, safety_db_refresh)
+
+
+class JsonStreamReader:
+    """
+    Incremental JSON reader over a binary file that decodes one value at a time,
+    reading more of the file only when the value is not complete yet.
+    """
+
+    decoder = json.JSONDecoder()
+    whitespace = re.compile(r"[ \t\n\r]*")
+    number_tail = re.compile(r"[0-9.eE+\-]*")
+
+    def __init__(self, fileobj, chunk_size):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.text_decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """
+        Read the next chunk of the file into the buffer, dropping what has already been consumed.
+        """
+        data = self.fileobj.read(self.chunk_size)
+        if not data:
+            self.eof = True
+        text = self.text_decoder.decode(data, final=self.eof)
+        self.buffer = self.buffer[self.pos :] + text
+        self.pos = 0
+
+    def peek(self):
+        """
+        Skip whitespace and return the next character without consuming it.
+
+        Returns:
+            string: the next character, empty at the end of the file.
+        """
+        while True:
+            self.pos = self.whitespace.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                return ""
+            self.fill()
+
+    def expect(self, char):
+        """
+        Consume the next character, which must be char.
+
+        Args:
+            char (string): expected character
+        """
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expecting '{char}' but found '{found}' in JSON document")
+        self.pos += 1
+
+    def value(self):
+        """
+        Decode the next JSON value.
+
+        Returns:
+            the decoded value.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # a number running up to the end of the buffer may continue in the next chunk
+                if self.eof or not isinstance(value, (int, float)) or self.number_tail.match(self.buffer, end).end() < len(self.buffer):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+    def items(self):
+        """
+        Decode the elements of the array starting at the current position one at a time.
+
+        Returns:
+            generator: the decoded elements.
+        """
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+
+        while True:
+            yield self.value()
+            separator = self.peek()
+            self.pos += 1
+            if separator == "]":
+                return
+            if separator != ",":
+                raise ValueError(f"Expecting ',' or ']' but found '{separator}' in JSON array")
+
+
+def iter_json_array(fileobj, key=None):
+    """
+    Stream the elements of a JSON array without loading the whole document.
+
+    Args:
+        fileobj (file): binary file holding the JSON document
+        key (string): top level key of the array, None when the document itself is the array
+
+    Returns:
+        generator: the decoded array elements.
+    """
+    reader = JsonStreamReader(fileobj, sbom_chunk_size)
+
+    if key is None:
+        yield from reader.items()
+        return
+
+    reader.expect("{")
+    if reader.peek() == "}":
+        return
+
+    while True:
+        name = reader.value()
+        reader.expect(":")
+        if reader.peek() == "[":
+            if name == key:
+                yield from reader.items()
+            else:
+                # walk other arrays element by element so large sections are never held in memory
+                for _ in reader.items():
+                    pass
+        else:
+            reader.value()
+
+        separator = reader.peek()
+        reader.pos += 1
+        if separator == "}":
+            return
+        if separator != ",":
+            raise ValueError(f"Expecting ',' or '}}' but found '{separator}' in JSON object")
+
+
+async def spool_body(request):
+    """
+    Copy the request body to a spooled temporary file without buffering it all in memory.
+
+    Args:
+        request (Request): the incoming request
+
+    Returns:
+        SpooledTemporaryFile: the body, positioned at the start.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=sbom_spool_size)  # pylint: disable=R1732
+    async for chunk in request.stream():
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+
+class SbomComponents:
+    """
+    Re-iterable view of the component rows in a spooled SBOM. Each iteration parses the
+    document again from the start so a retried database load sees every row.
+    """
+
+    def __init__(self, spool, key, parse_component):
+        self.spool = spool
+        self.key = key
+        self.parse_component = parse_component
+
+    def __iter__(self):
+        self.spool.seek(0)
+        for component in iter_json_array(self.spool, self.key):
+            yield self.parse_component(component)
+
+
+def cyclonedx_component(compid, component):
+    """
+    Convert a CycloneDX component to a dm.dm_componentdeps row.
+
+    Args:
+        compid (int): id of the component the SBOM belongs to
+        component (dict): CycloneDX component
+
+    Returns:
+        tuple: the component row.
+    """
+    # Parse CycloneDX BOM for licenses
+    bomformat = "license"
+    packagename = component.get("name")
+    packageversion = component.get("version", "")
+    purl = component.get("purl", "")
+    pkgtype = ""
+    if ":" in purl:
+        pkgtype = purl.split("/")[0][4:]
+
+    summary = ""
+    license_url = ""
+    license_name = ""
+    licenses = component.get("licenses", None)
+    if licenses is not None and len(licenses) > 0:
+        current_license = licenses[0].get("license", {})
+        if current_license.get("id", None) is not None:
+            license_name = current_license.get("id")
+        elif current_license.get("name", None) is not None:
+            license_name = current_license.get("name")
+            if "," in license_name:
+                license_name = license_name.split(",")[0]
+
+        if len(license_name) > 0:
+            license_url = "https://spdx.org/licenses/" + license_name + ".html"
+
+    return (
+        compid,
+        packagename,
+        packageversion,
+        bomformat,
+        license_name,
+        license_url,
+        summary,
+        purl,
+        pkgtype,
+    )
+
+
+def spdx_component(compid, component):
+    """
+    Convert a SPDX package to a dm.dm_componentdeps row.
+
+    Args:
+        compid (int): id of the component the SBOM belongs to
+        component (dict): SPDX package
+
+    Returns:
+        tuple: the component row.
+    """
+    # Parse SPDX BOM for licenses
+    bomformat = "license"
+    packagename = component.get("name")
+    packageversion = component.get("versionInfo", "")
+    extpkgs = component.get("externalRefs", [])
+    purl = ""
+    pkgtype = ""
+
+    for pkgref in extpkgs:
+        reftype = pkgref.get("referenceType", None)
+        if reftype is not None and reftype == "purl":
+            purl = pkgref.get("referenceLocator", "")
+
+            if ":" in purl:
+                pkgtype = purl.split("/")[0][4:]
+
+    summary = ""
+    license_url = ""
+    license_name = ""
+    current_license = component.get("licenseDeclared", "NOASSERTION")
+
+    if current_license != "NOASSERTION":
+        license_name = current_license
+        license_url = "https://spdx.org/licenses/" + license_name + ".html"
+
+    if "," in license_name:
+        license_name = license_name.split(",", maxsplit=1)[0]
+
+    return (
+        compid,
+        packagename,
+        packageversion,
+        bomformat,
+        license_name,
+        license_url,
+        summary,
+        purl,
+        pkgtype,
+    )
+
+
+def safety_component(compid, component):
+    """
+    Convert a Python Safety report entry to a dm.dm_componentdeps row.
+
+    Args:
+        compid (int): id of the component the SBOM belongs to
+        component (list): Safety report entry
+
+    Returns:
+        tuple: the component row.
+    """
+    bomformat = "cve"
+    packagename = component[0]  # name
+    packageversion = component[2]  # version
+    summary = component[3]
+    safety_id = component[4]  # cve id
+    cve_url = ""
+    cve_name = safety_id
+
+    cve_detail = safety_db.get((packagename, safety_id), None)
+
+    if cve_detail is not None:
+        cve_name = cve_detail[0] or cve_name
+        cve_url = cve_detail[1] or cve_url
+
+    return (
+        compid,
+        packagename,
+        packageversion,
+        bomformat,
+        cve_name,
+        cve_url,
+        summary,
+    )
+
+
+def run_blocking(func, *args):
+    """
+    Run a blocking call on the bounded ingest thread pool so it does not stall the event loop.
+
+    Args:
+        func (function): the blocking function
+        args: arguments for the function
+
+    Returns:
+        awaitable: the result of the function.
+    """
+    return asyncio.get_running_loop().run_in_executor(ingest_executor, partial(func, *args))
+
+
+def resolve_dhurl(scheme, netloc):
+    """
+    Work out the DeployHub url from the request, preferring https when the server answers on it.
+
+    Args:
+        scheme (string): scheme of the request
+        netloc (string): host and port of the request
+
+    Returns:
+        string: url to the server.
+    """
+    dhurl = f"{scheme}://{netloc}".replace("http:", "https:")
+
+    try:
+        resp = http_request("HEAD", dhurl, "probe")
+
+        if resp is None or resp.status_code != 200:
+            dhurl = f"{scheme}://{netloc}"
+    except Exception:
+        dhurl = f"{scheme}://{netloc}"
+    return dhurl
+
+
+def cookie_key(cookies):
+    """
+    Hash the session cookies so they can be used as a cache key without being kept in memory.
+
+    Args:
+        cookies (dict): cookies from the request
+
+    Returns:
+        string: sha256 hex digest of the cookies.
+    """
+    cookie_str = "; ".join(f"{name}={value}" for name, value in sorted(cookies.items()))
+    return hashlib.sha256(cookie_str.encode("utf-8")).hexdigest()
+
+
+def validate_user(cookies):
+    """
+    Validate the session cookies with the validateuser microservice.
+
+    Successful validations are cached for VALIDATEUSER_CACHE_TTL seconds, failures are never cached.
+
+    Args:
+        cookies (dict): cookies from the request
+
+    Returns:
+        int: http status code returned by validateuser.
+    """
+    key = cookie_key(cookies)
+    if validateuser_cache.get(key, False):
+        return status.HTTP_200_OK
+
+    result = http_request("GET", validateuser_url + "/msapi/validateuser", "validateuser", cookies=cookies)
+    if result.status_code == status.HTTP_200_OK:
+        validateuser_cache.put(key, True)
+    return result.status_code
 
 
 # health check endpoint
 class StatusMsg(BaseModel):
     status: str = ""
     service_name: str = ""
+    safety_db_age: float | None = None
 
 
 @app.get("/health", tags=["health"])
@@ -1505,19 +4247,47 @@ async def health(response: Response) -> StatusMsg:
             cursor = conn.cursor()
             cursor.execute("SELECT 1")
             if cursor.rowcount > 0:
-                return StatusMsg(status="UP", service_name=service_name)
+                return StatusMsg(status="UP", service_name=service_name, safety_db_age=safety_db.age())
             response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
-            return StatusMsg(status="DOWN", service_name=service_name)
+            return StatusMsg(status="DOWN", service_name=service_name, safety_db_age=safety_db.age())
 
     except Exception as err:
         print(str(err))
         response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
-        return StatusMsg(status="DOWN", service_name=service_name)
+        return StatusMsg(status="DOWN", service_name=service_name, safety_db_age=safety_db.age())
 
 
 # end health check
 
 
+@app.get("/msapi/deppkg/status", tags=["status"])
+def sweep_status():
+    """
+    This is the end point used to report the state of the background vulnerability sweep, outbound connection reuse and caches
+    """
+    return {
+        "vulnsweep": vuln_sweep.status(),
+        "http": get_http_stats(),
+        "validateuser": validateuser_cache.stats(),
+        "registries": get_registry_status(),
+        "deferred": deferred_purls.status(),
+        "purl_jobs": purl_jobs.stats(),
+        "cvss": cvss_risklevel.cache_info()._asdict(),
+        "components": component_cache.stats(),
+        "osv_details": vuln_detail_cache.stats(),
+        "purls": parse_purl_base.cache_info()._asdict(),
+        "persistent_caches": persistent_caches,
+    }
+
+
+@app.get("/metrics", tags=["status"], response_class=PlainTextResponse)
+def prometheus_metrics():
+    """
+    This is the end point used by Prometheus to scrape the service metrics
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/msapi/deppkg")
 def sbom_type():
     """
@@ -1536,27 +4306,16 @@ async def cyclonedx(request: Request, response: Response, compid: int):
     global dhurl
     global cookies
 
-    dhurl = f"{request.base_url.scheme}://{request.base_url.netloc}".replace("http:", "https:")
-
-    try:
-        resp = requests.head(dhurl, timeout=1)
-
-        if resp is None or resp.status_code != 200:
-            dhurl = f"{request.base_url.scheme}://{request.base_url.netloc}"
-    except Exception:
-        dhurl = f"{request.base_url.scheme}://{request.base_url.netloc}"
+    dhurl = await run_blocking(resolve_dhurl, request.base_url.scheme, request.base_url.netloc)
 
     cookies = request.cookies
 
     try:
-        result = requests.get(validateuser_url + "/msapi/validateuser", cookies=request.cookies, timeout=5)
-        if result is None:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authorization Failed")
-
-        if result.status_code != status.HTTP_200_OK:
+        status_code = await run_blocking(validate_user, request.cookies)
+        if status_code != status.HTTP_200_OK:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Authorization Failed status_code=" + str(result.status_code),
+                detail="Authorization Failed status_code=" + str(status_code),
             )
     except Exception as err:
         raise HTTPException(
@@ -1564,49 +4323,9 @@ async def cyclonedx(request: Request, response: Response, compid: int):
             detail="Authorization Failed:" + str(err),
         ) from None
 
-    cyclonedx_json = await request.json()
-    components_data = []
-    components = cyclonedx_json.get("components", [])
-
-    # Parse CycloneDX BOM for licenses
-    bomformat = "license"
-    for component in components:
-        packagename = component.get("name")
-        packageversion = component.get("version", "")
-        purl = component.get("purl", "")
-        pkgtype = ""
-        if ":" in purl:
-            pkgtype = purl.split("/")[0][4:]
-
-        summary = ""
-        license_url = ""
-        license_name = ""
-        licenses = component.get("licenses", None)
-        if licenses is not None and len(licenses) > 0:
-            current_license = licenses[0].get("license", {})
-            if current_license.get("id", None) is not None:
-                license_name = current_license.get("id")
-            elif current_license.get("name", None) is not None:
-                license_name = current_license.get("name")
-                if "," in license_name:
-                    license_name = license_name.split(",")[0]
-
-            if len(license_name) > 0:
-                license_url = "https://spdx.org/licenses/" + license_name + ".html"
-        component_data = (
-            compid,
-            packagename,
-            packageversion,
-            bomformat,
-            license_name,
-            license_url,
-            summary,
-            purl,
-            pkgtype,
-        )
-        components_data.append(component_data)
-
-    return save_components_data(response, compid, bomformat, components_data)
+    with await spool_body(request) as spool:
+        components_data = SbomComponents(spool, "components", partial(cyclonedx_component, compid))
+        return await run_blocking(save_components_data, response, compid, "license", components_data)
 
 
 @app.post("/msapi/deppkg/spdx", tags=["spdx"])
@@ -1618,67 +4337,17 @@ async def spdx(request: Request, response: Response, compid: int):
     global dhurl
     global cookies
 
-    dhurl = f"{request.base_url.scheme}://{request.base_url.netloc}".replace("http:", "https:")
-
-    try:
-        resp = requests.head(dhurl, timeout=1)
-
-        if resp is None or resp.status_code != 200:
-            dhurl = f"{request.base_url.scheme}://{request.base_url.netloc}"
-    except Exception:
-        dhurl = f"{request.base_url.scheme}://{request.base_url.netloc}"
+    dhurl = await run_blocking(resolve_dhurl, request.base_url.scheme, request.base_url.netloc)
 
     cookies = request.cookies
 
-    spdx_json = await request.json()
-    components_data = []
-    components = spdx_json.get("packages", [])
-
-    # Parse SPDX BOM for licenses
-    bomformat = "license"
-    for component in components:
-        packagename = component.get("name")
-        packageversion = component.get("versionInfo", "")
-        extpkgs = component.get("externalRefs", [])
-        purl = ""
-        pkgtype = ""
-
-        for pkgref in extpkgs:
-            reftype = pkgref.get("referenceType", None)
-            if reftype is not None and reftype == "purl":
-                purl = pkgref.get("referenceLocator", "")
-
-                if ":" in purl:
-                    pkgtype = purl.split("/")[0][4:]
-
-        summary = ""
-        license_url = ""
-        license_name = ""
-        current_license = component.get("licenseDeclared", "NOASSERTION")
-
-        if current_license != "NOASSERTION":
-            license_name = current_license
-            license_url = "https://spdx.org/licenses/" + license_name + ".html"
-
-        if "," in license_name:
-            license_name = license_name.split(",", maxsplit=1)[0]
-
-        component_data = (
-            compid,
-            packagename,
-            packageversion,
-            bomformat,
-            license_name,
-            license_url,
-            summary,
-            purl,
-            pkgtype,
-        )
-        components_data.append(component_data)
+    with await spool_body(request) as spool:
+        components_data = SbomComponents(spool, "packages", partial(spdx_component, compid))
+        result = await run_blocking(save_components_data, response, compid, "license", components_data)
 
-    threading.Thread(target=update_vulns).start()
+    vuln_sweep.request(compid)
 
-    return save_components_data(response, compid, bomformat, components_data)
+    return result
 
 
 @app.post("/msapi/deppkg/safety", tags=["safety"])
@@ -1686,17 +4355,12 @@ async def safety(request: Request, response: Response, compid: int):
     """
     This is the end point used to upload a Python Safety SBOM
     """
-    global safety_db  # pylint: disable=W0603
-
     try:
-        result = requests.get(validateuser_url + "/msapi/validateuser", cookies=request.cookies, timeout=5)
-        if result is None:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authorization Failed")
-
-        if result.status_code != status.HTTP_200_OK:
+        status_code = await run_blocking(validate_user, request.cookies)
+        if status_code != status.HTTP_200_OK:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Authorization Failed status_code=" + str(result.status_code),
+                detail="Authorization Failed status_code=" + str(status_code),
             )
     except requests.exceptions.ConnectionError as conn_error:
         print("\n" + "=" * 80, flush=True)
@@ -1707,77 +4371,197 @@ async def safety(request: Request, response: Response, compid: int):
         print("=" * 80 + "\n", flush=True)
         raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail="Connection error")
 
-    if safety_db is None:
-        try:
-            url_res = requests.get(
-                "https://raw.githubusercontent.com/pyupio/safety-db/master/data/insecure_full.json",
-                timeout=5,
-            )
-            # FIX: Ensure url_res exists before checking status_code to satisfy linters
-            if url_res is not None:
-                if url_res.status_code == 502:
-                    print("\n" + "=" * 80, flush=True)
-                    print("502 BAD GATEWAY when fetching safety database", flush=True)
-                    print("=" * 80, flush=True)
-                    traceback.print_stack(file=sys.stdout)
-                    sys.stdout.flush()
-                    print("=" * 80 + "\n", flush=True)
+    # without the database the advisories would be stored without their CVE names
+    if safety_db.index is None:
+        await run_blocking(safety_db.wait_ready, safety_db_wait)
 
-                if url_res.status_code == 200:
-                    safety_db = json.loads(url_res.text)
-        except requests.exceptions.ConnectionError as conn_error:
-            print("\n" + "=" * 80, flush=True)
-            print("502 CONNECTION ERROR fetching safety database", flush=True)
-            print(f"Error: {str(conn_error)}", flush=True)
-            traceback.print_exc(file=sys.stdout)
-            sys.stdout.flush()
-            print("=" * 80 + "\n", flush=True)
+    with await spool_body(request) as spool:
+        components_data = SbomComponents(spool, None, partial(safety_component, compid))
+        return await run_blocking(save_components_data, response, compid, "cve", components_data)
 
-    safety_json = await request.json()
-    components_data = []
-    bomformat = "cve"
-    for component in safety_json:
-        packagename = component[0]  # name
-        packageversion = component[2]  # version
-        summary = component[3]
-        safety_id = component[4]  # cve id
-        cve_url = ""
-        cve_name = safety_id
-
-        # FIX: Ensure safety_db is not None before calling .get()
-        cve_detail = None
-        if safety_db is not None:
-            cve_detail = safety_db.get(packagename, None)
-
-        if cve_detail is not None:
-            for cve in cve_detail:
-                if cve["id"] == "pyup.io-" + safety_id:
-                    cve_name = cve["cve"]
-                    if cve_name.startswith("CVE"):
-                        cve_url = "https://nvd.nist.gov/vuln/detail/" + cve_name
-                    break
 
-        component_data = (
-            compid,
-            packagename,
-            packageversion,
-            bomformat,
-            cve_name,
-            cve_url,
-            summary,
-        )
-        components_data.append(component_data)
-    return save_components_data(response, compid, bomformat, components_data)
+componentdeps_columns = "compid, packagename, packageversion, deptype, name, url, summary, purl, pkgtype"
 
 
-def save_components_data(response, compid, bomformat, components_data):
-    try:
-        if len(components_data) == 0:
-            return {"detail": "components not updated"}
+def copy_value(value):
+    """
+    Format a value for the COPY text format.
 
-        # remove dups
-        components_data = list(set(components_data))
+    Args:
+        value: value to format
+
+    Returns:
+        string: the escaped value, \\N for None.
+    """
+    if value is None:
+        return "\\N"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+class CopyStream:
+    """
+    File-like object that renders rows in the COPY text format as COPY reads them,
+    so the whole payload is never held in memory.
+    """
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = ""
+        self.count = 0
+
+    def read(self, size=-1):
+        """
+        Read the next block of COPY data.
+
+        Args:
+            size (int): maximum number of characters to return, -1 for everything
+
+        Returns:
+            string: the COPY data, empty when all the rows have been read.
+        """
+        parts = [self.buffer]
+        length = len(self.buffer)
+        while size < 0 or length < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            line = "\t".join(copy_value(value) for value in row) + "\n"
+            parts.append(line)
+            length += len(line)
+            self.count += 1
+
+        data = "".join(parts)
+        if size < 0:
+            self.buffer = ""
+            return data
+        self.buffer = data[size:]
+        return data[:size]
+
+
+def componentdeps_row(component_data):
+    """
+    Pad a component tuple to the full dm.dm_componentdeps column list.
+
+    Args:
+        component_data (tuple): compid, packagename, packageversion, deptype, name, url, summary and optionally purl, pkgtype
+
+    Returns:
+        tuple: the nine column values.
+    """
+    if len(component_data) < 9:
+        return tuple(component_data) + (None,) * (9 - len(component_data))
+    return tuple(component_data)
+
+
+def pages(rows, page_size):
+    """
+    Split an iterable into lists of at most page_size items.
 
+    Args:
+        rows (iterable): rows to split
+        page_size (int): maximum number of rows per page
+
+    Returns:
+        generator: lists of rows.
+    """
+    page = []
+    for row in rows:
+        page.append(row)
+        if len(page) >= page_size:
+            yield page
+            page = []
+    if len(page) > 0:
+        yield page
+
+
+def stage_components(cursor, components_data):
+    """
+    Load component rows into the componentdeps_stage temporary table.
+
+    COMPONENT_LOAD_MODE selects how the rows are sent: copy streams them with COPY, values sends
+    multi-row INSERT pages and executemany is a statement per row.
+
+    Args:
+        cursor (cursor): cursor to run the load on
+        components_data (iterable): component tuples
+
+    Returns:
+        int: number of rows staged.
+    """
+    rows = (componentdeps_row(component_data) for component_data in components_data)
+
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS componentdeps_stage (LIKE dm.dm_componentdeps INCLUDING DEFAULTS) ON COMMIT DROP")
+
+    if component_load_mode == "executemany":
+        rows = list(rows)
+        sqlstmt = f"INSERT INTO componentdeps_stage({componentdeps_columns}) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)"
+        cursor.executemany(sqlstmt, rows)
+        return len(rows)
+
+    if component_load_mode == "values":
+        sqlstmt = f"INSERT INTO componentdeps_stage({componentdeps_columns}) VALUES %s"
+        rows_staged = 0
+        for page in pages(rows, component_page_size):
+            execute_values(cursor, sqlstmt, page, page_size=len(page))
+            rows_staged += len(page)
+        return rows_staged
+
+    stream = CopyStream(rows)
+    cursor.copy_expert(f"COPY componentdeps_stage ({componentdeps_columns}) FROM STDIN", stream)
+    return stream.count
+
+
+def apply_components(cursor, compid, bomformat):
+    """
+    Make the rows for the component match the staged rows, touching only what changed.
+
+    Args:
+        cursor (cursor): cursor with the componentdeps_stage table loaded
+        compid (int): id of the component
+        bomformat (string): dependency type of the rows, license or cve
+
+    Returns:
+        dict: number of rows added, removed and unchanged.
+    """
+    # the temp table has no statistics until it is analyzed, without them the planner guesses badly
+    cursor.execute("ANALYZE componentdeps_stage")
+
+    # rows are matched on a hash of the whole row so the joins can be hashed, the record text keeps NULL and '' apart
+    stage_hash = "md5(ROW(" + ", ".join(f"s.{column}" for column in componentdeps_columns.split(", ")) + ")::text)"
+    dep_hash = "md5(ROW(" + ", ".join(f"d.{column}" for column in componentdeps_columns.split(", ")) + ")::text)"
+
+    # remove the packages that are no longer in the SBOM
+    cursor.execute(
+        f"""
+        DELETE FROM dm.dm_componentdeps d WHERE d.compid = %s AND d.deptype = %s
+        AND NOT EXISTS (SELECT 1 FROM componentdeps_stage s WHERE {stage_hash} = {dep_hash})
+        """,
+        (compid, bomformat),
+    )
+    removed = max(cursor.rowcount, 0)
+
+    # everything left over is already in the SBOM
+    cursor.execute("SELECT count(*) FROM dm.dm_componentdeps WHERE compid = %s AND deptype = %s", (compid, bomformat))
+    unchanged = cursor.fetchone()[0]
+
+    # add the packages that are new, EXCEPT treats NULLs as equal and removes duplicates
+    cursor.execute(
+        f"""
+        INSERT INTO dm.dm_componentdeps({componentdeps_columns})
+        SELECT {componentdeps_columns} FROM componentdeps_stage
+        EXCEPT
+        SELECT {componentdeps_columns} FROM dm.dm_componentdeps WHERE compid = %s AND deptype = %s
+        ON CONFLICT ON CONSTRAINT dm_componentdeps_pkey DO NOTHING
+        """,
+        (compid, bomformat),
+    )
+    added = max(cursor.rowcount, 0)
+
+    return {"added": added, "removed": removed, "unchanged": unchanged}
+
+
+def save_components_data(response, compid, bomformat, components_data):
+    try:
         # Retry logic for failed query
         no_of_retry = db_conn_retry
         attempt = 1
@@ -1787,30 +4571,28 @@ def save_components_data(response, compid, bomformat, components_data):
                     conn = connection.connection
                     cursor = conn.cursor()
 
-                    # delete old licenses
-                    sqlstmt = "DELETE from dm.dm_componentdeps where compid=%s and deptype=%s"
-                    params = (
-                        compid,
-                        bomformat,
+                    started = monotonic()
+                    with metrics.timer("db_query_duration_seconds", {"operation": "stage_components"}):
+                        rows_staged = stage_components(cursor, components_data)
+                    if rows_staged == 0:
+                        conn.rollback()
+                        return {"detail": "components not updated"}
+
+                    with metrics.timer("db_query_duration_seconds", {"operation": "apply_components"}):
+                        counts = apply_components(cursor, compid, bomformat)
+
+                        # Commit the changes to the database
+                        conn.commit()
+                    metrics.inc("db_rows_inserted_total", {"table": "dm_componentdeps"}, counts["added"])
+                    print(
+                        f"Loaded {rows_staged} components for {compid} in {(monotonic() - started) * 1000:.1f} ms using {component_load_mode}: "
+                        + f"{counts['added']} added, {counts['removed']} removed, {counts['unchanged']} unchanged"
                     )
-                    cursor.execute(sqlstmt, params)
-
-                    # insert into database
-                    sqlstmt = """
-                        INSERT INTO dm.dm_componentdeps(compid, packagename, packageversion, deptype, name, url, summary, purl, pkgtype)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) ON CONFLICT ON CONSTRAINT dm_componentdeps_pkey DO NOTHING
-                    """
-
-                    cursor.executemany(sqlstmt, components_data)
-
-                    rows_inserted = cursor.rowcount
-                    # Commit the changes to the database
-                    conn.commit()
-                    if rows_inserted > 0:
+                    if counts["added"] > 0 or counts["removed"] > 0:
                         response.status_code = status.HTTP_201_CREATED
-                        return {"detail": "components updated succesfully"}
+                        return dict(counts, detail="components updated succesfully")
 
-                return {"detail": "components not updated"}
+                return dict(counts, detail="components not updated")
 
             except (InterfaceError, OperationalError) as ex:
                 if attempt < no_of_retry:
@@ -1836,39 +4618,19 @@ def save_components_data(response, compid, bomformat, components_data):
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(err)) from None
 
 
-@app.post("/msapi/purl2comp")
-async def purl2comp(request: Request, response: Response):
+async def authorize(request):
     """
-    This is the end point used to create a component from a purl
-    """
-
-    global dhurl
-    global cookies
-
-    dhurl = f"{request.base_url.scheme}://{request.base_url.netloc}".replace("http:", "https:")
-
-    try:
-        resp = requests.head(dhurl, timeout=1)
-
-        if resp is None or resp.status_code != 200:
-            dhurl = f"{request.base_url.scheme}://{request.base_url.netloc}"
-    except Exception:
-        dhurl = f"{request.base_url.scheme}://{request.base_url.netloc}"
-
-    # dhurl = "http://localhost:8181"
-    cookies = request.cookies
-
-    pprint(dhurl)
+    Validate the user of a request, raising a 401 if they are not logged in.
 
+    Args:
+        request (Request): the incoming request
+    """
     try:
-        result = requests.get(validateuser_url + "/msapi/validateuser", cookies=request.cookies, timeout=5)
-        if result is None:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authorization Failed")
-
-        if result.status_code != status.HTTP_200_OK:
+        status_code = await run_blocking(validate_user, request.cookies)
+        if status_code != status.HTTP_200_OK:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Authorization Failed status_code=" + str(result.status_code),
+                detail="Authorization Failed status_code=" + str(status_code),
             )
     except Exception as err:
         raise HTTPException(
@@ -1876,15 +4638,245 @@ async def purl2comp(request: Request, response: Response):
             detail="Authorization Failed:" + str(err),
         ) from None
 
+
+@app.post("/msapi/purl2comp", tags=["purl2comp"])
+async def purl2comp(request: Request, response: Response):
+    """
+    This is the end point used to create a component from a purl
+    """
+
+    global dhurl
+    global cookies
+
+    # other requests can change the globals while this one waits on the pool, so work with its own copies
+    req_dhurl = await run_blocking(resolve_dhurl, request.base_url.scheme, request.base_url.netloc)
+    req_cookies = request.cookies
+
+    pprint(req_dhurl)
+
+    await authorize(request)
+
+    # the sweep picks up the most recent server and session
+    dhurl = req_dhurl
+    cookies = req_cookies
+
     purl_json = await request.json()
     purl = purl_json.get("purl", None)
 
     if purl is None:
         return
 
-    create_compver(dhurl, cookies, purl)
+    created, _ = await run_blocking(create_compver, req_dhurl, req_cookies, purl)
+    if created is None:
+        deferred_purls.defer(req_dhurl, req_cookies, purl)
     return
 
 
+class PurlJob:
+    """
+    Batch of purls being turned into components in the background.
+    """
+
+    def __init__(self, purls, invalid):
+        self.job_id = uuid.uuid4().hex
+        self.lock = threading.Lock()
+        self.purls = {purl: {"status": "queued"} for purl in purls}
+        self.purls.update({purl: {"status": "failed", "error": "Invalid purl"} for purl in invalid})
+        self.created = datetime.now(timezone.utc).isoformat()
+        self.remaining = len(purls)
+        self.finished = self.created if self.remaining == 0 else None
+        self.finished_at = monotonic() if self.remaining == 0 else None
+
+    def run_purl(self, job_dhurl, job_cookies, purl, exists, record):
+        """
+        Create the component for one purl of the job.
+
+        Args:
+            job_dhurl (string): url to the server
+            job_cookies (string): cookies of the user that submitted the job
+            purl (string): purl to create the component for
+            exists (boolean): the component was already found by existing_purls
+            record (PurlRecord): the parsed purl
+        """
+        with self.lock:
+            self.purls[purl]["status"] = "running"
+
+        try:
+            created, error = create_compver(job_dhurl, job_cookies, purl, exists, record)
+        except Exception as err:
+            created, error = False, str(err)
+        finally:
+            purl_job_slots.release()
+
+        # a purl whose registry is unavailable finishes when its retry does
+        if created is None and deferred_purls.defer(job_dhurl, job_cookies, purl, record, self.finish_purl):
+            with self.lock:
+                self.purls[purl] = {"status": "deferred", "error": error}
+            return
+        self.finish_purl(purl, created, error)
+
+    def finish_purl(self, purl, created, error):
+        """
+        Record the outcome of one purl of the job.
+
+        Args:
+            purl (string): purl the component was created for
+            created (boolean): the component was created
+            error (string): reason it was not
+        """
+        result = {"status": "done"} if created else {"status": "failed", "error": error}
+        with self.lock:
+            self.purls[purl] = result
+            self.remaining -= 1
+            if self.remaining == 0:
+                self.finished = datetime.now(timezone.utc).isoformat()
+                self.finished_at = monotonic()
+
+    def status(self):
+        """
+        Get the progress of the job.
+
+        Returns:
+            dict: job id, state, counts per status and the status of each purl.
+        """
+        with self.lock:
+            counts = {"queued": 0, "running": 0, "deferred": 0, "done": 0, "failed": 0}
+            for purl_status in self.purls.values():
+                counts[purl_status["status"]] += 1
+            return {
+                "job_id": self.job_id,
+                "status": "completed" if self.finished is not None else "running",
+                "created": self.created,
+                "finished": self.finished,
+                "total": len(self.purls),
+                "counts": counts,
+                "purls": {purl: dict(purl_status) for purl, purl_status in self.purls.items()},
+            }
+
+
+class PurlJobStore:
+    """
+    Batch purl jobs by id.
+
+    Running jobs are never evicted. Finished jobs are kept for ttl seconds after they finish, and the
+    oldest of them make room for new jobs when the store is full.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, job):
+        """
+        Store a new job.
+
+        Args:
+            job (PurlJob): the job
+
+        Returns:
+            boolean: True if the job was stored, False if the store is full of running jobs.
+        """
+        with self.lock:
+            self.expire()
+            if len(self.jobs) >= self.maxsize:
+                oldest = next((job_id for job_id, stored in self.jobs.items() if stored.finished_at is not None), None)
+                if oldest is None:
+                    return False
+                del self.jobs[oldest]
+            self.jobs[job.job_id] = job
+            return True
+
+    def get(self, job_id):
+        """
+        Look up a job.
+
+        Args:
+            job_id (string): id of the job
+
+        Returns:
+            PurlJob: the job, None if it is unknown or finished more than ttl seconds ago.
+        """
+        with self.lock:
+            self.expire()
+            return self.jobs.get(job_id)
+
+    def expire(self):
+        """
+        Drop the jobs that finished more than ttl seconds ago, the caller holds the lock.
+        """
+        cutoff = monotonic() - self.ttl
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished_at is not None and job.finished_at <= cutoff]:
+            del self.jobs[job_id]
+
+    def stats(self):
+        """
+        Get the number of stored jobs.
+
+        Returns:
+            dict: jobs stored, running and the store size.
+        """
+        with self.lock:
+            running = sum(1 for job in self.jobs.values() if job.finished_at is None)
+            return {"size": len(self.jobs), "running": running, "maxsize": self.maxsize}
+
+
+purl_jobs = PurlJobStore(purl_job_store_size, purl_job_ttl)
+purl_job_slots = threading.BoundedSemaphore(purl_job_queue_size)
+
+
+@app.post("/msapi/purl2comp/batch", tags=["purl2comp"], status_code=status.HTTP_202_ACCEPTED)
+async def purl2comp_batch(request: Request):
+    """
+    This is the end point used to create the components for a list of purls in the background
+    """
+    job_dhurl = await run_blocking(resolve_dhurl, request.base_url.scheme, request.base_url.netloc)
+    await authorize(request)
+
+    purl_json = await request.json()
+    purls = purl_json.get("purls", None) if isinstance(purl_json, dict) else None
+
+    if not isinstance(purls, list) or not all(isinstance(purl, str) for purl in purls):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Expected a list of purls")
+
+    records = {purl: parse_purl(purl) for purl in dict.fromkeys(purl.strip() for purl in purls if purl.strip() != "")}
+    invalid = [purl for purl, record in records.items() if record is None]
+    purls = [purl for purl, record in records.items() if record is not None]
+
+    # reserve a slot for every purl up front so a job is either queued whole or rejected
+    taken = 0
+    while taken < len(purls) and purl_job_slots.acquire(blocking=False):
+        taken += 1
+    if taken < len(purls):
+        for _ in range(taken):
+            purl_job_slots.release()
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Too many purls queued, try again later")
+
+    job = PurlJob(purls, invalid)
+    if not purl_jobs.add(job):
+        for _ in range(taken):
+            purl_job_slots.release()
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Too many batch jobs running, try again later")
+    existing = await run_blocking(existing_purls, purls)
+    for purl in purls:
+        purl_job_executor.submit(job.run_purl, job_dhurl, request.cookies, purl, purl in existing, records[purl])
+
+    return {"job_id": job.job_id, "total": len(purls) + len(invalid), "invalid": len(invalid), "status_url": "/msapi/purl2comp/batch/" + job.job_id}
+
+
+@app.get("/msapi/purl2comp/batch/{job_id}", tags=["purl2comp"])
+async def purl2comp_batch_status(request: Request, job_id: str):
+    """
+    This is the end point used to get the progress of a batch purl to component job
+    """
+    await authorize(request)
+
+    job = purl_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return job.status()
+
+
 if __name__ == "__main__":
     uvicorn.run(app, port=5003)
@@ -0,0 +1,148 @@
+# Copyright (c) 2021 Linux Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=E0401,E0611
+# pyright: reportMissingImports=false,reportMissingModuleSource=false
+
+"""
+Local stand-in for the OSV API so the vulnerability sweep can be run offline.
+
+Serves /v1/query, /v1/querybatch and /v1/vulns/{id} from a JSON file holding a list of OSV
+vulnerability records.
+
+    OSV_STANDIN_DATA=vulns.json uvicorn osv_standin:app --port 5010
+    OSV_URL=http://localhost:5010 uvicorn main:app --port 5003
+"""
+
+import json
+import os
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request, status
+from packageurl import PackageURL
+
+osv_standin_data = os.getenv("OSV_STANDIN_DATA", "osv_vulns.json")
+osv_standin_page_size = int(os.getenv("OSV_STANDIN_PAGE_SIZE", "1000"))
+
+app = FastAPI(title="osv-standin")
+
+vulns = {}  # type: ignore
+if os.path.exists(osv_standin_data):
+    with open(osv_standin_data, mode="r", encoding="utf-8") as data_file:
+        vulns = {vuln["id"]: vuln for vuln in json.load(data_file)}
+
+
+def split_purl(purl):
+    """
+    Split a purl into the package purl and the version.
+
+    Args:
+        purl (string): package url
+
+    Returns:
+        list: [purl without version or qualifiers, version].
+    """
+    try:
+        purl_parts = PackageURL.from_string(purl)
+    except ValueError:
+        return [purl.lower(), None]
+
+    base = PackageURL(type=purl_parts.type, namespace=purl_parts.namespace, name=purl_parts.name).to_string()
+    return [base.lower(), purl_parts.version]
+
+
+def match_query(query):
+    """
+    Find the vulnerabilities matching an OSV query.
+
+    Args:
+        query (dict): OSV query
+
+    Returns:
+        list: ids of the matching vulnerabilities.
+    """
+    package = query.get("package", {})
+    version = query.get("version", None)
+    purl = None
+
+    if package.get("purl"):
+        purl, purl_version = split_purl(package["purl"])
+        version = purl_version or version
+
+    matches = []
+    for vulnid, vuln in vulns.items():
+        for affected in vuln.get("affected", []):
+            affected_pkg = affected.get("package", {})
+            if purl is not None:
+                if affected_pkg.get("purl") is None or split_purl(affected_pkg["purl"])[0] != purl:
+                    continue
+            elif affected_pkg.get("name", "").lower() != package.get("name", "").lower():
+                continue
+
+            if version is None or version in affected.get("versions", []):
+                matches.append(vulnid)
+                break
+    return matches
+
+
+def page_results(query):
+    """
+    Run a query and return the requested page of results.
+
+    Args:
+        query (dict): OSV query, optionally with a page_token
+
+    Returns:
+        dict: OSV result with the vulns and the next_page_token if there are more.
+    """
+    matches = match_query(query)
+    offset = int(query.get("page_token") or 0)
+    result = {"vulns": [{"id": vulnid, "modified": vulns[vulnid].get("modified", "")} for vulnid in matches[offset : offset + osv_standin_page_size]]}
+    if offset + osv_standin_page_size < len(matches):
+        result["next_page_token"] = str(offset + osv_standin_page_size)
+    return result
+
+
+@app.post("/v1/query")
+async def query(request: Request):
+    """
+    Return the full vulnerability records for a single query
+    """
+    matches = match_query(await request.json())
+    if len(matches) == 0:
+        return {}
+    return {"vulns": [vulns[vulnid] for vulnid in matches]}
+
+
+@app.post("/v1/querybatch")
+async def querybatch(request: Request):
+    """
+    Return the vulnerability ids for a batch of queries
+    """
+    queries = (await request.json()).get("queries", [])
+    return {"results": [page_results(query) for query in queries]}
+
+
+@app.get("/v1/vulns/{vulnid}")
+def vuln_detail(vulnid: str):
+    """
+    Return the full vulnerability record for an id
+    """
+    if vulnid not in vulns:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Bug not found.")
+    return vulns[vulnid]
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, port=5010)
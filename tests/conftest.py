@@ -0,0 +1,36 @@
+import os
+import sys
+
+import pytest
+import requests
+
+# main reads its configuration at import time and refuses to start without the validate user url
+os.environ.setdefault("VALIDATEUSER_URL", "http://localhost/msapi/validateuser")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def osv(monkeypatch):
+    """
+    Answer the OSV calls of main from osv_standin, refusing every other outbound call.
+
+    Tests put their records in osv.vulns and find every outbound call, as (kind, method, url), in osv.calls.
+    """
+    from fastapi.testclient import TestClient
+
+    import main
+    import osv_standin
+
+    client = TestClient(osv_standin.app)
+    calls = []
+
+    def http_request(method, url, kind, **kwargs):
+        calls.append((kind, method, url))
+        if not url.startswith(main.osv_url):
+            raise requests.exceptions.ConnectionError(f"No network in tests: {url}")
+        return client.request(method, url[len(main.osv_url) :], json=kwargs.get("json"))
+
+    monkeypatch.setattr(main, "http_request", http_request)
+    monkeypatch.setattr(osv_standin, "vulns", {})
+    monkeypatch.setattr(osv_standin, "calls", calls, raising=False)
+    yield osv_standin
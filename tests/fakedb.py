@@ -0,0 +1,124 @@
+import threading
+
+
+class FakeDatabase:
+    """
+    In-memory stand-in for the engine main gets its psycopg2 connections from.
+
+    Statements are routed to the first handler whose SQL fragment they contain. A handler gets the
+    statement and its parameters and returns the rows of a query, the rowcount of a change, or None.
+    Every statement is recorded with its whitespace collapsed so tests can assert on what ran.
+    """
+
+    def __init__(self):
+        self.handlers = []
+        self.statements = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.lock = threading.Lock()
+
+    def on(self, fragment, handler):
+        self.handlers.append((fragment, handler))
+        return self
+
+    def connect(self):
+        return FakeConnection(self)
+
+    def run(self, sql, params):
+        with self.lock:
+            self.statements.append((" ".join(sql.split()), params))
+        for fragment, handler in self.handlers:
+            if fragment in sql:
+                return handler(sql, params)
+        return None
+
+    def executed(self, fragment):
+        with self.lock:
+            return [params for sql, params in self.statements if fragment in sql]
+
+
+class FakeConnection:
+    """
+    Both the SQLAlchemy connection and the DBAPI connection behind it.
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self.connection = self
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def cursor(self, name=None):
+        return FakeCursor(self, name)
+
+    def commit(self):
+        with self.database.lock:
+            self.database.commits += 1
+
+    def rollback(self):
+        with self.database.lock:
+            self.database.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+class FakeCursor:
+    def __init__(self, connection, name=None):
+        self.connection = connection
+        self.name = name
+        self.itersize = 2000
+        self.rowcount = -1
+        self.rows = []
+
+    def execute(self, sql, params=None):
+        result = self.connection.database.run(sql, params)
+        if isinstance(result, int):
+            self.rows = []
+            self.rowcount = result
+        else:
+            self.rows = list(result or [])
+            self.rowcount = len(self.rows)
+
+    def executemany(self, sql, param_list):
+        total = 0
+        for params in param_list:
+            self.execute(sql, params)
+            total += max(self.rowcount, 0)
+        self.rowcount = total
+
+    def copy_expert(self, sql, stream):
+        self.execute(sql, stream.read())
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchmany(self, size=None):
+        size = self.itersize if size is None else size
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+    def fetchall(self):
+        batch, self.rows = self.rows, []
+        return batch
+
+    def __iter__(self):
+        while self.rows:
+            yield self.rows.pop(0)
+
+    def close(self):
+        pass
+
+
+def execute_values(cursor, sql, argslist, template=None, page_size=100, fetch=False):
+    """
+    Replacement for psycopg2.extras.execute_values, which needs a real connection to mogrify the rows.
+    The handler gets the statement with the page of rows as its parameters.
+    """
+    cursor.execute(sql, list(argslist))
@@ -0,0 +1,87 @@
+import time
+
+import main
+
+
+def test_ttl_cache_expires_and_evicts():
+    cache = main.TTLCache(2, 60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)  # b is the least recently used
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+    cache.put("short", 4, ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get("short", "gone") == "gone"
+
+    cache.discard("a")
+    assert cache.get("a") is None
+    cache.put(("pkg", 1), 5)
+    cache.discard_where(lambda key: isinstance(key, tuple))
+    assert cache.get(("pkg", 1)) is None
+
+    stats = cache.stats()
+    assert stats["maxsize"] == 2
+    assert stats["hits"] == 3
+    assert stats["misses"] == 4
+
+
+class FakeResponse:
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+def test_validate_user_caches_only_successes(monkeypatch):
+    calls = []
+
+    def validateuser(method, url, kind, **kwargs):
+        calls.append(kwargs["cookies"]["token"])
+        return FakeResponse(200 if kwargs["cookies"]["token"] == "good" else 401)
+
+    monkeypatch.setattr(main, "http_request", validateuser)
+    monkeypatch.setattr(main, "validateuser_cache", main.TTLCache(10, 60))
+
+    assert [main.validate_user({"token": "good"}) for _ in range(3)] == [200, 200, 200]
+    assert [main.validate_user({"token": "bad"}) for _ in range(2)] == [401, 401]
+    assert calls == ["good", "bad", "bad"]
+
+
+def test_component_lookups_are_cached_per_session(monkeypatch):
+    calls = []
+
+    def get_json(url, cookies):
+        calls.append((url, cookies["token"]))
+        return {"success": True, "result": {"id": 42 if cookies["token"] == "alice" else 43, "name": "requests;2_31_0", "domain": "GLOBAL"}}
+
+    monkeypatch.setattr(main, "get_json", get_json)
+    monkeypatch.setattr(main, "component_cache", main.TTLCache(100, 60))
+    compname = "GLOBAL.Open Source.pypi.requests"
+
+    assert main.get_component("https://dh.example", {"token": "alice"}, compname, "2_31_0", "", True, False) == [42, "requests;2_31_0"]
+    assert main.get_component("https://dh.example", {"token": "alice"}, compname, "2_31_0", "", True, False) == [42, "requests;2_31_0"]
+    # another user can see different components, so they get their own lookup
+    assert main.get_component("https://dh.example", {"token": "bob"}, compname, "2_31_0", "", True, False) == [43, "requests;2_31_0"]
+    assert len(calls) == 2
+
+    # the latest version changes whenever one is created, so it always goes to the server
+    main.get_component("https://dh.example", {"token": "alice"}, compname, "", "", True, True)
+    main.get_component("https://dh.example", {"token": "alice"}, compname, "", "", True, True)
+    assert len(calls) == 4
+
+    assert main.get_component_name("https://dh.example", {"token": "alice"}, 42) == "GLOBAL.requests;2_31_0"
+    assert main.get_component_name("https://dh.example", {"token": "alice"}, 42) == "GLOBAL.requests;2_31_0"
+    assert main.get_component_name("https://dh.example", {"token": "bob"}, 42) == "GLOBAL.requests;2_31_0"
+    assert len(calls) == 6
+
+    # creating a version drops the lookups of every session
+    main.forget_component("https://dh.example", compname + ";2_31_0", 42)
+    main.get_component("https://dh.example", {"token": "bob"}, compname, "2_31_0", "", True, False)
+    main.get_component_name("https://dh.example", {"token": "alice"}, 42)
+    assert len(calls) == 8
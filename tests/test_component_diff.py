@@ -0,0 +1,117 @@
+import fakedb
+import pytest
+from fastapi import Response
+from sqlalchemy.exc import OperationalError
+
+import main
+
+
+def componentdeps_database():
+    """
+    A fake with dm.dm_componentdeps modelled as a set of rows per component and dependency type.
+
+    Rows are compared as whole tuples, the way apply_components compares the md5 of the row text,
+    so NULL and '' stay different.
+    """
+    database = fakedb.FakeDatabase()
+    database.tables = {}
+    database.stage = []
+
+    def rows(params):
+        return database.tables.setdefault(tuple(params), set())
+
+    def create_stage(sql, params):
+        database.stage = []
+
+    def stage(sql, params):
+        database.stage.extend(params)
+        return len(params)
+
+    def delete(sql, params):
+        current = rows(params)
+        removed = current - set(database.stage)
+        current -= removed
+        return len(removed)
+
+    def count(sql, params):
+        return [(len(rows(params)),)]
+
+    def insert(sql, params):
+        current = rows(params)
+        added = set(database.stage) - current
+        current |= added
+        return len(added)
+
+    database.on("CREATE TEMP TABLE", create_stage)
+    database.on("INSERT INTO componentdeps_stage", stage)
+    database.on("DELETE FROM dm.dm_componentdeps d", delete)
+    database.on("SELECT count(*) FROM dm.dm_componentdeps", count)
+    database.on("INSERT INTO dm.dm_componentdeps", insert)
+    return database
+
+
+@pytest.fixture
+def database(monkeypatch):
+    database = componentdeps_database()
+    monkeypatch.setattr(main, "engine", database)
+    monkeypatch.setattr(main, "execute_values", fakedb.execute_values)
+    monkeypatch.setattr(main, "component_load_mode", "values")
+    return database
+
+
+def sbom(versions):
+    return [(7, f"pkg{number}", version, "license", "MIT", None if number % 2 else "", "") for number, version in enumerate(versions)]
+
+
+def test_reload_touches_only_the_changed_rows(database):
+    response = Response()
+    result = main.save_components_data(response, 7, "license", sbom(["1.0"] * 10))
+    assert response.status_code == 201
+    assert (result["added"], result["removed"], result["unchanged"]) == (10, 0, 0)
+
+    # the same SBOM again changes nothing
+    response = Response()
+    result = main.save_components_data(response, 7, "license", sbom(["1.0"] * 10))
+    assert response.status_code == 200
+    assert result["detail"] == "components not updated"
+    assert (result["added"], result["removed"], result["unchanged"]) == (0, 0, 10)
+
+    # two upgraded packages replace their old rows, a dropped package is removed
+    response = Response()
+    result = main.save_components_data(response, 7, "license", sbom(["1.0"] * 3 + ["2.0"] * 2 + ["1.0"] * 4))
+    assert response.status_code == 201
+    assert (result["added"], result["removed"], result["unchanged"]) == (2, 3, 7)
+    assert {row[2] for row in database.tables[(7, "license")]} == {"1.0", "2.0"}
+    assert len(database.tables[(7, "license")]) == 9
+    assert database.commits == 3
+
+
+def test_null_and_empty_values_are_different_rows(database):
+    main.save_components_data(Response(), 7, "license", [(7, "pkg", "1.0", "license", "MIT", None, "")])
+    result = main.save_components_data(Response(), 7, "license", [(7, "pkg", "1.0", "license", "MIT", "", "")])
+    assert (result["added"], result["removed"], result["unchanged"]) == (1, 1, 0)
+
+
+def test_empty_sbom_leaves_the_rows_alone(database):
+    main.save_components_data(Response(), 7, "license", sbom(["1.0"] * 3))
+    result = main.save_components_data(Response(), 7, "license", [])
+    assert result == {"detail": "components not updated"}
+    assert database.rollbacks == 1
+    assert len(database.tables[(7, "license")]) == 3
+
+
+def test_connection_errors_are_retried(database, monkeypatch):
+    connect = database.connect
+    attempts = []
+
+    def flaky_connect():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise OperationalError("connect", {}, Exception("server closed the connection"))
+        return connect()
+
+    monkeypatch.setattr(database, "connect", flaky_connect)
+    monkeypatch.setattr(main, "sleep", lambda seconds: None)
+    result = main.save_components_data(Response(), 7, "license", sbom(["1.0"] * 2))
+    assert result["added"] == 2
+    assert len(attempts) == 2
@@ -0,0 +1,78 @@
+import re
+
+import fakedb
+import pytest
+
+import main
+
+
+def copy_unescape(value):
+    if value == "\\N":
+        return None
+    return re.sub(r"\\(.)", lambda match: {"t": "\t", "n": "\n", "r": "\r"}.get(match.group(1), match.group(1)), value)
+
+
+def staging_database():
+    # collects the rows each load mode sends to the componentdeps_stage table
+    database = fakedb.FakeDatabase()
+    database.staged = []
+
+    def insert(sql, params):
+        if params and isinstance(params[0], tuple):
+            database.staged.extend(params)
+        else:
+            database.staged.append(tuple(params))
+        return 1
+
+    def copy(sql, data):
+        for line in data.splitlines():
+            database.staged.append(tuple(copy_unescape(value) for value in line.split("\t")))
+
+    database.on("INSERT INTO componentdeps_stage", insert)
+    database.on("COPY componentdeps_stage", copy)
+    return database
+
+
+def test_copy_stream_renders_copy_text_format():
+    rows = [
+        main.componentdeps_row((1, "pkg", "1.0", "license", "MIT", None, "tab\there")),
+        main.componentdeps_row((1, "pkg", "1.0", "cve", "CVE-1", "http://x", "line\nback\\slash", "pkg:pypi/pkg@1.0", "pypi")),
+    ]
+    expected = "1\tpkg\t1.0\tlicense\tMIT\t\\N\ttab\\there\t\\N\t\\N\n" + "1\tpkg\t1.0\tcve\tCVE-1\thttp://x\tline\\nback\\\\slash\tpkg:pypi/pkg@1.0\tpypi\n"
+
+    stream = main.CopyStream(rows)
+    assert stream.read() == expected
+    assert stream.read() == ""
+    assert stream.count == 2
+
+    # COPY reads fixed size blocks, which must join back into the same data
+    stream = main.CopyStream(rows)
+    blocks = []
+    while True:
+        block = stream.read(5)
+        if block == "":
+            break
+        assert len(block) <= 5
+        blocks.append(block)
+    assert "".join(blocks) == expected
+    assert stream.count == 2
+
+
+@pytest.mark.parametrize("mode", ["executemany", "values", "copy"])
+def test_stage_components_sends_the_same_rows_in_every_mode(monkeypatch, mode):
+    components = [(7, f"pkg{number}", "1.0", "license", "MIT", "" if number % 2 else None, "s\tummary") for number in range(25)]
+    components.append((7, "pkg", "2.0", "license", "MIT", "http://x", "", "pkg:pypi/pkg@2.0", "pypi"))
+    monkeypatch.setattr(main, "component_load_mode", mode)
+    monkeypatch.setattr(main, "component_page_size", 10)
+    monkeypatch.setattr(main, "execute_values", fakedb.execute_values)
+    database = staging_database()
+
+    with database.connect() as connection:
+        staged = main.stage_components(connection.cursor(), iter(components))
+
+    assert staged == len(components)
+    # COPY sends text, Postgres casts it back to the column types
+    as_text = [tuple(None if value is None else str(value) for value in row) for row in database.staged]
+    assert as_text == [tuple(None if value is None else str(value) for value in main.componentdeps_row(component)) for component in components]
+    if mode == "values":
+        assert len(database.executed("INSERT INTO componentdeps_stage")) == 3
@@ -0,0 +1,71 @@
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import main
+
+
+def git(*args, cwd=None):
+    result = subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True, text=True)
+    return result.stdout.strip()
+
+
+@pytest.fixture
+def bare_repo(tmp_path):
+    """
+    A local bare repository with a lightweight tag and an annotated tag on different commits.
+    """
+    work = tmp_path / "work"
+    work.mkdir()
+    git("init", "-q", cwd=work)
+    identity = ["-c", "user.name=test", "-c", "user.email=test@example.com"]
+    shas = {}
+    for version in ["1.0.0", "2.0.0"]:
+        (work / "VERSION").write_text(version)
+        git("add", "VERSION", cwd=work)
+        git(*identity, "commit", "-q", "-m", version, cwd=work)
+        shas[version] = git("rev-parse", "HEAD", cwd=work)
+    git("tag", "v1.0.0", shas["1.0.0"], cwd=work)
+    git(*identity, "tag", "-a", "2.0.0", "-m", "release 2.0.0", shas["2.0.0"], cwd=work)
+
+    bare = tmp_path / "repo.git"
+    git("clone", "-q", "--bare", str(work), str(bare))
+    main.git_refs_cache.discard_where(lambda key: True)
+    yield str(bare), shas
+    main.git_refs_cache.discard_where(lambda key: True)
+
+
+def test_get_commit_sha_resolves_tags_from_bare_repo(bare_repo):
+    repo_url, shas = bare_repo
+    cwd = os.getcwd()
+
+    assert main.get_commit_sha(repo_url, "1.0.0") == shas["1.0.0"]  # lightweight tag with a v prefix
+    assert main.get_commit_sha(repo_url, "2.0.0") == shas["2.0.0"]  # annotated tag peeled to its commit
+    assert main.get_commit_sha(repo_url, "3.0.0") is None
+    assert main.get_commit_sha(repo_url, None) is None
+    assert os.getcwd() == cwd
+
+
+def test_get_commit_sha_concurrent_lookups_share_one_ls_remote(bare_repo, monkeypatch):
+    repo_url, shas = bare_repo
+    cwd = os.getcwd()
+    calls = []
+    calls_lock = threading.Lock()
+    real_run = subprocess.run
+
+    def counting_run(args, **kwargs):
+        with calls_lock:
+            calls.append(args)
+        return real_run(args, **kwargs)
+
+    monkeypatch.setattr(main.subprocess, "run", counting_run)
+    versions = ["1.0.0", "2.0.0", "3.0.0"] * 100
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        results = list(pool.map(lambda version: main.get_commit_sha(repo_url, version), versions))
+
+    assert results == [shas.get(version) for version in versions]
+    assert len(calls) == 1
+    assert os.getcwd() == cwd
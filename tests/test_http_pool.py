@@ -0,0 +1,50 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import main
+
+
+def serve(protocol_version):
+    accepted = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def setup(self):
+            accepted.append(self.client_address)
+            super().setup()
+
+        def do_GET(self):  # pylint: disable=C0103
+            body = b"ok"
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    Handler.protocol_version = protocol_version
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, accepted
+
+
+@pytest.mark.parametrize("protocol_version", ["HTTP/1.0", "HTTP/1.1"])
+def test_connections_count_tcp_connects(monkeypatch, protocol_version):
+    monkeypatch.setattr(main, "http_stats", {})
+    server, accepted = serve(protocol_version)
+    session = main.new_http_session()
+    try:
+        for _ in range(5):
+            assert session.get(f"http://127.0.0.1:{server.server_address[1]}/", timeout=5).status_code == 200
+    finally:
+        session.close()
+        server.shutdown()
+        server.server_close()
+
+    stats = main.get_http_stats()["127.0.0.1"]
+    assert stats["requests"] == 5
+    # an HTTP/1.0 server closes every connection, a keep-alive server gets one connection for all five requests
+    assert stats["connections"] == len(accepted) == (5 if protocol_version == "HTTP/1.0" else 1)
+    assert stats["reused"] == 5 - len(accepted)
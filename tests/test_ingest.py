@@ -0,0 +1,66 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import fakedb
+import httpx
+import pytest
+
+import main
+
+uploads = 8
+
+
+def slow(seconds, result):
+    def call(*args):
+        time.sleep(seconds)
+        return result
+
+    return call
+
+
+@pytest.fixture
+def ingest(monkeypatch):
+    database = fakedb.FakeDatabase().on("SELECT 1", lambda sql, params: [(1,)])
+    monkeypatch.setattr(main, "engine", database)
+    # the HEAD to DeployHub, the validateuser call and the database load each block their thread
+    monkeypatch.setattr(main, "resolve_dhurl", slow(0.2, "https://dh.example"))
+    monkeypatch.setattr(main, "validate_user", slow(0.2, 200))
+    monkeypatch.setattr(main, "save_components_data", slow(0.5, {"detail": "components updated"}))
+    executor = ThreadPoolExecutor(max_workers=uploads, thread_name_prefix="ingest")
+    monkeypatch.setattr(main, "ingest_executor", executor)
+    yield database
+    executor.shutdown(wait=True)
+
+
+async def upload_while_checking_health():
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://testserver", cookies={"token": "alice"}) as client:
+
+        async def upload(compid):
+            return await client.post(f"/msapi/deppkg/cyclonedx?compid={compid}", json={"components": []})
+
+        async def health():
+            started = time.perf_counter()
+            response = await client.get("/health")
+            return response, time.perf_counter() - started
+
+        started = time.perf_counter()
+        pending = [asyncio.create_task(upload(compid)) for compid in range(uploads)]
+        checks = []
+        while not all(task.done() for task in pending):
+            checks.append(await health())
+            await asyncio.sleep(0.05)
+        responses = await asyncio.gather(*pending)
+        return responses, checks, time.perf_counter() - started
+
+
+def test_health_stays_fast_during_concurrent_uploads(ingest):
+    responses, checks, elapsed = asyncio.run(upload_while_checking_health())
+
+    assert [response.status_code for response in responses] == [200] * uploads
+    # each upload blocks for 0.9 seconds, run one after another they would take over 7
+    assert elapsed < 3
+    assert len(checks) >= 5
+    assert all(response.json()["status"] == "UP" for response, _ in checks)
+    assert max(latency for _, latency in checks) < 0.3
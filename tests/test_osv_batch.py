@@ -0,0 +1,54 @@
+import main
+
+
+def osv_record(vulnid, name, versions, modified="2024-01-01T00:00:00Z"):
+    return {"id": vulnid, "modified": modified, "summary": vulnid, "affected": [{"package": {"purl": f"pkg:pypi/{name}"}, "versions": versions}]}
+
+
+def detail_fetches(osv):
+    return [call[2].rsplit("/", 1)[1] for call in osv.calls if call[0] == "osv"]
+
+
+def test_querybatch_pages_and_fans_out_records(osv, monkeypatch):
+    monkeypatch.setattr(main, "vuln_detail_cache", main.TTLCache(100, 60))
+    monkeypatch.setattr(main, "osv_batch_size", 2)
+    monkeypatch.setattr(osv, "osv_standin_page_size", 1)
+    osv.vulns["PYSEC-1"] = osv_record("PYSEC-1", "django", ["1.0", "2.0"])
+    osv.vulns["PYSEC-2"] = osv_record("PYSEC-2", "django", ["1.0"])
+    payloads = [main.osv_payload("django", version, f"pkg:pypi/django@{version}")[0] for version in ["1.0", "2.0", "3.0"]]
+
+    results = main.get_vulns_batch(payloads)
+
+    assert [[vuln["id"] for vuln in result] for result in results] == [["PYSEC-1", "PYSEC-2"], ["PYSEC-1"], []]
+    # the first query pages through both of its vulnerabilities, two batches are needed for three queries
+    assert len([call for call in osv.calls if call[0] == "osv_batch"]) == 3
+    assert sorted(detail_fetches(osv)) == ["PYSEC-1", "PYSEC-2"]
+
+
+def test_details_are_cached_across_batches_until_modified(osv, monkeypatch):
+    monkeypatch.setattr(main, "vuln_detail_cache", main.TTLCache(100, 60))
+    osv.vulns["PYSEC-1"] = osv_record("PYSEC-1", "django", ["1.0", "2.0"])
+    payloads = [main.osv_payload("django", version, f"pkg:pypi/django@{version}")[0] for version in ["1.0", "2.0"]]
+
+    assert main.get_vulns_batch(payloads[:1])[0][0]["summary"] == "PYSEC-1"
+    assert main.get_vulns_batch(payloads[1:])[0][0]["summary"] == "PYSEC-1"
+    assert detail_fetches(osv) == ["PYSEC-1"]
+
+    # OSV changed the record, so the next batch fetches the new version
+    osv.vulns["PYSEC-1"] = dict(osv_record("PYSEC-1", "django", ["1.0", "2.0"], "2024-02-01T00:00:00Z"), summary="updated")
+    assert main.get_vulns_batch(payloads)[1][0]["summary"] == "updated"
+    assert detail_fetches(osv) == ["PYSEC-1", "PYSEC-1"]
+
+
+def test_failed_detail_fetch_is_not_cached(osv, monkeypatch):
+    monkeypatch.setattr(main, "vuln_detail_cache", main.TTLCache(100, 60))
+    osv.vulns["PYSEC-1"] = osv_record("PYSEC-1", "django", ["1.0"])
+    payload = main.osv_payload("django", "1.0", "pkg:pypi/django@1.0")[0]
+    real_detail = main.get_vuln_detail
+    monkeypatch.setattr(main, "get_vuln_detail", lambda vulnid: None)
+
+    # the package is not reported as clean when its vulnerability could not be read
+    assert main.get_vulns_batch([payload]) == [None]
+    monkeypatch.setattr(main, "get_vuln_detail", real_detail)
+    assert main.get_vulns_batch([payload])[0][0]["id"] == "PYSEC-1"
+    assert main.get_vulns_batch([]) == []
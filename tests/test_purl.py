@@ -0,0 +1,80 @@
+import fakedb
+import pytest
+
+import main
+
+
+def old_clean_name(name):
+    # the chained replace the translate table replaced
+    if name is None:
+        return name
+
+    name = name.replace(".", "_")
+    name = name.replace("-", "_")
+    name = name.replace("/", ".")
+    name = name.replace("+", "_")
+    name = name.replace(":", "_")
+    name = name.replace("~", "_")
+    name = name.replace("(", "")
+    name = name.replace(")", "")
+    name = name.replace("#", "_")
+    name = name.replace("@", "")
+    return name
+
+
+@pytest.mark.parametrize(
+    "name",
+    [None, "", "requests", "zope.interface", "@angular/core", "foo-bar_baz", "1.2.3+build~rc(1)#frag", "a:b/c.d-e", "..//--"],
+)
+def test_clean_name_matches_replace_chain(name):
+    assert main.clean_name(name) == old_clean_name(name)
+    assert main.clean_name.__wrapped__(name) == old_clean_name(name)
+
+
+def test_parse_purl_matches_create_compver_names():
+    record = main.parse_purl("pkg:npm/%40angular/core@16.2.0-rc.1?arch=x86#sub/path")
+    assert record.domain == "GLOBAL.Open Source.npm.angular"
+    assert record.compname == "core;16_2_0_rc_1"
+    assert record.variant == "16_2_0_rc_1"
+    assert record.package == "core"
+    assert record.base == "pkg:npm/%40angular/core@16.2.0-rc.1"
+    assert main.parse_purl("pkg:pypi/zope.interface") is main.parse_purl("pkg:pypi/zope.interface?x=1")
+    assert main.parse_purl("notapurl") is None
+    assert main.parse_purl(" ") is None
+    with pytest.raises(AttributeError):
+        record.name = "other"
+
+
+def test_create_compver_hands_its_record_down(monkeypatch):
+    record = main.parse_purl("pkg:pypi/requests@2.31.0?os=linux")
+    seen = []
+
+    def no_reparse(purl):
+        raise AssertionError("purl parsed again")
+
+    def commit_lookup(purl_record, purl):
+        seen.append((purl_record, purl))
+        return {"repo_url": None, "commit_sha": None}
+
+    monkeypatch.setattr(main, "parse_purl", no_reparse)
+    monkeypatch.setattr(main, "get_component", lambda *args: [5, ""])
+    monkeypatch.setattr(main, "get_component_name", lambda *args: "GLOBAL.Open Source.pypi.requests;2_31_0")
+    monkeypatch.setattr(main, "get_commit_from_purl_cached", commit_lookup)
+
+    assert main.create_compver("http://dh", {}, "pkg:pypi/requests@2.31.0?os=linux", True, record) == [True, ""]
+    assert seen == [(record, "pkg:pypi/requests@2.31.0?os=linux")]
+
+
+def test_commit_cache_is_keyed_by_the_record_base(monkeypatch):
+    database = fakedb.FakeDatabase()
+    database.on("select repourl, commitsha from dm.dm_purlcommit", lambda sql, params: [])
+    monkeypatch.setattr(main, "engine", database)
+    monkeypatch.setattr(main, "schema_ready", True)
+    monkeypatch.setattr(main, "getCommitFromPurl", lambda *args: {"repo_url": "https://github.com/psf/requests", "commit_sha": "abc"})
+
+    record = main.parse_purl("pkg:pypi/requests@2.31.0?os=linux")
+    results = main.get_commit_from_purl_cached(record, "pkg:pypi/requests@2.31.0?os=linux")
+
+    assert results["commit_sha"] == "abc"
+    assert database.executed("select repourl")[0][0] == "pkg:pypi/requests@2.31.0"
+    assert database.executed("insert into dm.dm_purlcommit")[0] == ("pkg:pypi/requests@2.31.0", "https://github.com/psf/requests", "abc")
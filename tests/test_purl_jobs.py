@@ -0,0 +1,120 @@
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main, "resolve_dhurl", lambda scheme, netloc: "https://dh.example")
+    monkeypatch.setattr(main, "validate_user", lambda cookies: 200)
+    monkeypatch.setattr(main, "existing_purls", lambda purls: {purl for purl in purls if "exists" in purl})
+    monkeypatch.setattr(main, "purl_jobs", main.PurlJobStore(10, 60))
+    monkeypatch.setattr(main, "deferred_purls", main.DeferredPurls(10, 3))
+    client = TestClient(main.app)
+    client.cookies.set("token", "alice")
+    return client
+
+
+def wait_for_job(client, job_id, state="completed"):
+    for _ in range(200):
+        job = client.get("/msapi/purl2comp/batch/" + job_id).json()
+        if job["status"] == state:
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"job did not reach {state}: {job}")
+
+
+def test_batch_reports_each_purl(client, monkeypatch):
+    calls = []
+
+    def create_compver(purl_dhurl, purl_cookies, purl, exists=False, record=None):
+        calls.append((purl_dhurl, purl_cookies, purl, exists, record.base))
+        return [False, "Component could not be created"] if "broken" in purl else [True, ""]
+
+    monkeypatch.setattr(main, "create_compver", create_compver)
+    purls = ["pkg:pypi/requests@2.31.0", "pkg:pypi/exists@1.0", " pkg:pypi/requests@2.31.0 ", "pkg:npm/broken@1.0", "notapurl", ""]
+    response = client.post("/msapi/purl2comp/batch", json={"purls": purls})
+    assert response.status_code == 202
+    submitted = response.json()
+    assert (submitted["total"], submitted["invalid"]) == (4, 1)
+
+    job = wait_for_job(client, submitted["job_id"])
+    assert job["counts"] == {"queued": 0, "running": 0, "deferred": 0, "done": 2, "failed": 2}
+    assert job["purls"]["notapurl"] == {"status": "failed", "error": "Invalid purl"}
+    assert job["purls"]["pkg:npm/broken@1.0"] == {"status": "failed", "error": "Component could not be created"}
+    assert sorted(calls) == [
+        ("https://dh.example", {"token": "alice"}, "pkg:npm/broken@1.0", False, "pkg:npm/broken@1.0"),
+        ("https://dh.example", {"token": "alice"}, "pkg:pypi/exists@1.0", True, "pkg:pypi/exists@1.0"),
+        ("https://dh.example", {"token": "alice"}, "pkg:pypi/requests@2.31.0", False, "pkg:pypi/requests@2.31.0"),
+    ]
+
+
+def test_purl_with_unavailable_registry_is_deferred_until_its_retry(client, monkeypatch):
+    monkeypatch.setattr(main, "breaker_reset_timeout", 0.2)
+    attempts = []
+
+    def create_compver(purl_dhurl, purl_cookies, purl, exists=False, record=None):
+        attempts.append(purl_cookies)
+        return [None, "Circuit open for pypi"] if len(attempts) == 1 else [True, ""]
+
+    monkeypatch.setattr(main, "create_compver", create_compver)
+    job_id = client.post("/msapi/purl2comp/batch", json={"purls": ["pkg:pypi/requests@2.31.0"]}).json()["job_id"]
+
+    job = None
+    for _ in range(50):
+        job = client.get("/msapi/purl2comp/batch/" + job_id).json()
+        if job["counts"]["deferred"] == 1:
+            break
+        time.sleep(0.01)
+    assert job["status"] == "running"
+    assert job["purls"]["pkg:pypi/requests@2.31.0"] == {"status": "deferred", "error": "Circuit open for pypi"}
+
+    job = wait_for_job(client, job_id)
+    assert job["counts"]["done"] == 1
+    assert attempts == [{"token": "alice"}, {"token": "alice"}]
+
+
+def test_running_jobs_are_not_evicted(client, monkeypatch):
+    release = threading.Event()
+
+    def create_compver(purl_dhurl, purl_cookies, purl, exists=False, record=None):
+        release.wait(5)
+        return [True, ""]
+
+    monkeypatch.setattr(main, "create_compver", create_compver)
+    monkeypatch.setattr(main, "purl_jobs", main.PurlJobStore(2, 60))
+    first = client.post("/msapi/purl2comp/batch", json={"purls": ["pkg:pypi/a@1"]}).json()["job_id"]
+    second = client.post("/msapi/purl2comp/batch", json={"purls": ["pkg:pypi/b@1"]}).json()["job_id"]
+
+    response = client.post("/msapi/purl2comp/batch", json={"purls": ["pkg:pypi/c@1"]})
+    assert response.status_code == 503
+    assert client.get("/msapi/purl2comp/batch/" + first).json()["status"] == "running"
+
+    # once the jobs finish the oldest one makes room for a new job
+    release.set()
+    wait_for_job(client, first)
+    wait_for_job(client, second)
+    third = client.post("/msapi/purl2comp/batch", json={"purls": ["pkg:pypi/c@1"]})
+    assert third.status_code == 202
+    assert client.get("/msapi/purl2comp/batch/" + first).status_code == 404
+    assert client.get("/msapi/purl2comp/batch/" + second).status_code == 200
+    wait_for_job(client, third.json()["job_id"])
+
+
+def test_finished_jobs_expire_after_the_ttl(monkeypatch):
+    store = main.PurlJobStore(10, 0.05)
+    job = main.PurlJob([], ["notapurl"])
+    assert store.add(job)
+    assert store.get(job.job_id) is job
+    time.sleep(0.06)
+    assert store.get(job.job_id) is None
+
+
+def test_batch_rejects_bad_requests(client):
+    assert client.post("/msapi/purl2comp/batch", json={"purls": "pkg:pypi/a@1"}).status_code == 400
+    assert client.post("/msapi/purl2comp/batch", json=["pkg:pypi/a@1"]).status_code == 400
+    assert client.get("/msapi/purl2comp/batch/unknown").status_code == 404
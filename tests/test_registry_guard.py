@@ -0,0 +1,145 @@
+import threading
+import time
+
+import fakedb
+import pytest
+import requests
+
+import main
+
+
+def test_circuit_breaker_opens_and_recovers():
+    breaker = main.CircuitBreaker(2, 0.05)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.status()["state"] == "open"
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.status()["state"] == "half_open"
+    assert not breaker.allow()  # only one trial call at a time
+
+    breaker.record_failure()  # a failed trial opens the circuit again
+    assert breaker.status()["state"] == "open"
+    assert breaker.status()["trips"] == 2
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.status()["state"] == "closed"
+    assert breaker.status()["failures"] == 0
+
+
+def test_circuit_breaker_stale_trial_does_not_stay_half_open():
+    breaker = main.CircuitBreaker(1, 0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()  # the trial call never reports back
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+
+
+def test_call_upstream_counts_exceptions_as_failures(monkeypatch):
+    def fail(method, url, **kwargs):
+        raise requests.exceptions.ChunkedEncodingError("truncated")
+
+    monkeypatch.setattr(main.http_session, "request", fail)
+    monkeypatch.setitem(main.registry_guards, "test-registry", [main.TokenBucket(1000.0, 1000.0), main.CircuitBreaker(1, 60)])
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        main.call_upstream("GET", "http://registry.invalid", "registry", "test-registry", {})
+
+    _, breaker = main.registry_guard("test-registry")
+    assert breaker.status()["state"] == "open"
+    with pytest.raises(main.UpstreamUnavailable):
+        main.call_upstream("GET", "http://registry.invalid", "registry", "test-registry", {})
+
+
+class FakeResponse:
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+def test_deferred_purl_is_retried_with_its_own_session_once_the_breaker_closes(monkeypatch):
+    database = fakedb.FakeDatabase()
+    database.on("select count(*) from dm.dm_component", lambda sql, params: [(1,)])
+    database.on("select repourl, commitsha from dm.dm_purlcommit", lambda sql, params: [])
+    monkeypatch.setattr(main, "engine", database)
+    monkeypatch.setattr(main, "schema_ready", True)
+    monkeypatch.setattr(main, "breaker_reset_timeout", 0.1)
+
+    # the circuit for pypi is open when the purl comes in
+    breaker = main.CircuitBreaker(1, 0.1)
+    breaker.record_failure()
+    monkeypatch.setitem(main.registry_guards, "pypi", [main.TokenBucket(1000.0, 1000.0), breaker])
+
+    sessions = []
+    registry_calls = []
+
+    def get_component(purl_dhurl, purl_cookies, *args):
+        sessions.append((purl_dhurl, purl_cookies))
+        return [5, ""]
+
+    def registry(method, url, **kwargs):
+        registry_calls.append(url)
+        return FakeResponse(200, {"info": {"project_urls": {"Source": "https://github.com/psf/requests"}}})
+
+    monkeypatch.setattr(main, "get_component", get_component)
+    monkeypatch.setattr(main, "get_component_name", lambda *args: "GLOBAL.Open Source.pypi.requests;2_31_0")
+    monkeypatch.setattr(main, "update_component_attrs", lambda *args: [True, ""])
+    monkeypatch.setattr(main, "get_commit_sha", lambda repo_url, version: "abc123")
+    monkeypatch.setattr(main.http_session, "request", registry)
+    monkeypatch.setattr(main, "deferred_purls", main.DeferredPurls(10, 3))
+
+    purl = "pkg:pypi/requests@2.31.0"
+    assert main.create_compver("https://dh.example", {"token": "alice"}, purl)[0] is None
+    assert registry_calls == []
+
+    outcomes = []
+    retried = threading.Event()
+
+    def finished(finished_purl, created, error):
+        outcomes.append((finished_purl, created, error))
+        retried.set()
+
+    assert main.deferred_purls.defer("https://dh.example", {"token": "alice"}, purl, None, finished)
+    assert main.deferred_purls.status()["pending"] == 1
+    assert retried.wait(5)
+
+    assert outcomes == [(purl, True, "")]
+    assert registry_calls == ["https://pypi.org/pypi/requests/2.31.0/json"]
+    assert breaker.status()["state"] == "closed"
+    # the retry ran for the caller that deferred the purl, not the last request's globals
+    assert len(sessions) == 2
+    assert all(session == ("https://dh.example", {"token": "alice"}) for session in sessions)
+    assert main.deferred_purls.status() == {"pending": 0, "retried": 1, "dropped": 0}
+    assert database.executed("insert into dm.dm_purlcommit")[0] == (purl, "https://github.com/psf/requests", "abc123")
+
+
+def test_deferred_purl_gives_up_after_the_retry_limit(monkeypatch):
+    monkeypatch.setattr(main, "breaker_reset_timeout", 0.01)
+    monkeypatch.setattr(main, "create_compver", lambda *args: [None, "Circuit open for pypi"])
+    deferred = main.DeferredPurls(10, 2)
+    outcomes = []
+    finished = threading.Event()
+
+    def callback(purl, created, error):
+        outcomes.append((purl, created, error))
+        finished.set()
+
+    deferred.defer("https://dh.example", {}, "pkg:pypi/requests@2.31.0", None, callback)
+    assert finished.wait(5)
+    assert outcomes == [("pkg:pypi/requests@2.31.0", False, "Gave up after 2 retries: Circuit open for pypi")]
+    assert deferred.status()["retried"] == 2
+
+    full = main.DeferredPurls(1, 2)
+    assert full.defer("https://dh.example", {}, "pkg:pypi/a@1", None, None)
+    assert not full.defer("https://dh.example", {}, "pkg:pypi/b@1", None, None)
+    assert full.status()["dropped"] == 1
+    full.retry_timer.cancel()
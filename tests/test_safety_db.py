@@ -0,0 +1,146 @@
+import json
+import os
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+
+def old_safety_lookup(data, packagename, safety_id):
+    # the list scan the index replaced
+    for cve in data.get(packagename, []):
+        if cve["id"] == "pyup.io-" + safety_id:
+            cve_name = cve.get("cve")
+            cve_url = None
+            if cve_name is not None and cve_name.startswith("CVE"):
+                cve_url = "https://nvd.nist.gov/vuln/detail/" + cve_name
+            return (cve_name, cve_url)
+    return None
+
+
+def test_index_safety_db_matches_list_scan():
+    data = {
+        "$meta": {"advisory": "meta", "timestamp": 1},
+        "django": [
+            {"id": "pyup.io-1001", "cve": "CVE-2020-0001", "advisory": "first"},
+            {"id": "pyup.io-1001", "cve": "CVE-2020-9999", "advisory": "duplicate id"},
+            {"id": "pyup.io-1002", "cve": "PVE-2021-1002"},
+            {"id": "pyup.io-1003", "cve": None},
+        ],
+        "flask": [{"id": "pyup.io-2001", "cve": "CVE-2019-1010083"}],
+        "empty": [],
+    }
+    index = main.index_safety_db(data)
+
+    for packagename, safety_id in [("django", "1001"), ("django", "1002"), ("django", "1003"), ("flask", "2001"), ("flask", "1001"), ("missing", "1")]:
+        assert index.get((packagename, safety_id)) == old_safety_lookup(data, packagename, safety_id)
+    assert len(index) == 4
+
+
+def test_package_names_match_however_they_are_spelled():
+    data = {
+        "Django_REST.framework": [{"id": "pyup.io-3001", "cve": "CVE-2020-3001"}],
+        "django-rest-framework": [{"id": "pyup.io-3001", "cve": "CVE-2099-0000"}, {"id": "pyup.io-3002", "cve": "PVE-2021-3002"}],
+    }
+    database = main.SafetyDb("http://safety.invalid/insecure_full.json", "unused", 3600)
+    database.index = main.index_safety_db(data)
+
+    assert set(database.index) == {("django-rest-framework", "3001"), ("django-rest-framework", "3002")}
+    for packagename in ["django-rest-framework", "Django_Rest_Framework", "django.rest.framework", "DJANGO--REST__FRAMEWORK"]:
+        assert database.get((packagename, "3001")) == ("CVE-2020-3001", "https://nvd.nist.gov/vuln/detail/CVE-2020-3001")
+        assert database.get((packagename, "3002")) == ("PVE-2021-3002", None)
+    assert database.get(("djangorestframework", "3001")) is None
+
+
+class SlowDownload:
+    """
+    Stands in for http_request, holding each download until the test releases it.
+    """
+
+    def __init__(self):
+        self.started = threading.Semaphore(0)
+        self.release = threading.Event()
+
+    def __call__(self, method, url, kind, **kwargs):
+        self.started.release()
+        self.release.wait(5)
+        return SimpleNamespace(status_code=200, content=json.dumps({"django": [{"id": "pyup.io-1001", "cve": "CVE-2020-0001"}]}).encode("utf-8"), headers={})
+
+
+def refresh_threads():
+    return [thread for thread in threading.enumerate() if thread.name == "safety-db-refresh"]
+
+
+@pytest.fixture
+def safety(tmp_path, monkeypatch):
+    download = SlowDownload()
+    monkeypatch.setattr(main, "http_request", download)
+    database = main.SafetyDb("http://safety.invalid/insecure_full.json", str(tmp_path / "insecure_full.json"), 3600)
+    writes = []
+    original_write = database.write_snapshot
+    monkeypatch.setattr(database, "write_snapshot", lambda content: writes.append(content) or original_write(content))
+    yield database, download, writes
+    database.stop()
+    download.release.set()
+
+
+def test_start_twice_runs_one_refresher(safety):
+    database, download, _ = safety
+    before = len(refresh_threads())
+
+    starters = [threading.Thread(target=database.start) for _ in range(8)]
+    for starter in starters:
+        starter.start()
+    for starter in starters:
+        starter.join()
+
+    assert download.started.acquire(timeout=5)
+    assert len(refresh_threads()) == before + 1
+    assert not download.started.acquire(timeout=0.1)
+
+
+def test_stop_during_download_writes_nothing(safety):
+    database, download, writes = safety
+    database.start()
+    assert download.started.acquire(timeout=5)
+    thread = database.thread
+
+    database.stop()
+    download.release.set()
+    thread.join(5)
+
+    assert not thread.is_alive()
+    assert writes == []
+    assert database.index is None
+    assert not os.path.exists(database.snapshot)
+
+
+def test_restart_after_stop_leaves_no_orphan(safety):
+    database, download, writes = safety
+    database.start()
+    assert download.started.acquire(timeout=5)
+    first = database.thread
+
+    database.stop()
+    database.start()
+    assert download.started.acquire(timeout=5)
+    second = database.thread
+
+    download.release.set()
+    first.join(5)
+    assert not first.is_alive()
+    assert database.wait_ready(5)
+    assert second.is_alive()
+    assert len(writes) == 1
+    assert database.get(("django", "1001")) == ("CVE-2020-0001", "https://nvd.nist.gov/vuln/detail/CVE-2020-0001")
+
+
+def test_wait_ready_does_not_restart_after_stop(safety):
+    database, download, _ = safety
+    database.stop()
+
+    assert not database.wait_ready(0.1)
+    assert database.thread is None
+    assert not download.started.acquire(timeout=0.1)
@@ -0,0 +1,43 @@
+import io
+import json
+
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 64, 65536])
+def test_iter_json_array_matches_json_load(monkeypatch, chunk_size):
+    document = {
+        "bomFormat": "CycloneDX",
+        "metadata": {"component": {"name": "app", "tags": ["a", "b"]}},
+        "dependencies": [{"ref": "x", "dependsOn": ["y"] * 50}],
+        "components": [
+            {"name": "é-unicode", "version": "1.0", "score": 12345.678e-3, "count": 1234567890, "neg": -0.5, "ok": True, "none": None},
+            {"name": 'esc"aped\\\n', "licenses": [{"license": {"id": "MIT"}}], "big": 98765432109876543210},
+            7,
+            "string",
+        ],
+        "trailer": 42,
+    }
+    monkeypatch.setattr(main, "sbom_chunk_size", chunk_size)
+    data = json.dumps(document, indent=2).encode("utf-8")
+
+    assert list(main.iter_json_array(io.BytesIO(data), "components")) == document["components"]
+    assert list(main.iter_json_array(io.BytesIO(json.dumps(document["components"]).encode("utf-8")))) == document["components"]
+    assert list(main.iter_json_array(io.BytesIO(data), "missing")) == []
+
+
+def test_iter_json_array_handles_bom_and_empty_documents(monkeypatch):
+    monkeypatch.setattr(main, "sbom_chunk_size", 3)
+    assert list(main.iter_json_array(io.BytesIO(b"\xef\xbb\xbf[1, 2.5, 300]"))) == [1, 2.5, 300]
+    assert list(main.iter_json_array(io.BytesIO(b"[]"))) == []
+    assert list(main.iter_json_array(io.BytesIO(b"{}"), "packages")) == []
+
+
+def test_iter_json_array_rejects_malformed_documents(monkeypatch):
+    monkeypatch.setattr(main, "sbom_chunk_size", 4)
+    with pytest.raises(ValueError):
+        list(main.iter_json_array(io.BytesIO(b'[1, 2 "three"]')))
+    with pytest.raises(ValueError):
+        list(main.iter_json_array(io.BytesIO(b'{"packages": [1, 2'), "packages"))
@@ -0,0 +1,71 @@
+import os
+
+import fakedb
+import psycopg2
+import pytest
+
+import main
+
+
+def denied(sql, params):
+    raise psycopg2.ProgrammingError("permission denied for schema dm")
+
+
+@pytest.fixture
+def schema(monkeypatch):
+    monkeypatch.setattr(main, "schema_ready", False)
+    monkeypatch.setattr(main, "persistent_caches", True)
+    database = fakedb.FakeDatabase()
+    monkeypatch.setattr(main, "engine", database)
+    return database
+
+
+def test_only_missing_tables_are_created(schema):
+    schema.on("select to_regclass", lambda sql, params: [(params[0] if params[0] != "dm.dm_vulnsweep" else None,)])
+
+    assert main.ensure_schema()
+    assert main.ensure_schema()
+
+    assert len(schema.executed("to_regclass")) == 3
+    assert len(schema.executed("create table")) == 1
+    assert [sql for sql, _ in schema.statements if "create table" in sql] == [" ".join(main.schema_ddl["dm.dm_vulnsweep"].split())]
+
+
+def test_ddl_failure_turns_off_the_commit_cache(schema, monkeypatch):
+    schema.on("select to_regclass", lambda sql, params: [(None,)]).on("create table", denied)
+    monkeypatch.setattr(main, "getCommitFromPurl", lambda *args: {"repo_url": "https://github.com/psf/requests", "commit_sha": "abc"})
+    record = main.parse_purl("pkg:pypi/requests@2.31.0")
+
+    assert main.get_commit_from_purl_cached(record, "pkg:pypi/requests@2.31.0")["commit_sha"] == "abc"
+    assert main.get_commit_from_purl_cached(record, "pkg:pypi/requests@2.31.0")["commit_sha"] == "abc"
+
+    assert not main.persistent_caches
+    assert main.sweep_status()["persistent_caches"] is False
+    # the DDL is tried once and the cache table is never touched
+    assert len(schema.executed("create table")) == 1
+    assert schema.executed("dm_purlcommit") == []
+
+
+def test_lost_connection_is_retried(schema):
+    attempts = []
+
+    def flaky(sql, params):
+        attempts.append(params)
+        if len(attempts) == 1:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        return [(params[0],)]
+
+    schema.on("select to_regclass", flaky)
+
+    assert not main.ensure_schema()
+    assert main.persistent_caches
+    assert main.ensure_schema()
+
+
+def test_migration_matches_schema_ddl():
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "chart", "ms-dep-pkg-cud", "sql", "dm_deppkg_tables.sql")
+    with open(path, mode="r", encoding="utf-8") as sql_file:
+        migration = " ".join(line for line in sql_file.read().splitlines() if not line.startswith("--")).split()
+
+    for sqlstmt in main.schema_ddl.values():
+        assert " ".join(sqlstmt.split()) + ";" in " ".join(migration)
@@ -0,0 +1,38 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import main
+
+
+class FakeResponse:
+    status_code = 200
+
+
+def test_request_path_calls_do_not_wait_on_deployhub_enrichment(monkeypatch):
+    monkeypatch.setattr(main.http_session, "request", lambda method, url, **kwargs: FakeResponse())
+    monkeypatch.setattr(main, "validateuser_cache", main.TTLCache(10, 60))
+    busy = threading.BoundedSemaphore(1)
+    monkeypatch.setattr(main, "upstream_semaphores", {"deployhub": busy})
+
+    # enrichment has every DeployHub slot
+    busy.acquire()
+    released = False
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        try:
+            enrichment = pool.submit(main.http_request, "GET", "https://dh.example/dmadminweb/API/component/1", "deployhub")
+            probe = pool.submit(main.resolve_dhurl, "http", "dh.example")
+            validate = pool.submit(main.validate_user, {"token": "alice"})
+
+            assert probe.result(timeout=2) == "https://dh.example"
+            assert validate.result(timeout=2) == 200
+            assert not enrichment.done()
+
+            busy.release()
+            released = True
+            assert enrichment.result(timeout=2).status_code == 200
+        finally:
+            if not released:
+                busy.release()
+
+    assert main.upstream_for("https://dh.example", "probe") == "probe"
+    assert main.upstream_for(main.validateuser_url + "/msapi/validateuser", "validateuser") == "validateuser"
@@ -0,0 +1,175 @@
+import time
+
+import fakedb
+import psycopg2
+import pytest
+import requests
+
+import main
+
+
+def sweep_database(rows, lastpurl=None):
+    """
+    A fake with the tables a vulnerability sweep reads and writes.
+
+    rows are the (compid, packagename, packageversion, purl) license rows of dm.dm_componentdeps.
+    """
+    database = fakedb.FakeDatabase()
+    database.vulns = []
+    database.scanned = set()
+    database.sweeps = {}
+    if lastpurl is not None:
+        database.sweeps["full"] = {"lastpurl": lastpurl, "finished": False}
+
+    def unfinished(sql, params):
+        sweep = database.sweeps.get("full")
+        return [(sweep["lastpurl"],)] if sweep is not None and not sweep["finished"] else []
+
+    def start(sql, params):
+        database.sweeps[params[0]] = {"lastpurl": None, "finished": False}
+
+    def checkpoint(sql, params):
+        lastpurl, finished, sweep = params
+        if lastpurl is not None:
+            database.sweeps[sweep]["lastpurl"] = lastpurl
+        if finished:
+            database.sweeps[sweep]["finished"] = True
+
+    def select(sql, params):
+        packages = sorted({(row[1], row[2], row[3]) for row in rows}, key=lambda row: row[2])
+        if "make_interval" in sql:
+            compids, _ = params
+            stale = {row[3] for row in rows if row[0] in compids or row[3] not in database.scanned}
+            return [row for row in packages if row[2] in stale]
+        if params is not None:
+            return [row for row in packages if row[2] > params[0]]
+        return packages
+
+    def insert_vulns(sql, params):
+        database.vulns.extend(params)
+        return len(params)
+
+    def mark_scanned(sql, params):
+        database.scanned.update(params[0])
+
+    database.on("select lastpurl from dm.dm_vulnsweep", unfinished)
+    database.on("insert into dm.dm_vulnsweep", start)
+    database.on("update dm.dm_vulnsweep", checkpoint)
+    database.on("select distinct", select)
+    database.on("insert into dm.dm_vulns ", insert_vulns)
+    database.on("insert into dm.dm_vulnscan", mark_scanned)
+    return database
+
+
+def osv_record(vulnid, purl, version):
+    return {"id": vulnid, "modified": "2024-01-01T00:00:00Z", "summary": "bad", "affected": [{"package": {"purl": purl}, "versions": [version]}]}
+
+
+def run_sweep(scheduler, start):
+    finished = scheduler.status()["completed"] + scheduler.status()["failed"]
+    start()
+    for _ in range(500):
+        sweep_status = scheduler.status()
+        if not sweep_status["running"] and sweep_status["completed"] + sweep_status["failed"] > finished:
+            return sweep_status["last"]
+        time.sleep(0.01)
+    raise AssertionError("sweep did not finish")
+
+
+@pytest.fixture
+def sweep(monkeypatch, osv):
+    monkeypatch.setattr(main, "schema_ready", True)
+    monkeypatch.setattr(main, "execute_values", fakedb.execute_values)
+    monkeypatch.setattr(main, "dhurl", "")
+    monkeypatch.setattr(main, "cookies", {})
+    monkeypatch.setattr(main, "osv_batch_size", 2)
+    return main.VulnSweepScheduler(100)
+
+
+packages = [(1, name, "1.0", f"pkg:pypi/{name}@1.0") for name in ["a", "b", "c", "d"]]
+
+
+def test_resume_without_a_session_only_sweeps_osv(sweep, osv, monkeypatch):
+    database = sweep_database(packages, lastpurl="pkg:pypi/b@1.0")
+    monkeypatch.setattr(main, "engine", database)
+    osv.vulns["PYSEC-1"] = osv_record("PYSEC-1", "pkg:pypi/c", "1.0")
+    enriched = []
+    monkeypatch.setattr(main, "create_compver", lambda *args: enriched.append(args) or [True, ""])
+
+    last = run_sweep(sweep, sweep.resume)
+
+    assert last["status"] == "completed"
+    assert last["resumed_after"] == "pkg:pypi/b@1.0"
+    assert last["enrichment_skipped"] == 2
+    assert enriched == []
+    # only OSV was called, nothing went to DeployHub with the empty startup globals
+    assert {call[0] for call in osv.calls} == {"osv_batch", "osv"}
+    assert database.scanned == {"pkg:pypi/c@1.0", "pkg:pypi/d@1.0"}
+    assert [row[3] for row in database.vulns] == ["PYSEC-1"]
+    assert database.sweeps["full"] == {"lastpurl": "pkg:pypi/d@1.0", "finished": True}
+
+
+def test_sweep_enriches_with_the_session_of_the_last_request(sweep, osv, monkeypatch):
+    database = sweep_database(packages)
+    database.on("from dm.dm_component a, dm.dm_domain b", lambda sql, params: [])
+    monkeypatch.setattr(main, "engine", database)
+    monkeypatch.setattr(main, "dhurl", "https://dh.example")
+    monkeypatch.setattr(main, "cookies", {"token": "alice"})
+    enriched = []
+    monkeypatch.setattr(main, "create_compver", lambda *args: enriched.append(args[:3]) or [True, ""])
+
+    last = run_sweep(sweep, sweep.request)
+
+    assert last["status"] == "completed"
+    assert sorted(enriched) == [("https://dh.example", {"token": "alice"}, row[3]) for row in packages]
+
+
+def test_full_sweep_resumes_after_the_last_checkpoint(sweep, osv, monkeypatch):
+    database = sweep_database(packages)
+    monkeypatch.setattr(main, "engine", database)
+    osv_request = main.http_request
+
+    def osv_down_for_c(method, url, kind, **kwargs):
+        queries = (kwargs.get("json") or {}).get("queries", [])
+        if any("pkg:pypi/c" in str(query) for query in queries):
+            raise requests.exceptions.ConnectionError("OSV unavailable")
+        return osv_request(method, url, kind, **kwargs)
+
+    monkeypatch.setattr(main, "http_request", osv_down_for_c)
+    last = run_sweep(sweep, sweep.request)
+
+    # the batch with c failed so the checkpoint stays after the last batch that was fully scanned
+    assert last["status"] == "completed"
+    assert database.sweeps["full"] == {"lastpurl": "pkg:pypi/b@1.0", "finished": False}
+    assert database.scanned == {"pkg:pypi/a@1.0", "pkg:pypi/b@1.0"}
+
+    monkeypatch.setattr(main, "http_request", osv_request)
+    last = run_sweep(sweep, sweep.resume)
+    assert last["resumed_after"] == "pkg:pypi/b@1.0"
+    assert database.sweeps["full"] == {"lastpurl": "pkg:pypi/d@1.0", "finished": True}
+    assert database.scanned == {row[3] for row in packages}
+
+
+def denied(sql, params):
+    raise psycopg2.ProgrammingError("permission denied for schema dm")
+
+
+def test_sweep_without_bookkeeping_tables_scans_everything(sweep, osv, monkeypatch):
+    database = sweep_database(packages, lastpurl="pkg:pypi/b@1.0")
+    database.on("select to_regclass", lambda sql, params: [(None,)])
+    database.on("create table", denied)
+    monkeypatch.setattr(main, "engine", database)
+    monkeypatch.setattr(main, "schema_ready", False)
+    monkeypatch.setattr(main, "persistent_caches", True)
+    monkeypatch.setattr(main, "vuln_sweep_mode", "delta")
+    osv.vulns["PYSEC-1"] = osv_record("PYSEC-1", "pkg:pypi/a", "1.0")
+
+    sweep.resume()
+    last = run_sweep(sweep, lambda: sweep.request(1))
+
+    assert last["status"] == "completed"
+    assert last["processed"] == 4
+    assert [row[3] for row in database.vulns] == ["PYSEC-1"]
+    # no watermarks, checkpoints or delta join against the missing tables
+    used = [sql for sql, _ in database.statements if "create table" not in sql]
+    assert not [sql for sql in used if "dm_vulnscan" in sql or "dm_vulnsweep" in sql]